@@ -0,0 +1,366 @@
+"""
+Benchmark for the Hough transform functions in ps2.py.
+
+Generates synthetic scenes with a known number of lines and circles, edge noise and image size, then times
+each stage of the Hough subsystem (accumulators, peak detection and circle finding). For every stage it
+reports the run time, throughput in edge pixels/sec and megapixels/sec, the accumulator size and the peak
+memory growth of the process that ran it. The detected lines and circles are checked against the planted
+ones, and the faster variants are checked against the stage they replace: their lines must agree with the
+peaks of hough_lines_acc and the streaming find_circles must find the same circles as the 3-D one.
+
+Each stage runs in a fresh worker process so its peak memory is not hidden by the previous stages.
+
+How to run:
+python benchmark.py [--sizes 512x512 1080x1920] [--lines 8] [--circles 6] [--radii 15 30] [--noise 0.002]
+                    [--min-agreement 0.75]
+"""
+
+import argparse
+import math
+import multiprocessing
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import ps2
+
+
+def make_scene(shape, n_lines=8, n_circles=6, radius_range=(15, 30), noise_density=0.002, seed=None):
+    """Generates a synthetic scene with known lines and circles.
+
+    The edge image has the one pixel wide lines and circle outlines plus noise edge pixels. In the grayscale
+    image each line is a step between its two half planes and the circles are filled in, so that its gradients
+    are normal to the lines and point to the circle centers, as the theta_window and 'point plus' methods
+    expect.
+
+    Args:
+        shape (tuple): image shape (rows, cols).
+        n_lines (int): number of lines crossing the image.
+        n_circles (int): number of circles, fully inside the image.
+        radius_range (tuple): minimum and maximum (inclusive) circle radius.
+        noise_density (float): fraction of the pixels set as noise edges.
+        seed (int): random seed. Default set to None.
+
+    Returns:
+        dict: 'img' (uint8 grayscale image), 'edges' (uint8 edge image with values 0 or 255),
+              'lines' (n_lines x 2 array of [rho, theta]) and 'circles' (n_circles x 3 array of
+              [row_id, col_id, radius]).
+    """
+    rng = np.random.RandomState(seed)
+    row_size, col_size = shape
+    edges = np.zeros(shape, dtype=np.uint8)
+    grid_rows, grid_cols = np.mgrid[:row_size, :col_size]
+    steps = np.zeros(shape)
+
+    # lines through a random point of the image with a random normal angle in [0, pi)
+    theta = rng.uniform(0, np.pi, n_lines)
+    x0, y0 = rng.uniform(0, col_size, n_lines), rng.uniform(0, row_size, n_lines)
+    rho = x0 * np.cos(theta) + y0 * np.sin(theta)
+    length = 2 * (row_size + col_size)
+    for x, y, t in zip(x0, y0, theta):
+        p1 = (int(round(x - length * math.sin(t))), int(round(y + length * math.cos(t))))
+        p2 = (int(round(x + length * math.sin(t))), int(round(y - length * math.cos(t))))
+        cv2.line(edges, p1, p2, 255, 1)
+    for r, t in zip(rho, theta):
+        steps += grid_cols * math.cos(t) + grid_rows * math.sin(t) > r
+    img = (60 + 120 * steps / max(1, n_lines)).astype(np.uint8)
+
+    radius = rng.randint(radius_range[0], radius_range[1] + 1, n_circles)
+    center_row = (radius + 1 + rng.rand(n_circles) * (row_size - 2 * radius - 2)).astype(int)
+    center_col = (radius + 1 + rng.rand(n_circles) * (col_size - 2 * radius - 2)).astype(int)
+    for r, a, b in zip(radius, center_row, center_col):
+        cv2.circle(img, (int(b), int(a)), int(r), 200, -1)
+        cv2.circle(edges, (int(b), int(a)), int(r), 255, 1)
+
+    noise = rng.rand(*shape) < noise_density
+    edges[noise] = 255
+
+    return {
+        'img': cv2.GaussianBlur(img, (9, 9), 0),
+        'edges': edges,
+        'lines': np.column_stack((rho, theta)),
+        'circles': np.column_stack((center_row, center_col, radius)).astype(np.float64),
+    }
+
+
+def match_lines(found, truth, rho_tol=6., theta_tol=np.pi / 90):
+    """Returns the precision and recall of the detected lines.
+
+    Args:
+        found (numpy.array): detected lines, array of shape Q x 2 of [rho, theta].
+        truth (numpy.array): planted lines, array of shape N x 2 of [rho, theta].
+        rho_tol (float): maximum rho difference (in pixels).
+        theta_tol (float): maximum theta difference (in radians).
+
+    Returns:
+        tuple: (precision, recall).
+    """
+    if len(found) == 0 or len(truth) == 0:
+        return 0., 0.
+    d_theta = found[:, np.newaxis, 1] - truth[np.newaxis, :, 1]
+    d_rho = found[:, np.newaxis, 0] - truth[np.newaxis, :, 0]
+    # (rho, theta) and (-rho, theta +/- pi) are the same line
+    same = (np.abs(d_theta) <= theta_tol) & (np.abs(d_rho) <= rho_tol)
+    flipped = (np.abs(np.abs(d_theta) - np.pi) <= theta_tol) & \
+              (np.abs(found[:, np.newaxis, 0] + truth[np.newaxis, :, 0]) <= rho_tol)
+    hits = same | flipped
+    return hits.any(axis=1).mean(), hits.any(axis=0).mean()
+
+
+def match_circles(found, truth, center_tol=3., radius_tol=2.):
+    """Returns the precision and recall of the detected circles.
+
+    Args:
+        found (numpy.array): detected circles, array of shape Q x 3 of [row_id, col_id, radius].
+        truth (numpy.array): planted circles, array of shape N x 3 of [row_id, col_id, radius].
+        center_tol (float): maximum center distance (in pixels).
+        radius_tol (float): maximum radius difference (in pixels).
+
+    Returns:
+        tuple: (precision, recall).
+    """
+    if len(found) == 0 or len(truth) == 0:
+        return 0., 0.
+    distance = np.hypot(found[:, np.newaxis, 0] - truth[np.newaxis, :, 0],
+                        found[:, np.newaxis, 1] - truth[np.newaxis, :, 1])
+    hits = (distance <= center_tol) & (np.abs(found[:, np.newaxis, 2] - truth[np.newaxis, :, 2]) <= radius_tol)
+    return hits.any(axis=1).mean(), hits.any(axis=0).mean()
+
+
+def _peaks_to_lines(peaks, rho, theta):
+    if len(peaks) == 0:
+        return np.zeros((0, 2))
+    return np.column_stack((rho[peaks[:, 0]], theta[peaks[:, 1]]))
+
+
+def _lines_peaks(H, scene, config):
+    # the peaks every lines accumulator is compared with, see the hough_peaks_nms stage
+    peaks = ps2.hough_peaks_nms(H, config['lines_threshold'], config['nhood_delta'], max_peaks=len(scene['lines']))
+    return _peaks_to_lines(peaks, scene['rho'], scene['theta'])
+
+
+def _segments_to_lines(segments):
+    if len(segments) == 0:
+        return np.zeros((0, 2))
+    x1, y1, x2, y2 = np.asarray(segments, dtype=np.float64).T
+    theta = np.mod(np.arctan2(x1 - x2, y2 - y1), np.pi)
+    return np.column_stack((x1 * np.cos(theta) + y1 * np.sin(theta), theta))
+
+
+# Stages: each one takes the scene and the benchmark config and returns a dict with any of 'lines', 'circles',
+# 'acc_bytes' (accumulator size) and 'H' (a lines accumulator, its peaks are found after the stage is timed).
+def stage_lines_acc(scene, config):
+    H, rho, theta = ps2.hough_lines_acc(scene['edges'])
+    return {'acc_bytes': H.nbytes}
+
+
+def stage_lines_acc_window(scene, config):
+    H, rho, theta = ps2.hough_lines_acc(scene['edges'], img_orig=scene['img'], theta_window=config['theta_window'])
+    return {'acc_bytes': H.nbytes, 'H': H}
+
+
+def stage_lines_acc_pyramid(scene, config):
+    H, rho, theta = ps2.hough_lines_acc_pyramid(scene['edges'], levels=config['levels'],
+                                                hough_threshold=config['pyramid_threshold'])
+    return {'acc_bytes': H.nbytes, 'H': H}
+
+
+def stage_lines_random(scene, config):
+    H, rho, theta, segments = ps2.hough_lines_random(scene['edges'], seed=0)
+    return {'acc_bytes': H.nbytes, 'lines': _segments_to_lines(segments)}
+
+
+def stage_hough_peaks(scene, config):
+    peaks = ps2.hough_peaks(scene['H'], config['lines_threshold'], config['nhood_delta'])
+    return {'lines': _peaks_to_lines(peaks[:len(scene['lines'])], scene['rho'], scene['theta'])}
+
+
+def stage_hough_peaks_nms(scene, config):
+    return {'lines': _lines_peaks(scene['H'], scene, config)}
+
+
+def stage_circles_acc(scene, config):
+    H = ps2.hough_circles_acc(scene['img'], scene['edges'], config['radii'][len(config['radii']) // 2])
+    return {'acc_bytes': H.nbytes}
+
+
+def stage_circles_volume(scene, config):
+    H = ps2.hough_circles_volume(scene['img'], scene['edges'], config['radii'])
+    return {'acc_bytes': H.nbytes}
+
+
+def stage_find_circles(scene, config):
+    circles = ps2.find_circles(scene['img'], scene['edges'], config['radii'], config['circles_threshold'],
+                               config['nhood_delta'])
+    return {'circles': circles}
+
+
+def stage_find_circles_streaming(scene, config):
+    # the 3-D accumulator alone takes max_bytes, so find_circles has to stream the radii whatever its dtype
+    circles = ps2.find_circles(scene['img'], scene['edges'], config['radii'], config['circles_threshold'],
+                               config['nhood_delta'], max_bytes=scene['volume_bytes'])
+    return {'circles': circles}
+
+
+# (name, stage, baseline): the lines of a stage with a 'hough_lines_acc' baseline must agree with the peaks of
+# hough_lines_acc, the circles of a stage with a 'find_circles' baseline must be the ones of that stage.
+STAGES = [
+    ('hough_lines_acc', stage_lines_acc, None),
+    ('hough_lines_acc theta_window', stage_lines_acc_window, 'hough_lines_acc'),
+    ('hough_lines_acc_pyramid', stage_lines_acc_pyramid, 'hough_lines_acc'),
+    ('hough_lines_random', stage_lines_random, 'hough_lines_acc'),
+    ('hough_peaks', stage_hough_peaks, None),
+    ('hough_peaks_nms', stage_hough_peaks_nms, None),
+    ('hough_circles_acc', stage_circles_acc, None),
+    ('hough_circles_volume', stage_circles_volume, None),
+    ('find_circles', stage_find_circles, None),
+    ('find_circles max_bytes', stage_find_circles_streaming, 'find_circles'),
+]
+
+
+def _max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _run_stage(job):
+    """Worker process: runs a stage and measures its time and peak memory growth."""
+    stage, scene, config, repeat = job
+    start_rss = _max_rss_bytes()
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = stage(scene, config)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    mem_bytes = _max_rss_bytes() - start_rss
+    if 'H' in result:
+        result['lines'] = _lines_peaks(result.pop('H'), scene, config)
+    return best, mem_bytes, result
+
+
+def run_benchmark(sizes, n_lines=8, n_circles=6, radius_range=(15, 30), noise_density=0.002, repeat=1, seed=0,
+                  stages=None, min_agreement=0.75):
+    """Runs every stage on a synthetic scene of each size and prints a report.
+
+    A stage with a hough_lines_acc baseline agrees with it on the fraction of the planted lines found by the
+    peaks of hough_lines_acc that it also finds (a peak on noise is not expected to be reproduced). A stage with
+    a find_circles baseline agrees with it when it finds the same circles.
+
+    Args:
+        sizes (list): list of image shapes (rows, cols).
+        n_lines (int): number of planted lines.
+        n_circles (int): number of planted circles.
+        radius_range (tuple): minimum and maximum (inclusive) circle radius.
+        noise_density (float): fraction of the pixels set as noise edges.
+        repeat (int): number of runs of each stage, the best time is reported.
+        seed (int): random seed for the scenes.
+        stages (list): names of the stages to run. Default set to None (all of them).
+        min_agreement (float): least agreement of a stage with its baseline.
+
+    Returns:
+        list: one dict per (size, stage) with the measurements.
+
+    Raises:
+        AssertionError: if a stage agrees with its baseline on less than min_agreement.
+    """
+    config = {
+        'radii': list(range(radius_range[0], radius_range[1] + 1)),
+        'theta_window': 5,
+        'levels': 2,
+        # the coarse pass ranks the lines differently, see hough_lines_acc_pyramid
+        'pyramid_threshold': 50,
+        'lines_threshold': 40,
+        'circles_threshold': 200,
+        'nhood_delta': (5, 5),
+    }
+    report = []
+    header = "{:>11} {:<30} {:>9} {:>12} {:>9} {:>10} {:>9} {:>11} {:>6}".format(
+        'size', 'stage', 'time (s)', 'edge px/s', 'MP/s', 'acc (MB)', 'mem (MB)', 'prec/recall', 'agree')
+    print(header)
+    print('-' * len(header))
+
+    for shape in sizes:
+        scene = make_scene(shape, n_lines, n_circles, radius_range, noise_density, seed)
+        scene['H'], scene['rho'], scene['theta'] = ps2.hough_lines_acc(scene['edges'])
+        accumulator = ps2.hough_circles_acc(scene['img'], scene['edges'], config['radii'][0])
+        scene['volume_bytes'] = accumulator.nbytes * len(config['radii'])
+        edge_count = np.count_nonzero(scene['edges'])
+        megapixels = shape[0] * shape[1] / 1e6
+
+        # the lines of hough_lines_acc that are planted lines, and the results of the baseline stages
+        baseline_lines = _lines_peaks(scene['H'], scene, config)
+        baseline_lines = baseline_lines[[match_lines(line[np.newaxis], scene['lines'])[0] == 1.
+                                         for line in baseline_lines]]
+        baselines = {'hough_lines_acc': baseline_lines}
+
+        for name, stage, baseline in STAGES:
+            if stages is not None and name not in stages:
+                continue
+            pool = multiprocessing.Pool(1)
+            try:
+                seconds, mem_bytes, result = pool.apply(_run_stage, ((stage, scene, config, repeat),))
+            finally:
+                pool.close()
+                pool.join()
+            lines, circles, acc_bytes = result.get('lines'), result.get('circles'), result.get('acc_bytes', 0)
+            if circles is not None:
+                baselines[name] = circles
+
+            accuracy = ''
+            if lines is not None:
+                accuracy = "{:.2f}/{:.2f}".format(*match_lines(lines, scene['lines']))
+            elif circles is not None:
+                accuracy = "{:.2f}/{:.2f}".format(*match_circles(circles, scene['circles']))
+
+            agreement = None
+            if baseline == 'hough_lines_acc':
+                agreement = match_lines(lines, baseline_lines)[1] if len(baseline_lines) > 0 else 1.
+            elif baseline in baselines:
+                agreement = float(np.array_equal(circles, baselines[baseline]))
+
+            row = {
+                'size': shape, 'stage': name, 'seconds': seconds, 'edge_pixels': edge_count,
+                'edge_pixels_per_sec': edge_count / max(seconds, 1e-9),
+                'megapixels_per_sec': megapixels / max(seconds, 1e-9),
+                'accumulator_bytes': acc_bytes, 'peak_memory_bytes': mem_bytes, 'accuracy': accuracy,
+                'agreement': agreement,
+            }
+            report.append(row)
+            print("{:>11} {:<30} {:>9.4f} {:>12.0f} {:>9.2f} {:>10.2f} {:>9.1f} {:>11} {:>6}".format(
+                "{}x{}".format(*shape), name, seconds, row['edge_pixels_per_sec'], row['megapixels_per_sec'],
+                acc_bytes / 1e6, mem_bytes / 1e6, accuracy, '' if agreement is None else "{:.2f}".format(agreement)))
+            if agreement is not None and agreement < min_agreement:
+                raise AssertionError("{} agrees with {} on {:.2f} of the {}x{} scene, expected at least {:.2f}".format(
+                    name, baseline, agreement, shape[0], shape[1], min_agreement))
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the Hough transform functions in ps2.py.')
+    parser.add_argument('--sizes', nargs='+', default=['256x256', '512x512', '1080x1920'],
+                        help='image sizes as ROWSxCOLS')
+    parser.add_argument('--lines', type=int, default=8, help='number of planted lines')
+    parser.add_argument('--circles', type=int, default=6, help='number of planted circles')
+    parser.add_argument('--radii', type=int, nargs=2, default=[15, 30], help='circle radius range (inclusive)')
+    parser.add_argument('--noise', type=float, default=0.002, help='fraction of noise edge pixels')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the best time is reported')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--stages', nargs='+', default=None, help='names of the stages to run')
+    parser.add_argument('--min-agreement', type=float, default=0.75,
+                        help='least agreement of a faster stage with the stage it replaces')
+
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.lower().split('x')) for size in args.sizes]
+    run_benchmark(sizes, args.lines, args.circles, tuple(args.radii), args.noise, args.repeat, args.seed,
+                  args.stages, args.min_agreement)
+
+
+if __name__ == '__main__':
+    main()
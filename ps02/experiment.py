@@ -144,7 +144,8 @@ def normalize_and_scale(img_in):
     Returns:
         numpy.array: output image with pixel values in [0, 255]
     """
-    return cv2.normalize(img_in, 0, 255, norm_type=cv2.NORM_MINMAX)
+    # Hough accumulators use compact unsigned types (i.e. uint32) that cv2.normalize does not support
+    return cv2.normalize(img_in.astype(np.float64), 0, 255, norm_type=cv2.NORM_MINMAX)
 
 
 def part_1(save_imgs=True):
@@ -264,7 +265,7 @@ def part_4b():
     # Use hough_circles_acc with the 'point plus' method
     radius = 75
     H = hough_circles_acc(test_circle, test_circle_edges, radius)
-    cv2.imwrite(os.path.join(output_dir, 'ps2-4-b-1-H.png'), H)
+    cv2.imwrite(os.path.join(output_dir, 'ps2-4-b-1-H.png'), normalize_and_scale(H))
 
     hough_threshold = 100  # You may have to try different values
     nhood_delta = (1, 1)  # You may have to try different values
@@ -0,0 +1,230 @@
+"""
+Batch edge detection and Hough transform pipeline.
+
+Runs the same chain used in experiment.py (get_smoothed_image -> get_edge_image -> hough_* -> peaks) over a
+directory or glob of images using a process pool. The results of each image are written to disk as soon as
+they are ready, one .npz file per image (under the same sub-directories as in the source) containing:
+
+    lines: array of shape Q x 2 where each row is a [rho, theta] pair.
+    circles: array of shape N x 3 where each row is a [row_id, col_id, radius] triple.
+
+How to run:
+python pipeline.py <directory or glob> --output <output directory> [--params params.json] [--processes N]
+
+The params file is a JSON object that overrides any value in DEFAULT_PARAMS.
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from experiment import get_edge_image, get_smoothed_image
+from ps2 import find_circles, hough_lines_acc, hough_peaks_nms
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+DEFAULT_PARAMS = {
+    # smoothing and edges
+    'ksize': (13, 13),
+    'sigma': 0,
+    'threshold1': 28,
+    'threshold2': 115,
+    # lines
+    'lines': True,
+    'rho_res': 1,
+    'theta_res': np.pi / 180,
+    'theta_window': None,
+    'lines_threshold': 110,
+    'lines_nhood': (10, 10),
+    'max_lines': None,
+    # circles
+    'circles': True,
+    'radii': list(range(20, 35)),
+    'circles_threshold': 150,
+    'circles_nhood': (10, 10),
+    'radius_delta': None,
+    'max_bytes': None,
+}
+
+
+def find_images(source):
+    """Returns the sorted list of image files in a directory or matching a glob pattern.
+
+    Args:
+        source (str): directory path or glob pattern.
+
+    Returns:
+        list: image file paths.
+    """
+    if os.path.isdir(source):
+        source = os.path.join(source, '*')
+    return sorted(f for f in glob.glob(source) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def output_paths(filenames, output_dir):
+    """Returns the .npz output path of each image file.
+
+    The paths keep the sub-directories of the images relative to their common root, so that images with the
+    same name in different directories do not overwrite each other.
+
+    Args:
+        filenames (list): image file paths.
+        output_dir (str): directory where the .npz results are written.
+
+    Returns:
+        list: output paths, in the same order as filenames.
+
+    Raises:
+        ValueError: if two images map to the same output path (same name with different extensions).
+    """
+    if not filenames:
+        return []
+
+    root = os.path.dirname(os.path.commonprefix([os.path.abspath(f) for f in filenames]))
+    out_paths = [os.path.join(output_dir, os.path.splitext(os.path.relpath(os.path.abspath(f), root))[0] + '.npz')
+                 for f in filenames]
+
+    seen = {}
+    for filename, out_path in zip(filenames, out_paths):
+        if out_path in seen:
+            raise ValueError("{} and {} would both be saved to {}.".format(seen[out_path], filename, out_path))
+        seen[out_path] = filename
+    return out_paths
+
+
+def detect(img, params):
+    """Runs the smoothing, edge detection, Hough transform and peak detection chain on a grayscale image.
+
+    Args:
+        img (numpy.array): grayscale image.
+        params (dict): pipeline parameters, see DEFAULT_PARAMS.
+
+    Returns:
+        dict: 'lines' (Q x 2 array of [rho, theta]) and 'circles' (N x 3 array of [row_id, col_id, radius]).
+    """
+    img_smoothed = get_smoothed_image(img, tuple(params['ksize']), sigmaX=params['sigma'], sigmaY=params['sigma'])
+    img_edges = get_edge_image(img_smoothed, params['threshold1'], params['threshold2'])
+
+    lines = np.zeros((0, 2))
+    if params['lines']:
+        H, rho, theta = hough_lines_acc(img_edges, params['rho_res'], params['theta_res'], img_orig=img,
+                                        theta_window=params['theta_window'])
+        peaks = hough_peaks_nms(H, params['lines_threshold'], tuple(params['lines_nhood']),
+                                max_peaks=params['max_lines'])
+        if len(peaks) > 0:
+            lines = np.column_stack((rho[peaks[:, 0]], theta[peaks[:, 1]]))
+
+    circles = np.zeros((0, 3))
+    if params['circles']:
+        circles = find_circles(img, img_edges, params['radii'], params['circles_threshold'],
+                               tuple(params['circles_nhood']), radius_delta=params['radius_delta'],
+                               max_bytes=params['max_bytes'])
+
+    return {'lines': lines, 'circles': circles}
+
+
+def process_image(job):
+    """Process pool worker: runs detect on one image file and saves the results.
+
+    A failure on one image is reported in the result instead of being raised, so it does not stop the rest
+    of the batch.
+
+    Args:
+        job (tuple): (image path, output path, params dict).
+
+    Returns:
+        tuple: (image path, output path, number of lines, number of circles, seconds, error). The output path is
+               None and error describes the problem if the image could not be read or processed, error is None
+               otherwise.
+    """
+    filename, out_path, params = job
+    start = time.time()
+
+    img = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return filename, None, 0, 0, time.time() - start, "could not read the image"
+
+    try:
+        results = detect(img, params)
+        np.savez(out_path, **results)
+    except Exception as e:
+        return filename, None, 0, 0, time.time() - start, "{}: {}".format(type(e).__name__, str(e).strip())
+
+    return filename, out_path, len(results['lines']), len(results['circles']), time.time() - start, None
+
+
+def _init_worker():
+    # one process per core, keep OpenCV from spawning its own threads on top
+    cv2.setNumThreads(0)
+
+
+def run_pipeline(source, output_dir, params=None, processes=None, chunksize=1):
+    """Runs the detection chain over a set of images on a process pool, saving each result when it is ready.
+
+    Args:
+        source (str): directory path or glob pattern with the input images.
+        output_dir (str): directory where the .npz results are written.
+        params (dict): values that override DEFAULT_PARAMS. Default set to None.
+        processes (int): number of worker processes. Default set to None (all cores).
+        chunksize (int): number of images sent to a worker at a time.
+
+    Returns:
+        list: one (image path, output path, number of lines, number of circles, seconds, error) tuple per image,
+              in completion order, see process_image.
+
+    Raises:
+        ValueError: if two images would be saved to the same output path, see output_paths.
+    """
+    run_params = dict(DEFAULT_PARAMS)
+    run_params.update(params or {})
+
+    filenames = find_images(source)
+    out_paths = output_paths(filenames, output_dir)
+    for directory in set(os.path.dirname(out_path) for out_path in out_paths) | {output_dir}:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    jobs = [(filename, out_path, run_params) for filename, out_path in zip(filenames, out_paths)]
+    results = []
+    pool = multiprocessing.Pool(processes, initializer=_init_worker)
+    try:
+        for result in pool.imap_unordered(process_image, jobs, chunksize):
+            results.append(result)
+            filename, out_path, n_lines, n_circles, seconds, error = result
+            if out_path is None:
+                print("[{}/{}] {}: {}".format(len(results), len(jobs), filename, error))
+            else:
+                print("[{}/{}] {}: {} lines, {} circles ({:.2f}s)".format(
+                    len(results), len(jobs), filename, n_lines, n_circles, seconds))
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the edges and Hough transform pipeline over images.')
+    parser.add_argument('source', help='directory or glob pattern with the input images')
+    parser.add_argument('--output', default='output', help='directory where the results are written')
+    parser.add_argument('--params', help='JSON file with parameters that override the defaults')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes')
+
+    args = parser.parse_args()
+
+    params = None
+    if args.params:
+        with open(args.params) as f:
+            params = json.load(f)
+
+    run_pipeline(args.source, args.output, params, args.processes)
+
+
+if __name__ == '__main__':
+    main()
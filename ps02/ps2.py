@@ -5,7 +5,7 @@ import numpy as np
 import cv2
 
 
-def hough_lines_acc(img_edges, rho_res=1, theta_res=np.pi/180):
+def hough_lines_acc(img_edges, rho_res=1, theta_res=np.pi/180, img_orig=None, theta_window=None):
     """ Creates and returns a Hough accumulator array by computing the Hough Transform for lines on an
     edge image.
 
@@ -21,38 +21,436 @@ def hough_lines_acc(img_edges, rho_res=1, theta_res=np.pi/180):
     Note that indexing using negative numbers will result in calling index values starting from
     the end. For example, if b = [0, 1, 2, 3, 4] calling b[-2] will return 3.
 
+    When theta_window is set, each edge pixel only votes for the theta bins that are within theta_window
+    bins of its gradient orientation (see cv2.Sobel) computed from img_orig, similar to the 'point plus'
+    method used in hough_circles_acc. The line normal follows the gradient, so this keeps the votes
+    that matter and drops the rest.
+
     Args:
         img_edges (numpy.array): edge image (every nonzero value is considered an edge).
         rho_res (int): rho resolution (in pixels).
         theta_res (float): theta resolution (in degrees converted to radians i.e 1 deg = pi/180).
+        img_orig (numpy.array): original image used to compute the gradients. Only used with theta_window.
+        theta_window (int): number of theta bins to vote on each side of the gradient orientation.
+                            Default set to None (every edge pixel votes for all theta values).
 
     Returns:
         tuple: Three-element tuple containing:
-               H (numpy.array): Hough accumulator array.
+               H (numpy.array): Hough accumulator array. Its dtype is the narrowest unsigned integer type
+                                that can hold the number of edge pixels (see _accumulator_dtype).
                rho (numpy.array): vector of rho values, one for each row of H
                theta (numpy.array): vector of theta values, one for each column of H.
     """
-    row_size, col_size = img_edges.shape
+    rho, theta = _hough_lines_bins(img_edges.shape, rho_res, theta_res)
+    rows, cols = np.where(img_edges == 255)
+    # initialize H[d, theta] = 0, an edge pixel votes at most once in each bin
+    H = np.zeros((rho.size, theta.size), dtype=_accumulator_dtype(len(rows)))
+
+    theta_index = None
+    if theta_window is not None:
+        if img_orig is None:
+            raise ValueError("img_orig is required when theta_window is set.")
+        theta_index = _gradient_theta_index(img_orig, rows, cols, theta, theta_res, theta_window)
+
+    H += _vote_lines(rows, cols, rho, theta, theta_index=theta_index).astype(H.dtype)
+
+    return H, rho, theta
+
+
+def _accumulator_dtype(max_votes):
+    """Returns the narrowest unsigned integer dtype that can hold a given number of votes.
+
+    Args:
+        max_votes (int): maximum number of votes a single bin can receive.
+
+    Returns:
+        numpy.dtype: one of uint8, uint16, uint32 or uint64.
+    """
+    return np.min_scalar_type(max(0, int(max_votes)))
+
+
+def _gradient_theta_index(img_orig, rows, cols, theta, theta_res, theta_window):
+    """Returns the theta bins each edge pixel votes for given its gradient orientation.
+
+    The gradient angle is folded into [0, pi) since a line normal and its opposite describe the same line
+    (with rho changing sign). Bins that fall outside the theta vector are marked with -1, unless theta spans
+    the full [0, pi) range, in which case the window wraps around. A wrapping window is cut to theta.size bins
+    so that no edge pixel votes twice in the same bin, which keeps the bound of _accumulator_dtype.
+
+    Args:
+        img_orig (numpy.array): original image used to compute the gradients.
+        rows (numpy.array): row index of each edge pixel.
+        cols (numpy.array): column index of each edge pixel.
+        theta (numpy.array): vector of theta values.
+        theta_res (float): theta resolution (in radians).
+        theta_window (int): number of theta bins to vote on each side of the gradient orientation.
+
+    Returns:
+        numpy.array: array of shape (edges, 2 * theta_window + 1), or (edges, theta.size) for a wrapping window
+                     that is wider than theta, with the theta indices to vote for.
+    """
+    grad_x = cv2.Sobel(img_orig, cv2.CV_64F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(img_orig, cv2.CV_64F, 0, 1, ksize=3)
+    t = np.mod(np.arctan2(grad_y[rows, cols], grad_x[rows, cols]), np.pi)
+
+    offsets = np.arange(-theta_window, theta_window + 1)
+    theta_index = np.round(t / theta_res).astype(np.int64)[:, np.newaxis] + offsets
+
+    bins_per_pi = int(round(np.pi / theta_res))
+    if bins_per_pi == theta.size:
+        theta_index = theta_index[:, :theta.size] % theta.size
+    else:
+        theta_index[(theta_index < 0) | (theta_index >= theta.size)] = -1
+    return theta_index
+
+
+def _hough_lines_bins(shape, rho_res, theta_res):
+    """Returns the rho and theta vectors that index the rows and columns of a lines Hough accumulator.
+
+    Args:
+        shape (tuple): edge image shape (rows, cols).
+        rho_res (int): rho resolution (in pixels).
+        theta_res (float): theta resolution (in radians).
+
+    Returns:
+        tuple: two-element tuple containing:
+               rho (numpy.array): vector of rho values.
+               theta (numpy.array): vector of theta values.
+    """
+    row_size, col_size = shape
     # construct theta array [0, pi)
     theta = np.linspace(0, 180 * theta_res, 180, endpoint=False)
     # get the maximum rho possible
     rho_max = int(math.ceil(math.sqrt(row_size**2 + col_size**2)))
     # construct the rho array
     rho = np.linspace(-rho_max * rho_res, rho_max * rho_res, rho_max * 2, endpoint=False)
-    # initialize H[d, theta] = 0
-    H = np.zeros((rho.size, theta.size))
+    return rho, theta
+
+
+def _vote_lines(rows, cols, rho, theta, theta_index=None, chunk_size=2**22):
+    """Casts the votes of a set of edge pixels and returns them as an accumulator.
+
+    Each (edge, theta) pair is mapped to its nearest rho bin (see _line_vote_bins) and all the votes are
+    accumulated at once with np.bincount. Edge pixels are processed in chunks so that no more than chunk_size
+    (edge, theta) pairs are held in memory at the same time.
+
+    Args:
+        rows (numpy.array): row index of each edge pixel.
+        cols (numpy.array): column index of each edge pixel.
+        rho (numpy.array): evenly spaced vector of rho values, one for each row of the accumulator.
+        theta (numpy.array): vector of theta values, one for each column of the accumulator.
+        theta_index (numpy.array): array of shape (edges, k) with the theta indices each edge pixel votes
+                                   for, negative values are skipped. Default set to None (all theta values).
+        chunk_size (int): maximum number of (edge, theta) pairs voted at once.
+
+    Returns:
+        numpy.array: accumulator of shape (rho.size, theta.size) with the vote counts (int64).
+    """
+    votes = np.zeros(rho.size * theta.size, dtype=np.int64)
 
+    width = theta.size if theta_index is None else theta_index.shape[1]
+    step = max(1, chunk_size // max(1, width))
+    for start in range(0, len(rows), step):
+        t_index = None if theta_index is None else theta_index[start:start + step]
+        bins = _line_vote_bins(rows[start:start + step], cols[start:start + step], rho, theta, t_index)
+        votes += np.bincount(bins, minlength=votes.size)
+
+    return votes.reshape(rho.size, theta.size)
+
+
+def _line_vote_bins(rows, cols, rho, theta, theta_index=None):
+    """Returns the flat accumulator bins a set of edge pixels vote for.
+
+    Each (edge, theta) pair is mapped to its nearest rho bin with index arithmetic (rho is evenly spaced): the
+    bins next to the estimated index are compared with the same np.abs(rho - d) distances as the original
+    np.argmin search, so rounding and ties (to the lower bin) give the same votes. An edge pixel votes at most
+    once in each bin.
+
+    Args:
+        rows (numpy.array): row index of each edge pixel.
+        cols (numpy.array): column index of each edge pixel.
+        rho (numpy.array): evenly spaced vector of rho values, one for each row of the accumulator.
+        theta (numpy.array): vector of theta values, one for each column of the accumulator.
+        theta_index (numpy.array): array of shape (edges, k) with the theta indices each edge pixel votes
+                                   for, negative values are skipped. Default set to None (all theta values).
+
+    Returns:
+        numpy.array: 1-D array with the flat (rho, theta) index of every vote, edge by edge.
+    """
+    rho_step = rho[1] - rho[0] if rho.size > 1 else 1.
+    y = np.asarray(rows)[:, np.newaxis]
+    x = np.asarray(cols)[:, np.newaxis]
+    if theta_index is None:
+        t_index = np.arange(theta.size)
+        d = x * np.cos(theta) + y * np.sin(theta)  # maybe negative
+    else:
+        t_index = theta_index
+        d = x * np.cos(theta)[t_index] + y * np.sin(theta)[t_index]
+    # nearest rho bin. Only the votes about half a step from a bin can round differently from
+    # np.argmin(np.abs(rho - d)), these pick the first of the two closest bins by the same distances
+    fraction = d - rho[0]
+    fraction /= rho_step
+    rho_index = np.floor(fraction)
+    fraction -= rho_index
+    rho_index = rho_index.astype(np.int64)
+    halfway = np.flatnonzero(np.abs(fraction - 0.5) < _HALFWAY_TOLERANCE)
+    lower = np.clip(rho_index.flat[halfway], 0, rho.size - 2)
+    rho_index += fraction > 0.5
+    if halfway.size:
+        d_halfway = d.flat[halfway]
+        rho_index.flat[halfway] = lower + (np.abs(rho[lower + 1] - d_halfway) < np.abs(rho[lower] - d_halfway))
+    np.clip(rho_index, 0, rho.size - 1, out=rho_index)
+    bins = rho_index * theta.size + t_index
+    if theta_index is not None:
+        bins = bins[t_index >= 0]
+    return bins.ravel()
+
+
+# distance from half a rho step below which _line_vote_bins compares the two closest bins
+_HALFWAY_TOLERANCE = 1e-6
+
+
+def hough_lines_acc_pyramid(img_edges, rho_res=1, theta_res=np.pi/180, levels=2, hough_threshold=100,
+                            nhood_delta=(2, 2), window=None):
+    """Returns a Hough accumulator array for lines computed coarse-to-fine.
+
+    The edge image is first reduced by a factor of 2 ** levels (an edge block is set if any of its pixels is
+    an edge) and voted into a coarse accumulator that keeps one out of every 2 ** levels rho bins. Theta is
+    not reduced: on a large image a small theta error moves rho by more than a coarse bin. The candidate
+    lines are found in it with hough_peaks. Each candidate is then refined in a window of window[0] rho bins
+    and window[1] theta bins around it: only the edge pixels whose line can cross the window vote, and only
+    for the theta columns of the window.
+
+    For large images with few dominant lines this skips most of the votes. The output has the same contract
+    as hough_lines_acc, with the same votes inside the candidate windows and zeros outside them. A coarse bin
+    counts a band of edge pixels, so thick or axis aligned lines rank higher than in hough_lines_acc and a
+    line that passes hough_threshold there can fall under it in the coarse accumulator. Use a lower
+    hough_threshold than with hough_lines_acc (50 finds the lines that reach 100 in it on benchmark.make_scene)
+    and filter the refined peaks.
+
+    Args:
+        img_edges (numpy.array): edge image (every nonzero value is considered an edge).
+        rho_res (int): rho resolution (in pixels).
+        theta_res (float): theta resolution (in degrees converted to radians i.e 1 deg = pi/180).
+        levels (int): number of pyramid levels, each one halves the resolution.
+        hough_threshold (int): minimum value in the normalized coarse accumulator to search for candidates.
+                               Pass this value to hough_peaks.
+        nhood_delta (tuple): non-maximal suppression deltas used in the coarse accumulator.
+                             Pass this value to hough_peaks.
+        window (tuple): pair of integers with the rho and theta bins to refine on each side of a candidate.
+                        Default set to None (2 ** levels in both directions).
+
+    Returns:
+        tuple: Three-element tuple containing:
+               H (numpy.array): Hough accumulator array.
+               rho (numpy.array): vector of rho values, one for each row of H
+               theta (numpy.array): vector of theta values, one for each column of H.
+    """
+    factor = 2 ** levels
+    if window is None:
+        window = (factor, factor)
+
+    rho, theta = _hough_lines_bins(img_edges.shape, rho_res, theta_res)
     rows, cols = np.where(img_edges == 255)
-    for index in xrange(len(rows)):
-        y, x = rows[index], cols[index]
-        d_list = (x * np.cos(theta)) + (y * np.sin(theta))  # maybe negative
-        for i, d in enumerate(d_list):
-            rho_index = np.argmin(np.abs(rho - d))
-            H[rho_index, i] += 1
+    H = np.zeros((rho.size, theta.size), dtype=_accumulator_dtype(len(rows)))
+    if rows.size == 0:
+        return H, rho, theta
+
+    # coarse pass: one vote per edge block, cast from the block center
+    block_rows, block_cols = _edge_blocks(rows, cols, factor)
+    H_coarse = _vote_lines(block_rows, block_cols, rho[::factor], theta)
+    peaks = hough_peaks(H_coarse, hough_threshold, nhood_delta)
+    if len(peaks) == 0:
+        return H, rho, theta
+
+    # fine pass: full resolution votes restricted to the window around each candidate
+    centers = [(r * factor, t) for r, t in peaks]
+    windows = [(max(0, r - window[0]), min(rho.size, r + window[0] + 1),
+                max(0, t - window[1]), min(theta.size, t + window[1] + 1)) for r, t in centers]
+    inside = np.zeros(H.shape, dtype=bool)
+    for r_lo, r_hi, t_lo, t_hi in windows:
+        inside[r_lo:r_hi, t_lo:t_hi] = True
+    columns = np.flatnonzero(inside.any(axis=0))
+
+    # edge pixels whose line can cross each window: rho moves by at most distance * |theta - theta0| along the
+    # window columns. When the windows overlap too much, voting every edge pixel in their columns is cheaper.
+    rho_step = rho[1] - rho[0]
+    distance = np.hypot(rows, cols)
+    near, pairs = [], 0
+    for (r_lo, r_hi, t_lo, t_hi), (rho_index, theta_index) in zip(windows, centers):
+        if len(windows) >= columns.size or pairs > rows.size * columns.size:
+            break
+        d = cols * math.cos(theta[theta_index]) + rows * math.sin(theta[theta_index])
+        near.append(np.flatnonzero(np.abs(d - rho[rho_index]) <=
+                                   (window[0] + 1) * rho_step + distance * window[1] * theta_res))
+        # scanning the edge pixels costs about as much as voting them in one column
+        pairs += near[-1].size * (t_hi - t_lo) + rows.size
+
+    if len(near) < len(windows) or pairs > rows.size * columns.size:
+        votes = _vote_lines(rows, cols, rho, theta[columns])
+        H[:, columns] = np.where(inside[:, columns], votes, 0)
+        return H, rho, theta
+
+    for (r_lo, r_hi, t_lo, t_hi), index in zip(windows, near):
+        t_index = np.broadcast_to(np.arange(t_lo, t_hi), (index.size, t_hi - t_lo))
+        bins = _line_vote_bins(rows[index], cols[index], rho, theta, theta_index=t_index)
+        bin_rho, bin_theta = np.divmod(bins, theta.size)
+        keep = (r_lo <= bin_rho) & (bin_rho < r_hi)
+        votes = np.bincount((bin_rho[keep] - r_lo) * (t_hi - t_lo) + bin_theta[keep] - t_lo,
+                            minlength=(r_hi - r_lo) * (t_hi - t_lo))
+        # overlapping windows get the same votes
+        H[r_lo:r_hi, t_lo:t_hi] = votes.reshape(r_hi - r_lo, t_hi - t_lo)
 
     return H, rho, theta
 
 
+def _edge_blocks(rows, cols, factor):
+    """Returns the centers of the factor x factor blocks that contain at least one edge pixel.
+
+    Args:
+        rows (numpy.array): row index of each edge pixel.
+        cols (numpy.array): column index of each edge pixel.
+        factor (int): block size.
+
+    Returns:
+        tuple: two-element tuple with the rows and cols (float) of the block centers in full resolution units.
+    """
+    block_cols = cols.max() // factor + 1
+    blocks = np.unique((rows // factor) * block_cols + cols // factor)
+    center = (factor - 1) / 2.
+    return (blocks // block_cols) * factor + center, (blocks % block_cols) * factor + center
+
+
+def hough_lines_random(img_edges, rho_res=1, theta_res=np.pi/180, vote_threshold=50, min_line_length=30,
+                       max_line_gap=5, batch_size=64, max_samples=None, max_lines=None, seed=None):
+    """Returns a Hough accumulator array and line segments using a randomized Hough Transform for lines.
+
+    This method follows the progressive probabilistic Hough transform. Edge pixels are sampled in a random
+    order and vote in batches. As soon as a bin reaches vote_threshold, the line it represents is walked
+    through the edge pixels that have not been used yet and the longest run of pixels with gaps of at most
+    max_line_gap is taken as a segment. If the segment is at least min_line_length long, its pixels are
+    removed from the remaining samples and their votes are withdrawn, so dominant lines stop collecting
+    votes early. Otherwise the bin is not checked again until its votes double. The process ends when the
+    samples run out or max_lines segments are found.
+
+    The rho and theta vectors use the same binning as hough_lines_acc, so H can be passed to hough_peaks
+    and the peaks drawn with the usual tools. H holds the votes of every sampled pixel.
+
+    Args:
+        img_edges (numpy.array): edge image (every nonzero value is considered an edge).
+        rho_res (int): rho resolution (in pixels).
+        theta_res (float): theta resolution (in degrees converted to radians i.e 1 deg = pi/180).
+        vote_threshold (int): number of votes a bin needs before looking for a segment.
+        min_line_length (int): minimum segment length (in pixels).
+        max_line_gap (int): maximum gap (in pixels) between two pixels of the same segment.
+        batch_size (int): number of edge pixels that vote before the bins are checked.
+        max_samples (int): maximum number of edge pixels to sample. Default set to None (all of them).
+        max_lines (int): stop after finding this number of segments. Default set to None (no limit).
+        seed (int): random seed used to sample the edge pixels. Default set to None.
+
+    Returns:
+        tuple: four-element tuple containing:
+               H (numpy.array): Hough accumulator array.
+               rho (numpy.array): vector of rho values, one for each row of H
+               theta (numpy.array): vector of theta values, one for each column of H.
+               segments (numpy.array): array of shape N x 4 where each row is a [x1, y1, x2, y2] segment.
+    """
+    rho, theta = _hough_lines_bins(img_edges.shape, rho_res, theta_res)
+    rows, cols = np.where(img_edges == 255)
+    order = np.random.RandomState(seed).permutation(len(rows))[:max_samples]
+
+    H = np.zeros((rho.size, theta.size), dtype=_accumulator_dtype(len(order)))
+    H_flat = H.reshape(-1)
+    # votes of the sampled pixels that are not part of a segment yet
+    live = np.zeros(H.size, dtype=np.int64)
+    # votes a bin needs before it is checked (again)
+    bar = np.full(H.size, vote_threshold, dtype=np.int64)
+
+    free = np.ones(len(rows), dtype=bool)
+    voted = np.zeros(len(rows), dtype=bool)
+    segments = []
+    # bins that gave a segment in the last batch, they are checked again while they keep enough votes
+    found = []
+
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        batch = batch[free[batch]]
+        # scatter the votes of the batch in the bins it touched
+        bins, votes = np.unique(_line_vote_bins(rows[batch], cols[batch], rho, theta), return_counts=True)
+        H_flat[bins] += votes.astype(H.dtype)
+        live[bins] += votes
+        voted[batch] = True
+
+        # look for segments in the bins that passed the threshold, most voted first. Only the bins this batch
+        # voted for can have reached their bar since the last check.
+        passed = np.union1d(bins, found) if found else bins
+        passed = passed[live[passed] >= bar[passed]]
+        found = []
+        for bin_index in passed[np.argsort(-live[passed], kind='mergesort')]:
+            if live[bin_index] < bar[bin_index]:
+                # its votes were withdrawn by a previous segment
+                continue
+            rho_index, theta_index = divmod(bin_index, theta.size)
+            members = _line_segment_members(rows, cols, free, rho[rho_index], theta[theta_index],
+                                            rho[1] - rho[0], max_line_gap)
+            (x1, y1), (x2, y2) = (cols[members[0]], rows[members[0]]), (cols[members[-1]], rows[members[-1]])
+            if math.hypot(x2 - x1, y2 - y1) < min_line_length:
+                bar[bin_index] = 2 * live[bin_index]
+                continue
+
+            segments.append([x1, y1, x2, y2])
+            found.append(bin_index)
+            free[members] = False
+            members = members[voted[members]]
+            bins, votes = np.unique(_line_vote_bins(rows[members], cols[members], rho, theta), return_counts=True)
+            live[bins] -= votes
+
+            if max_lines is not None and len(segments) >= max_lines:
+                break
+        if max_lines is not None and len(segments) >= max_lines:
+            break
+
+    segments = np.array(segments, dtype=int).reshape(-1, 4)
+    return H, rho, theta, segments
+
+
+def _line_segment_members(rows, cols, free, rho, theta, rho_step, max_line_gap):
+    """Returns the edge pixels that form the longest segment along a (rho, theta) line.
+
+    Only the free edge pixels that lie inside the rho bin (or within one pixel of the line) are considered.
+    They are sorted by their position along the line and split wherever the gap is larger than max_line_gap.
+
+    Args:
+        rows (numpy.array): row index of each edge pixel.
+        cols (numpy.array): column index of each edge pixel.
+        free (numpy.array): boolean array with the edge pixels that can be part of the segment.
+        rho (float): line distance to the origin.
+        theta (float): line normal angle.
+        rho_step (float): rho bin size.
+        max_line_gap (int): maximum gap (in pixels) between two pixels of the same segment.
+
+    Returns:
+        numpy.array: indices of the edge pixels in the segment sorted along the line (at least one).
+    """
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    index = np.flatnonzero(free)
+    x, y = cols[index], rows[index]
+    near = np.abs(x * cos_t + y * sin_t - rho) <= max(rho_step / 2., 1.)
+    index = index[near]
+
+    # position of each pixel along the line direction
+    position = -x[near] * sin_t + y[near] * cos_t
+    order = np.argsort(position, kind='mergesort')
+    index, position = index[order], position[order]
+
+    # split in runs and keep the longest one
+    breaks = np.flatnonzero(np.diff(position) > max_line_gap + 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [index.size]))
+    longest = np.argmax(position[ends - 1] - position[starts])
+    return index[starts[longest]:ends[longest]]
+
+
 def hough_peaks(H, hough_threshold, nhood_delta, rows=None, cols=None):
     """Returns the best peaks in a Hough Accumulator array.
 
@@ -82,7 +480,7 @@ def hough_peaks(H, hough_threshold, nhood_delta, rows=None, cols=None):
                      where the peaks are in the H array and Q is the number of the peaks found in H.
     """
     # In order to standardize the range of hough_threshold values let's work with a normalized version of H.
-    H_norm = cv2.normalize(H.copy(), alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+    H_norm = cv2.normalize(H.astype(np.float64), alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
 
     # get the possible peaks index given the threshold
     p_rows, p_cols = np.where(H_norm >= hough_threshold)
@@ -126,6 +524,293 @@ def hough_peaks(H, hough_threshold, nhood_delta, rows=None, cols=None):
     return peaks
 
 
+def hough_peaks_nms(H, hough_threshold, nhood_delta, max_peaks=None):
+    """Returns the best peaks in a Hough Accumulator array using a dilation based non-maximal suppression.
+
+    This is a faster alternative to hough_peaks for large accumulators or low thresholds. Instead of walking
+    the sorted peaks one by one, the local maxima are found at once by comparing H with its dilation
+    (a max filter of shape nhood_delta[1] * 2 + 1 by nhood_delta[0] * 2 + 1, see cv2.dilate). Plateaus of
+    equal values are reduced to a single peak. When max_peaks is set only the best max_peaks peaks are kept
+    using a partial sort (np.argpartition).
+
+    The threshold is moved to accumulator units (see _normalized_threshold) so that no normalized copy of H is
+    made, and H is dilated in its own narrow type, only over the bounding box of the values above the threshold.
+
+    Args:
+        H (numpy.array): Hough accumulator array.
+        hough_threshold (int): minimum pixel intensity value in the accumulator array to search for peaks
+        nhood_delta (tuple): a pair of integers indicating the distance in the row and
+                             column indices deltas over which non-maximal suppression should take place.
+        max_peaks (int): maximum number of peaks to return. Default set to None (all peaks).
+
+    Returns:
+        numpy.array: Output array of shape Q x 2 where each row is a [row_id, col_id] pair
+                     where the peaks are in the H array and Q is the number of the peaks found in H.
+                     Peaks are sorted by their value in descending order.
+    """
+    # the same hough_threshold values as hough_peaks, which normalizes H to [0, 255]
+    threshold = _normalized_threshold(H[np.newaxis], hough_threshold)[0]
+
+    peaks = _local_maxima(H, (nhood_delta[1], nhood_delta[0]), threshold, max_peaks=max_peaks)
+    return np.column_stack(np.unravel_index(peaks, H.shape)).astype(int)
+
+
+def _max_filter(a, nhood_delta):
+    """Returns the maximum value of the neighbourhood of each element of a 2-D array (grayscale dilation).
+
+    Args:
+        a (numpy.array): 2-D array.
+        nhood_delta (tuple): distance over which the maximum is taken along each axis of a.
+
+    Returns:
+        numpy.array: array of the same shape as a, with the dtype returned by _dilation_type for its values.
+    """
+    kernel = np.ones((2 * nhood_delta[0] + 1, 2 * nhood_delta[1] + 1), dtype=np.uint8)
+    work_type = _dilation_type(a.min(), a.max()) if a.size else np.float64
+    if a.dtype in _DILATION_TYPES:
+        work_type = a.dtype
+    return cv2.dilate(a.astype(work_type, copy=False), kernel)
+
+
+# dtypes supported by cv2.dilate, from the narrowest one
+_DILATION_TYPES = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+def _dilation_type(low, high):
+    """Returns the narrowest dtype supported by cv2.dilate that holds every integer in [low, high] exactly.
+
+    Accumulators only hold a small fraction of their worst case bound, so a uint32 accumulator can usually be
+    dilated as uint16 instead of float64.
+
+    Args:
+        low (int): smallest value.
+        high (int): largest value.
+
+    Returns:
+        type: one of _DILATION_TYPES.
+    """
+    for work_type in _DILATION_TYPES[:3]:
+        if np.iinfo(work_type).min <= low and high <= np.iinfo(work_type).max:
+            return work_type
+    return np.float32 if max(abs(low), abs(high)) <= 2 ** 24 else np.float64
+
+
+def _local_maxima(a, nhood_delta, threshold=None, candidates=None, max_peaks=None):
+    """Returns the flat indices of the elements that are the maximum of their neighbourhood.
+
+    A 3-D array is a stack of planes (e.g. one accumulator per radius) and is processed one plane at a time:
+    the neighbourhood maximum of a plane is the dilation of the maximum of the planes around it, so no
+    filtered copy of the whole array is made. With a threshold, only the bounding box of the elements of the
+    plane that pass it, grown by the neighbourhood, is dilated. Candidates that share the same value inside a
+    neighbourhood (plateaus) are then settled among themselves, keeping only the first one in flat index order.
+
+    Args:
+        a (numpy.array): 2-D array or 3-D array of planes.
+        nhood_delta (tuple): distance over which the maximum is taken along each axis of a. For a 3-D array the
+                             first value can be None to take the maximum along the whole axis.
+        threshold (float): minimum value of a peak, or one minimum value per plane for a 3-D array.
+                           Default set to None (no minimum).
+        candidates (numpy.array): boolean array of the same shape as a with the elements allowed to be a peak.
+                                  Default set to None (all of them).
+        max_peaks (int): maximum number of peaks to return. Default set to None (all peaks).
+
+    Returns:
+        numpy.array: flat indices of the peaks sorted by value in descending order.
+    """
+    planes = a if a.ndim == 3 else a[np.newaxis]
+    nhood_delta = tuple(nhood_delta) if a.ndim == 3 else (0,) + tuple(nhood_delta)
+    if candidates is not None:
+        candidates = candidates.reshape(planes.shape)
+    if threshold is not None:
+        threshold = np.broadcast_to(threshold, planes.shape[:1])
+
+    def max_filter(plane):
+        return _max_filter(plane, nhood_delta[1:])
+
+    index = []
+    if nhood_delta[0] is None:
+        # the maximum over the whole first axis, dilated once
+        all_max = max_filter(planes.max(axis=0))
+    for i, plane in enumerate(planes):
+        box = (slice(None), slice(None))
+        if threshold is not None:
+            passed = _at_least(plane, threshold[i])
+            box = _bounding_box(passed, nhood_delta[1:])
+            if box is None:
+                continue
+            passed = passed[box]
+        if nhood_delta[0] is not None:
+            window = planes[max(0, i - nhood_delta[0]):i + nhood_delta[0] + 1, box[0], box[1]]
+            window_max = max_filter(window.max(axis=0) if len(window) > 1 else window[0])
+        else:
+            window_max = all_max[box]
+        peaks = plane[box] == window_max
+        if threshold is not None:
+            peaks &= passed
+        if candidates is not None:
+            peaks &= candidates[i][box]
+        found = np.flatnonzero(peaks)
+        if peaks.shape != plane.shape:
+            # back to the flat index of the whole plane
+            found = (found // peaks.shape[1] + box[0].start) * plane.shape[1] + found % peaks.shape[1] + box[1].start
+        index.append(found + i * plane.size)
+    index = np.concatenate(index) if index else np.array([], dtype=np.int64)
+
+    index = _settle_plateaus(planes.flat[index], index, planes.shape, nhood_delta)
+
+    values = a.flat[index].astype(np.float64)
+    if max_peaks is not None and index.size > max_peaks:
+        best = np.argpartition(-values, max_peaks - 1)[:max_peaks] if max_peaks > 0 else []
+        index, values = index[best], values[best]
+
+    return index[np.lexsort((index, -values))]
+
+
+def _at_least(a, threshold):
+    """Returns a >= threshold, comparing an integer array with an integer of its own type instead of as float64.
+
+    Args:
+        a (numpy.array): array.
+        threshold (float): minimum value.
+
+    Returns:
+        numpy.array: boolean array of the same shape as a.
+    """
+    if a.dtype.kind in 'ui':
+        info = np.iinfo(a.dtype)
+        if threshold > info.max:
+            return np.zeros(a.shape, dtype=bool)
+        threshold = a.dtype.type(max(np.ceil(threshold), info.min))
+    return a >= threshold
+
+
+def _bounding_box(mask, margin):
+    """Returns the rows and columns slices of the bounding box of a 2-D mask, grown by margin and clipped to it.
+
+    Args:
+        mask (numpy.array): 2-D boolean array.
+        margin (tuple): number of rows and columns added on each side.
+
+    Returns:
+        tuple: (rows, cols) slices, or None if the mask is empty.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask[rows[0]:rows[-1] + 1].any(axis=0))
+    return (slice(max(rows[0] - margin[0], 0), rows[-1] + margin[0] + 1),
+            slice(max(cols[0] - margin[1], 0), cols[-1] + margin[1] + 1))
+
+
+# largest number of candidate pairs compared at once when settling plateaus
+_PLATEAU_PAIRS = 2 ** 18
+
+
+def _settle_plateaus(values, index, shape, nhood_delta):
+    """Keeps the first of the local maxima that share the same value inside a neighbourhood.
+
+    Every local maximum is the largest value of its neighbourhood, so another one inside it can only tie. A
+    maximum is dropped when a tie with a smaller flat index is inside its neighbourhood. The ties are found
+    by comparing each maximum with the earlier ones of the same value. Large plateaus, that would need more
+    than _PLATEAU_PAIRS comparisons, are settled with _settle_plateaus_dense instead.
+
+    Args:
+        values (numpy.array): value of each local maximum.
+        index (numpy.array): flat index of each local maximum in an array of the given shape.
+        shape (tuple): shape (planes, rows, cols) of the array the maxima come from.
+        nhood_delta (tuple): neighbourhood distance along each axis of shape, the first one can be None.
+
+    Returns:
+        numpy.array: flat indices of the maxima that are kept.
+    """
+    order = np.lexsort((index, values))
+    index, values = index[order], values[order]
+
+    # number of earlier maxima with the same value
+    n = index.size
+    group_start = np.maximum.accumulate(np.where(np.r_[True, values[1:] != values[:-1]], np.arange(n), 0))
+    earlier = np.arange(n) - group_start
+    pairs = earlier.sum()
+    if pairs == 0:
+        return index
+    if pairs > _PLATEAU_PAIRS:
+        return _settle_plateaus_dense(values, index, shape, nhood_delta)
+
+    left = np.repeat(np.arange(n), earlier)
+    right = group_start[left] + np.arange(pairs) - np.repeat(np.cumsum(earlier) - earlier, earlier)
+    p = np.unravel_index(index[left], shape)
+    q = np.unravel_index(index[right], shape)
+    near = (np.abs(p[1] - q[1]) <= nhood_delta[1]) & (np.abs(p[2] - q[2]) <= nhood_delta[2])
+    if nhood_delta[0] is not None:
+        near &= np.abs(p[0] - q[0]) <= nhood_delta[0]
+
+    tied = np.zeros(n, dtype=bool)
+    tied[left[near]] = True
+    return index[~tied]
+
+
+def _settle_plateaus_dense(values, index, shape, nhood_delta):
+    """Plateau settling of _settle_plateaus done with dilations, for large plateaus.
+
+    The maxima are drawn into planes one plane at a time, with their value plus one over zeros for unsigned
+    integer values (in the narrowest type cv2.dilate supports) and over -inf otherwise. Only the planes that
+    hold maxima are drawn. A maximum is tied with an earlier one when the largest maximum in the part of its
+    neighbourhood before it in flat index order (the earlier planes, then the earlier rows and columns of its
+    own plane) has the same value.
+
+    Args:
+        values (numpy.array): value of each local maximum.
+        index (numpy.array): flat index of each local maximum in an array of the given shape.
+        shape (tuple): shape (planes, rows, cols) of the array the maxima come from.
+        nhood_delta (tuple): neighbourhood distance along each axis of shape, the first one can be None.
+
+    Returns:
+        numpy.array: flat indices of the maxima that are kept.
+    """
+    d_plane, d_row, d_col = nhood_delta
+    full = np.ones((2 * d_row + 1, 2 * d_col + 1), dtype=np.uint8)
+    before = np.zeros_like(full)
+    before[:d_row] = 1
+    before[d_row, :d_col] = 1
+
+    order = np.argsort(index, kind='mergesort')
+    index, values = index[order], values[order]
+    if values.dtype.kind == 'u':
+        offset, fill, work_type = 1, 0, _dilation_type(0, int(values.max()) + 1)
+    else:
+        offset, fill, work_type = 0, -np.inf, np.float64
+
+    plane_size = shape[1] * shape[2]
+    plane_of = index // plane_size
+    kept = []
+    maxima = []  # (plane, drawing) of the earlier planes inside the neighbourhood
+    earlier = None
+    for i in np.unique(plane_of):
+        found = index[plane_of == i] - i * plane_size
+        drawn_values = values[plane_of == i].astype(work_type) + offset
+        drawn = np.full(shape[1:], fill, dtype=work_type)
+        drawn.flat[found] = drawn_values
+
+        if d_plane is not None:
+            maxima = [(k, m) for k, m in maxima if i - k <= d_plane]
+            earlier = None
+            for _, m in maxima:
+                earlier = m.copy() if earlier is None else np.maximum(earlier, m, out=earlier)
+        tied = np.zeros(found.size, dtype=bool)
+        if before.any():
+            tied |= cv2.dilate(drawn, before).flat[found] == drawn_values
+        if earlier is not None:
+            tied |= cv2.dilate(earlier, full).flat[found] == drawn_values
+        kept.append(found[~tied] + i * plane_size)
+
+        if d_plane is not None:
+            maxima.append((i, drawn))
+        else:
+            earlier = drawn if earlier is None else np.maximum(earlier, drawn, out=earlier)
+
+    return np.concatenate(kept)
+
+
 def hough_circles_acc(img_orig, img_edges, radius, point_plus=True):
     """Returns a Hough accumulator array using the Hough Transform for circles.
 
@@ -149,11 +834,11 @@ def hough_circles_acc(img_orig, img_edges, radius, point_plus=True):
     """
 
     row_size, col_size = img_edges.shape
-    # initialize H[a, b] = 0
-    H = np.zeros((row_size, col_size))
-
     rows, cols = np.where(img_edges == 255)
 
+    # initialize H[a, b] = 0, an edge pixel votes at most 360 times in each bin
+    H = np.zeros((row_size, col_size), dtype=_accumulator_dtype(360 * len(rows)))
+
     if not point_plus:
         theta_res = np.pi/180
         theta = np.linspace(0, 360 * theta_res, 360, endpoint=False)
@@ -167,108 +852,441 @@ def hough_circles_acc(img_orig, img_edges, radius, point_plus=True):
                 if 0 <= a < row_size and 0 <= b < col_size:
                     H[a, b] += 1
     elif point_plus:
-        def get_bin_position(a, b, k=1):
-            y0 = a - k if a >= k else 0
-            y1 = a + k + 1
-            x0 = b - k if b >= k else 0
-            x1 = b + k + 1
-            return (x0, x1), (y0, y1)
+        H = hough_circles_volume(img_orig, img_edges, [radius])[0]
 
-        grad_x = cv2.Sobel(img_orig, cv2.CV_64F, 1, 0, ksize=3)
-        grad_y = cv2.Sobel(img_orig, cv2.CV_64F, 0, 1, ksize=3)
+    return H
 
-        for index in xrange(len(rows)):
-            y, x = rows[index], cols[index]
-            dx = grad_x[y, x]
-            dy = grad_y[y, x]
-            # get the theta
-            t = math.atan2(dy, dx)
-            # vote in both direction in and out the center
-            a1 = int(np.round(y + radius * math.sin(t)))  # row_id
-            b1 = int(np.round(x + radius * math.cos(t)))  # col_id
-            a2 = int(np.round(y - radius * math.sin(t)))  # row_id
-            b2 = int(np.round(x - radius * math.cos(t)))  # col_id
-            if 0 <= a1 < row_size and 0 <= b1 < col_size:
-                (x0, x1), (y0, y1) = get_bin_position(a1, b1)
-                H[y0:y1, x0:x1] += 1
-                H[a1, b1] += 10
-            if 0 <= a1 < row_size and 0 <= b2 < col_size:
-                (x0, x1), (y0, y1) = get_bin_position(a1, b2)
-                H[y0:y1, x0:x1] += 1
-                H[a1, b2] += 10
-            if 0 <= a2 < row_size and 0 <= b1 < col_size:
-                (x0, x1), (y0, y1) = get_bin_position(a2, b1)
-                H[y0:y1, x0:x1] += 1
-                H[a2, b1] += 10
-            if 0 <= a2 < row_size and 0 <= b2 < col_size:
-                (x0, x1), (y0, y1) = get_bin_position(a2, b2)
-                H[y0:y1, x0:x1] += 1
-                H[a2, b2] += 10
 
+def hough_circles_volume(img_orig, img_edges, radii):
+    """Returns a 3-D Hough accumulator array using the 'point plus' method for all radii at once.
+
+    The gradients (see cv2.Sobel) are computed only once and the candidate centers of every edge pixel are
+    generated for all radii as arrays. The votes are then accumulated with np.bincount into a preallocated
+    volume, so that H[i] is the same accumulator hough_circles_acc returns for radii[i].
+
+    Args:
+        img_orig (numpy.array): original image.
+        img_edges (numpy.array): edge image (every nonzero value is considered an edge).
+        radii (list): list of radii values to search for.
+
+    Returns:
+        numpy.array: Hough accumulator array of shape (len(radii), rows, cols).
+    """
+    rows, cols, sin_t, cos_t = _edge_gradient_directions(img_orig, img_edges)
+    return _vote_circles(rows, cols, sin_t, cos_t, radii, img_edges.shape)
+
+
+def _edge_gradient_directions(img_orig, img_edges):
+    """Returns the edge pixel positions and the sine and cosine of their gradient orientation.
+
+    Args:
+        img_orig (numpy.array): original image used to compute the gradients.
+        img_edges (numpy.array): edge image (every nonzero value is considered an edge).
+
+    Returns:
+        tuple: four-element tuple containing the rows, cols, sin(theta) and cos(theta) arrays.
+    """
+    grad_x = cv2.Sobel(img_orig, cv2.CV_64F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(img_orig, cv2.CV_64F, 0, 1, ksize=3)
+
+    rows, cols = np.where(img_edges == 255)
+    t = np.arctan2(grad_y[rows, cols], grad_x[rows, cols])
+    return rows, cols, np.sin(t), np.cos(t)
+
+
+# maximum votes an edge pixel can cast in a single bin with the 'point plus' method:
+# four candidate centers, each one with 10 votes plus one more from its 3x3 neighbourhood
+_POINT_PLUS_VOTES = 4 * 11
+
+# upper bound of the temporary memory (in bytes) taken by each vote cast by _vote_circles
+_BYTES_PER_VOTE = 32
+
+
+def _vote_circles(rows, cols, sin_t, cos_t, radii, shape, chunk_size=2**20, out=None):
+    """Casts the 'point plus' votes of a set of edge pixels for a list of radii.
+
+    Every edge pixel votes in both directions of its gradient, in and out of the center. Each candidate
+    center gets 10 votes and one more vote is added to every bin of its 3x3 neighbourhood. The flat indices
+    of the votes are generated from the edge offsets and accumulated with np.bincount, so the cost follows the
+    number of votes and not the size of the accumulator. The edges are processed in chunks of at most
+    chunk_size votes (about _BYTES_PER_VOTE bytes each), and the counts of a chunk only span the bins between
+    its first and last vote, which are added to the accumulator in place.
+
+    Args:
+        rows (numpy.array): row index of each edge pixel.
+        cols (numpy.array): column index of each edge pixel.
+        sin_t (numpy.array): sine of the gradient orientation of each edge pixel.
+        cos_t (numpy.array): cosine of the gradient orientation of each edge pixel.
+        radii (list): list of radii values to search for.
+        shape (tuple): edge image shape (rows, cols).
+        chunk_size (int): maximum number of votes cast at once.
+        out (numpy.array): C-contiguous array of shape (len(radii), rows, cols) to add the votes to. Default set to
+                           None (a new accumulator).
+
+    Returns:
+        numpy.array: Hough accumulator array of shape (len(radii), rows, cols), one contiguous plane per radius.
+                     Its dtype is the narrowest unsigned integer type that can hold the votes of all the edge pixels.
+    """
+    row_size, col_size = shape
+    radii = np.asarray(radii, dtype=np.float64)
+    H = out
+    if H is None:
+        H = np.zeros((radii.size, row_size, col_size), dtype=_accumulator_dtype(_POINT_PLUS_VOTES * len(rows)))
+    if len(rows) == 0:
+        return H
+
+    # 4 candidate centers per edge pixel, each one votes in its 3x3 neighbourhood
+    e_step = max(1, chunk_size // (4 * 9))
+    for k, r in enumerate(radii):
+        plane = H[k].reshape(-1)
+        for e_start in range(0, len(rows), e_step):
+            y = rows[e_start:e_start + e_step]
+            x = cols[e_start:e_start + e_step]
+            # candidate centers
+            a1 = np.round(y + r * sin_t[e_start:e_start + e_step]).astype(np.int64)  # row_id
+            b1 = np.round(x + r * cos_t[e_start:e_start + e_step]).astype(np.int64)  # col_id
+            a2 = np.round(y - r * sin_t[e_start:e_start + e_step]).astype(np.int64)  # row_id
+            b2 = np.round(x - r * cos_t[e_start:e_start + e_step]).astype(np.int64)  # col_id
+
+            a = np.concatenate((a1, a1, a2, a2))
+            b = np.concatenate((b1, b2, b1, b2))
+            inside = (0 <= a) & (a < row_size) & (0 <= b) & (b < col_size)
+            a, b = a[inside], b[inside]
+            if a.size == 0:
+                continue
+
+            # 10 votes for each center plus one vote for every bin of its 3x3 neighbourhood
+            centers = a * col_size + b
+            bins, weights = [], []
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    inside = (0 <= a + dy) & (a + dy < row_size) & (0 <= b + dx) & (b + dx < col_size)
+                    bins.append(centers[inside] + (dy * col_size + dx))
+                    weights.append(11 if dy == dx == 0 else 1)
+            weights = np.repeat(np.asarray(weights, dtype=np.float64), [len(v) for v in bins])
+            bins = np.concatenate(bins)
+            first = bins.min()
+            bins -= first
+            votes = np.bincount(bins, weights)
+            band = plane[first:first + votes.size]
+            np.add(band, votes, out=band, casting='unsafe')
+
+    return H
+
+
+def hough_circles_acc_pyramid(img_orig, img_edges, radius, levels=2, hough_threshold=100, nhood_delta=(2, 2),
+                              window=None):
+    """Returns a Hough accumulator array using the 'point plus' method computed coarse-to-fine.
+
+    The edge pixels first vote into a coarse accumulator where each bin covers 2 ** levels by 2 ** levels
+    centers, with one vote for each of their candidate centers (the bins are already as wide as the 'point
+    plus' neighbourhood). The candidate centers are found in it with hough_peaks. Each candidate is then
+    refined in a window of window bins on each side of it: only the edge pixels with a candidate center in
+    (or next to) a window vote again at full resolution, and the votes outside the windows are discarded.
+
+    The output has the same contract as hough_circles_acc, with the same votes inside the candidate windows
+    and zeros outside them.
+
+    Args:
+        img_orig (numpy.array): original image.
+        img_edges (numpy.array): edge image (every nonzero value is considered an edge).
+        radius (int): radius value to look for.
+        levels (int): number of pyramid levels, each one halves the resolution.
+        hough_threshold (int): minimum value in the normalized coarse accumulator to search for candidates.
+                               Pass this value to hough_peaks.
+        nhood_delta (tuple): non-maximal suppression deltas used in the coarse accumulator.
+                             Pass this value to hough_peaks.
+        window (int): number of bins to refine on each side of a candidate center.
+                      Default set to None (two coarse bins, 2 ** (levels + 1)).
+
+    Returns:
+        numpy.array: Hough accumulator array.
+    """
+    factor = 2 ** levels
+    if window is None:
+        window = 2 * factor
+
+    row_size, col_size = img_edges.shape
+    rows, cols, sin_t, cos_t = _edge_gradient_directions(img_orig, img_edges)
+    H = np.zeros((row_size, col_size), dtype=_accumulator_dtype(_POINT_PLUS_VOTES * len(rows)))
+
+    # coarse pass: one vote for each candidate center, cast in units of factor pixels
+    coarse_rows, coarse_cols = -(-row_size // factor), -(-col_size // factor)
+    a = [np.round((rows + sign * radius * sin_t) / factor).astype(np.int64) for sign in (1, -1)]
+    b = [np.round((cols + sign * radius * cos_t) / factor).astype(np.int64) for sign in (1, -1)]
+    a, b = np.concatenate((a[0], a[0], a[1], a[1])), np.concatenate((b[0], b[1], b[0], b[1]))
+    inside = (0 <= a) & (a < coarse_rows) & (0 <= b) & (b < coarse_cols)
+    H_coarse = np.bincount(a[inside] * coarse_cols + b[inside], minlength=coarse_rows * coarse_cols)
+    peaks = hough_peaks(H_coarse.reshape(coarse_rows, coarse_cols), hough_threshold, nhood_delta)
+    if len(peaks) == 0:
+        return H
+
+    # fine pass: the edge pixels with a candidate center inside a window, or one bin away from it (its 3x3
+    # neighbourhood votes reach the window), vote straight into H
+    inside = np.zeros(H.shape, dtype=bool)
+    reach = np.zeros(H.shape, dtype=bool)
+    for center_row, center_col in peaks * factor + factor // 2:
+        inside[max(0, center_row - window):center_row + window + 1,
+               max(0, center_col - window):center_col + window + 1] = True
+        reach[max(0, center_row - window - 1):center_row + window + 2,
+              max(0, center_col - window - 1):center_col + window + 2] = True
+    keep = np.zeros(rows.size, dtype=bool)
+    for sign_a in (1, -1):
+        a = np.clip(np.round(rows + sign_a * radius * sin_t).astype(np.int64), 0, row_size - 1)
+        for sign_b in (1, -1):
+            b = np.clip(np.round(cols + sign_b * radius * cos_t).astype(np.int64), 0, col_size - 1)
+            keep |= reach[a, b]
+
+    _vote_circles(rows[keep], cols[keep], sin_t[keep], cos_t[keep], [radius], H.shape, out=H[np.newaxis])
+    H[~inside] = 0
     return H
 
 
-def find_circles(img_orig, edge_img, radii, hough_threshold, nhood_delta):
+def find_circles(img_orig, edge_img, radii, hough_threshold, nhood_delta, radius_delta=None, max_bytes=None):
     """Finds circles in the input edge image using the Hough transform and the point plus gradient
     method.
 
-    In this method you will call both hough_circles_acc and hough_peaks.
+    The Hough accumulators for all the values in 'radii' are generated at once (see hough_circles_volume)
+    and stacked in a 3-D array. The peaks are then found with a volumetric non-maximal suppression: a bin
+    is a circle if it is above the threshold and it holds the most votes of its neighbourhood across rows,
+    columns and radii (see cv2.dilate). This keeps the most voted circle and discards the ones with a
+    similar center found at the other radii.
 
-    The goal here is to call hough_circles_acc iterating over the values in 'radii'. A Hough accumulator
-    is generated for each radius value and the respective peaks are identified. It is recommended that
-    the peaks from all radii are stored with their respective vote value. That way you can identify which
-    are true peaks and discard false positives.
+    When the 3-D array and its temporaries would need more than max_bytes (or _STREAMING_BYTES when max_bytes
+    is None), the radii are streamed one at a time instead, which is also faster for large arrays. With
+    radius_delta set to None only the running best radius of each bin is kept (its votes, radius index and
+    threshold test). Otherwise a rolling window of 2 * radius_delta + 1 radius accumulators is kept and the
+    peaks of each radius are collected as soon as all its neighbours have been voted. Both give the same
+    circles as the 3-D array.
 
     Args:
         img_orig (numpy.array): original image. Pass this parameter to hough_circles_acc.
         edge_img (numpy.array): edge image (every nonzero value is considered an edge).
         radii (list): list of radii values to search for.
         hough_threshold (int): minimum pixel intensity value in the accumulator array to
-                               search for peaks. Pass this value to hough_peaks.
+                               search for peaks. As in hough_peaks, it is applied to each radius
+                               accumulator normalized to [0, 255].
         nhood_delta (tuple): a pair of integers indicating the distance in the row and
                              column indices deltas over which non-maximal suppression should
-                             take place. Pass this value to hough_peaks.
+                             take place.
+        radius_delta (int): distance in radii indices over which non-maximal suppression should take
+                            place. Default set to None (all radii).
+        max_bytes (int): memory ceiling (in bytes) for the accumulator arrays and the temporary arrays used to
+                         vote and suppress them, not counting the list of local maxima (8 bytes each, only large
+                         with a hough_threshold close to 0). Default set to None (no limit, the radii are streamed
+                         when the 3-D array needs more than _STREAMING_BYTES).
 
     Returns:
         numpy.array: array with the circles position and radius where each row
                      contains [row_id, col_id, radius]
     """
-    row_size, col_size = edge_img.shape
-    H = np.zeros((row_size, col_size, 0))
-    row_range = np.linspace(0, col_size - 1, col_size)
-    col_range = np.linspace(0, row_size - 1, row_size)
-    peaks = np.zeros((0, 4))
-    circles = np.zeros((0, 4))
-    for r_index, r in enumerate(radii):
-        # vote for circles given radius r
-        h = hough_circles_acc(img_orig, edge_img, radius=r, point_plus=True)
-        H = np.concatenate((H, h.reshape((row_size, col_size, 1))), axis=2)
-        # get the possible peaks for radius r
-        possible_peaks = hough_peaks(h, hough_threshold=hough_threshold, nhood_delta=nhood_delta)
-        if len(possible_peaks) > 0:
-            values = h[possible_peaks[:, 0], possible_peaks[:, 1]]
-            # insert radius to the matrix
-            possible_peaks = np.insert(possible_peaks, possible_peaks.shape[1], r_index, axis=1)
-            # concat peaks with values
-            possible_peaks = np.concatenate((possible_peaks, values.reshape(values.shape[0], 1)), axis=1)
-            peaks = np.concatenate((peaks, possible_peaks))
-
-    peaks = peaks[peaks[:, peaks.shape[1]-1].argsort()[::-1]].astype(np.int)
-
-    # Since our H is 3-D, we want to use the most voted circle and remove the other radius
-    for peak in peaks:
-        x, y, z = peak[:3]
-        if H[x, y, z] == peak[3]:
-            x0 = x - nhood_delta[1] if x >= nhood_delta[1] else 0
-            x1 = x + nhood_delta[1] + 1 if x <= (col_range.size - nhood_delta[1]) else col_range.size
-            y0 = y - nhood_delta[0] if y >= nhood_delta[0] else 0
-            y1 = y + nhood_delta[0] + 1 if y <= (row_range.size - nhood_delta[0]) else row_range.size
-            # set values around the peak to 0
-            for i in xrange(len(radii)):
-                H[x0:x1, y0:y1, i] = 0
-            # restore the peak value
-            H[x, y, z] = peak[3]
-            # only interested in the peaks that are not replaced
-            circles = np.concatenate((circles, [[x, y, radii[z], peak[3]]]))
+    rows, cols, sin_t, cos_t = _edge_gradient_directions(img_orig, edge_img)
+    dtype, work = _find_circles_types(len(rows))
+    # the 3-D array plus the largest of: the float64 vote counts of a plane, the suppression of a plane (maximum
+    # over the radius window and its dilation) or the plateau drawings
+    needed = edge_img.size * (len(radii) * dtype.itemsize +
+                              max(8, dtype.itemsize + 2 * work + 2, ((radius_delta or 0) + 4) * work + 1))
+    if needed > (_STREAMING_BYTES if max_bytes is None else max_bytes):
+        args = (rows, cols, sin_t, cos_t, edge_img.shape, radii, hough_threshold, nhood_delta)
+        if radius_delta is None:
+            return _find_circles_best_radius(*args, max_bytes=max_bytes)
+        return _find_circles_rolling(*args, radius_delta=radius_delta, max_bytes=max_bytes)
+
+    # vote for circles for all radii at once
+    H = _vote_circles(rows, cols, sin_t, cos_t, radii, edge_img.shape, _vote_chunk_size(needed, max_bytes))
+    threshold = _normalized_threshold(H, hough_threshold)
+    peaks = _local_maxima(H, (radius_delta, nhood_delta[1], nhood_delta[0]), threshold)
+    return _circles_from_peaks(peaks, H.shape, radii)
+
+
+# memory (in bytes) needed by the 3-D accumulator array above which find_circles streams the radii by default
+_STREAMING_BYTES = 2 ** 26
 
-    return circles[:, :3]
+# number of votes _vote_circles casts at once when there is no memory ceiling, and the least it is given otherwise
+_VOTE_CHUNK = 2 ** 20
+_MIN_VOTE_CHUNK = 2 ** 14
+
+
+def _find_circles_types(n_edges):
+    """Returns the accumulator dtype of find_circles and the itemsize of the arrays used to suppress it.
+
+    Args:
+        n_edges (int): number of edge pixels.
+
+    Returns:
+        tuple: accumulator numpy.dtype and the largest itemsize used by _max_filter and _settle_plateaus_dense.
+    """
+    max_votes = _POINT_PLUS_VOTES * n_edges
+    return _accumulator_dtype(max_votes), np.dtype(_dilation_type(0, max_votes + 1)).itemsize
+
+
+def _vote_chunk_size(needed, max_bytes):
+    """Returns the number of votes _vote_circles can cast at once with the memory left by max_bytes.
+
+    Args:
+        needed (int): bytes taken by every other array.
+        max_bytes (int): memory ceiling in bytes, or None for no limit.
+
+    Returns:
+        int: chunk_size argument of _vote_circles.
+    """
+    if max_bytes is None:
+        return _VOTE_CHUNK
+    chunk_size = min(_VOTE_CHUNK, (max_bytes - needed) // _BYTES_PER_VOTE)
+    if chunk_size < _MIN_VOTE_CHUNK:
+        raise ValueError("find_circles needs at least {} bytes for this image, max_bytes={}".format(
+            needed + _MIN_VOTE_CHUNK * _BYTES_PER_VOTE, max_bytes))
+    return chunk_size
+
+
+def _find_circles_best_radius(rows, cols, sin_t, cos_t, shape, radii, hough_threshold, nhood_delta, max_bytes):
+    """Streaming version of find_circles that suppresses across all radii.
+
+    Only the best votes of each bin across the radii seen so far are kept, along with the radius index they
+    belong to and whether they passed the threshold. Ties go to the first radius that passed the threshold, and
+    plateaus are settled in (radius, row, col) order like in the 3-D array.
+
+    Args:
+        rows, cols, sin_t, cos_t (numpy.array): edge pixels and gradient directions (see _vote_circles).
+        shape (tuple): edge image shape (rows, cols).
+        radii (list): list of radii values to search for.
+        hough_threshold (int): minimum value in each normalized radius accumulator.
+        nhood_delta (tuple): non-maximal suppression deltas in the column and row directions.
+        max_bytes (int): memory ceiling (in bytes) for the accumulator arrays kept alive.
+
+    Returns:
+        numpy.array: array with the circles position and radius where each row
+                     contains [row_id, col_id, radius]
+    """
+    dtype, work = _find_circles_types(len(rows))
+    index_type = _accumulator_dtype(len(radii))
+    # running best votes, radius index and mask, plus the largest of: voting a radius (its accumulator and float64
+    # vote counts while the previous accumulator and masks are alive) or the final suppression (the last
+    # accumulator and masks, dilations and plateau drawings)
+    needed = shape[0] * shape[1] * (dtype.itemsize + index_type.itemsize + 1 +
+                                    max(2 * dtype.itemsize + 8 + 2, dtype.itemsize + 4 * work + 4))
+    chunk_size = _vote_chunk_size(needed, max_bytes)
+
+    best = np.zeros(shape, dtype=dtype)
+    best_index = np.zeros(shape, dtype=index_type)
+    best_mask = np.zeros(shape, dtype=bool)
+    for i, r in enumerate(radii):
+        h = _vote_circles(rows, cols, sin_t, cos_t, [r], shape, chunk_size)[0]
+        mask = h >= _normalized_threshold(h[np.newaxis], hough_threshold)[0]
+        better = h == best
+        better &= mask
+        better &= ~best_mask
+        better |= h > best
+        np.copyto(best, h, where=better)
+        best_index[better] = i
+        np.copyto(best_mask, mask, where=better)
+
+    found = np.flatnonzero(best_mask & (best == _max_filter(best, (nhood_delta[1], nhood_delta[0]))))
+    peaks = _settle_plateaus(best.flat[found], best_index.flat[found].astype(np.int64) * best.size + found,
+                             (len(radii),) + tuple(shape), (None, nhood_delta[1], nhood_delta[0]))
+    values = best.flat[peaks % best.size].astype(np.float64)
+    return _circles_from_peaks(peaks[np.lexsort((peaks, -values))], (len(radii),) + tuple(shape), radii)
+
+
+def _find_circles_rolling(rows, cols, sin_t, cos_t, shape, radii, hough_threshold, nhood_delta, radius_delta,
+                          max_bytes):
+    """Streaming version of find_circles that suppresses across radius_delta radii.
+
+    A rolling window of radius accumulators (with their threshold mask and 2-D max filter) is kept. The local
+    maxima of a radius are collected once the radius_delta radii after it have been voted, and its plateaus are
+    settled against the local maxima of the radius_delta radii before it like in the 3-D array. Then the
+    accumulators that are no longer needed are released.
+
+    Args:
+        rows, cols, sin_t, cos_t (numpy.array): edge pixels and gradient directions (see _vote_circles).
+        shape (tuple): edge image shape (rows, cols).
+        radii (list): list of radii values to search for.
+        hough_threshold (int): minimum value in each normalized radius accumulator.
+        nhood_delta (tuple): non-maximal suppression deltas in the column and row directions.
+        radius_delta (int): distance in radii indices over which non-maximal suppression should take place.
+        max_bytes (int): memory ceiling (in bytes) for the accumulator arrays kept alive.
+
+    Returns:
+        numpy.array: array with the circles position and radius where each row
+                     contains [row_id, col_id, radius]
+    """
+    dtype, work = _find_circles_types(len(rows))
+    # accumulator, mask and max filter of the other radii in the window, plus the largest of: voting a radius
+    # (its accumulator and float64 vote counts) or suppressing one (its arrays, masks and plateau drawings)
+    entry = dtype.itemsize + 1 + work
+    needed = shape[0] * shape[1] * (2 * radius_delta * entry +
+                                    max(dtype.itemsize + 8, entry + (radius_delta + 3) * work + 2))
+    chunk_size = _vote_chunk_size(needed, max_bytes)
+
+    def max_filter(a):
+        return _max_filter(a, (nhood_delta[1], nhood_delta[0]))
+
+    n = len(radii)
+    window = {}
+    maxima = {}  # flat (radius, row, col) indices and values of the local maxima of each radius
+    peaks, values = [], []
+    for j in range(n + radius_delta):
+        if j < n:
+            h = _vote_circles(rows, cols, sin_t, cos_t, [radii[j]], shape, chunk_size)[0]
+            mask = h >= _normalized_threshold(h[np.newaxis], hough_threshold)[0]
+            window[j] = (h, mask, max_filter(h))
+
+        i = j - radius_delta
+        if i < 0:
+            continue
+        h, candidates, h_max = window[i]
+        for k in range(max(0, i - radius_delta), min(n, i + radius_delta + 1)):
+            if k != i:
+                candidates &= h >= window[k][2]
+        candidates &= h == h_max
+        found = np.flatnonzero(candidates)
+        maxima[i] = (i * h.size + found, h.flat[found])
+
+        earlier = [maxima[k] for k in range(max(0, i - radius_delta), i + 1)]
+        found = _settle_plateaus(np.concatenate([m[1] for m in earlier]), np.concatenate([m[0] for m in earlier]),
+                                 (n,) + tuple(shape), (radius_delta, nhood_delta[1], nhood_delta[0]))
+        found = found[found >= i * h.size]
+        peaks.append(found)
+        values.append(h.flat[found - i * h.size].astype(np.float64))
+        window.pop(i - radius_delta, None)
+        maxima.pop(i - radius_delta, None)
+
+    peaks, values = np.concatenate(peaks), np.concatenate(values)
+    return _circles_from_peaks(peaks[np.lexsort((peaks, -values))], (n,) + tuple(shape), radii)
+
+
+def _normalized_threshold(H, hough_threshold):
+    """Returns the threshold of each radius accumulator in accumulator units.
+
+    This is the same test hough_peaks performs on each H[i] normalized to [0, 255] (cv2.NORM_MINMAX), moved to
+    the accumulator units to avoid a normalized copy of the whole array.
+
+    Args:
+        H (numpy.array): 3-D Hough accumulator array.
+        hough_threshold (int): minimum value in the normalized accumulator.
+
+    Returns:
+        numpy.array: float64 array with the minimum votes of each radius, H[i] >= threshold[i] passes.
+    """
+    h_min = H.min(axis=(1, 2)).astype(np.float64)
+    h_max = H.max(axis=(1, 2)).astype(np.float64)
+    threshold = h_min + hough_threshold * (h_max - h_min) / 255.
+    # constant accumulators are normalized to zero
+    threshold[h_max == h_min] = -np.inf if hough_threshold <= 0 else np.inf
+    return threshold
+
+
+def _circles_from_peaks(peaks, shape, radii):
+    """Builds the circles array from the flat indices of the peaks of a 3-D Hough accumulator array.
+
+    Args:
+        peaks (numpy.array): flat indices of the peaks.
+        shape (tuple): Hough accumulator array shape (radii, rows, cols).
+        radii (list): list of radii values, one for each radius index.
+
+    Returns:
+        numpy.array: array with the circles position and radius where each row
+                     contains [row_id, col_id, radius]
+    """
+    r_index, row_id, col_id = np.unravel_index(peaks, shape)
+    return np.column_stack((row_id, col_id, np.asarray(radii, dtype=np.float64)[r_index]))
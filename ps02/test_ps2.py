@@ -0,0 +1,288 @@
+"""
+Tests for the Hough transform functions in ps2.py.
+
+How to run:
+python -m unittest test_ps2
+"""
+
+import math
+import timeit
+import unittest
+
+import cv2
+import numpy as np
+
+import benchmark
+import ps2
+
+
+def _best_time(function, repeat=3):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def _argmin_lines_acc(img_edges, rho_res, img_orig=None, theta_window=None):
+    # the votes of the original hough_lines_acc, np.argmin(np.abs(rho - d)) for every (edge, theta) pair. With a
+    # theta_window, only the theta bins around the gradient orientation of the edge, folded into [0, pi)
+    rho, theta = ps2._hough_lines_bins(img_edges.shape, rho_res, np.pi / 180)
+    rows, cols = np.where(img_edges == 255)
+    if theta_window is not None:
+        grad_x = cv2.Sobel(img_orig, cv2.CV_64F, 1, 0, ksize=3)
+        grad_y = cv2.Sobel(img_orig, cv2.CV_64F, 0, 1, ksize=3)
+    H = np.zeros((rho.size, theta.size), dtype=np.int64)
+    for y, x in zip(rows, cols):
+        t_index = np.arange(theta.size)
+        if theta_window is not None:
+            center = int(np.round(math.atan2(grad_y[y, x], grad_x[y, x]) % np.pi / (np.pi / 180)))
+            t_index = np.arange(center - theta_window, center + theta_window + 1) % theta.size
+        d = x * np.cos(theta[t_index]) + y * np.sin(theta[t_index])
+        H[np.argmin(np.abs(rho[:, np.newaxis] - d), axis=0), t_index] += 1
+    return H
+
+
+class HoughLinesAccTest(unittest.TestCase):
+
+    def test_matches_argmin_votes(self):
+        # every vote in the same bin, including the ones half a rho step between two bins
+        edges = benchmark.make_scene((120, 160), seed=0)['edges']
+        for rho_res in (1, 2, 3):
+            H = ps2.hough_lines_acc(edges, rho_res)[0]
+            np.testing.assert_array_equal(H, _argmin_lines_acc(edges, rho_res))
+
+    def test_theta_window(self):
+        scene = benchmark.make_scene((120, 160), seed=0)
+        H = ps2.hough_lines_acc(scene['edges'])[0]
+        # a window wider than [0, pi) wraps around and votes once in every theta bin
+        H_full = ps2.hough_lines_acc(scene['edges'], img_orig=scene['img'], theta_window=90)[0]
+        np.testing.assert_array_equal(H_full, H)
+
+        H_window = ps2.hough_lines_acc(scene['edges'], img_orig=scene['img'], theta_window=3)[0]
+        self.assertEqual(H_window.dtype, H.dtype)
+        np.testing.assert_array_equal(H_window, _argmin_lines_acc(scene['edges'], 1, scene['img'], 3))
+        self.assertEqual(H_window.sum(), H.sum() * 7 // 180)
+
+        with self.assertRaises(ValueError):
+            ps2.hough_lines_acc(scene['edges'], theta_window=3)
+
+
+class HoughLinesRandomTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scene = benchmark.make_scene((1080, 1920), seed=0)
+
+    def test_accumulator_matches_hough_lines_acc(self):
+        # with an unreachable vote_threshold every edge pixel is sampled and no votes are withdrawn
+        H, rho, theta = ps2.hough_lines_acc(self.scene['edges'])
+        H_random, rho_random, theta_random, segments = ps2.hough_lines_random(self.scene['edges'],
+                                                                              vote_threshold=10 ** 9, seed=0)
+        self.assertEqual(H_random.dtype, H.dtype)
+        np.testing.assert_array_equal(H_random, H)
+        np.testing.assert_array_equal(rho_random, rho)
+        np.testing.assert_array_equal(theta_random, theta)
+        self.assertEqual(segments.shape, (0, 4))
+
+    def test_segments_lie_on_the_planted_lines(self):
+        segments = ps2.hough_lines_random(self.scene['edges'], seed=0)[3]
+        self.assertGreater(len(segments), 0)
+        rho, theta = self.scene['lines'].T
+        for x1, y1, x2, y2 in segments:
+            distance = np.maximum(np.abs(x1 * np.cos(theta) + y1 * np.sin(theta) - rho),
+                                  np.abs(x2 * np.cos(theta) + y2 * np.sin(theta) - rho))
+            self.assertLessEqual(distance.min(), 2.)
+
+    def test_not_much_slower_than_hough_lines_acc(self):
+        # the batches only update and check the bins they vote for, instead of the whole accumulator
+        edges = self.scene['edges']
+        acc = _best_time(lambda: ps2.hough_lines_acc(edges))
+        random = _best_time(lambda: ps2.hough_lines_random(edges, seed=0))
+        self.assertLess(random, 4 * acc + 0.1)
+
+
+@unittest.skipUnless(hasattr(np, 'int'), 'hough_peaks needs np.int (numpy < 1.24)')
+class HoughLinesPyramidTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scenes = [benchmark.make_scene(shape, 8, 6, (15, 30), 0.002, seed=seed)
+                      for seed, shape in enumerate([(480, 640), (720, 1280), (1080, 1920)] * 4)]
+
+    def test_votes_match_hough_lines_acc(self):
+        for scene in self.scenes:
+            H = ps2.hough_lines_acc(scene['edges'])[0]
+            H_pyramid = ps2.hough_lines_acc_pyramid(scene['edges'])[0]
+            self.assertEqual(H_pyramid.dtype, H.dtype)
+            self.assertTrue(((H_pyramid == H) | (H_pyramid == 0)).all())
+
+    def test_coarse_pass_finds_the_strong_lines(self):
+        # the lines that reach 100 in the normalized full accumulator, see hough_lines_acc_pyramid
+        for scene in self.scenes:
+            H, rho, theta = ps2.hough_lines_acc(scene['edges'])
+            H_pyramid = ps2.hough_lines_acc_pyramid(scene['edges'], hough_threshold=50)[0]
+            for line_rho, line_theta in scene['lines']:
+                r = np.argmin(np.abs(rho - line_rho))
+                t = np.argmin(np.abs(theta - line_theta))
+                around = (slice(max(0, r - 3), r + 4), slice(max(0, t - 2), t + 3))
+                if H[around].max() * 255. / H.max() >= 100:
+                    self.assertEqual(H_pyramid[around].max(), H[around].max())
+
+
+class HoughPeaksNMSTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.H = np.zeros((20, 30), dtype=np.uint16)
+        cls.H[5, 5] = 100
+        cls.H[6, 6] = 90  # inside the neighbourhood of (5, 5)
+        cls.H[15, 20] = 80
+        cls.H[10, 25] = cls.H[10, 26] = cls.H[11, 25] = 70  # a plateau
+        cls.H[2, 28] = 70  # the same value, outside the neighbourhood of the plateau
+        cls.H[18, 2] = 10  # below the threshold, 40 / 255 of the maximum
+
+    def test_peaks(self):
+        expected = [[5, 5], [15, 20], [2, 28], [10, 25]]
+        for H in (self.H, self.H.astype(np.float64)):
+            np.testing.assert_array_equal(ps2.hough_peaks_nms(H, 40, (2, 2)), expected)
+            np.testing.assert_array_equal(ps2.hough_peaks_nms(H, 40, (2, 2), max_peaks=2), expected[:2])
+            np.testing.assert_array_equal(ps2.hough_peaks_nms(H, 210, (2, 2)), expected[:1])
+            np.testing.assert_array_equal(ps2.hough_peaks_nms(H, 255, (2, 2)), expected[:1])
+        self.assertEqual(ps2.hough_peaks_nms(self.H, 300, (2, 2)).shape, (0, 2))
+
+    def test_plateaus_keep_the_first_element(self):
+        # many plateaus of small integers, settled by comparing pairs and by dilations
+        a = np.random.RandomState(0).randint(0, 4, (4, 30, 40)).astype(np.uint8)
+        for nhood_delta in [(1, 2, 2), (None, 1, 3)]:
+            expected = _settled_maxima(a, nhood_delta)
+            np.testing.assert_array_equal(ps2._local_maxima(a, nhood_delta), expected)
+            pairs, ps2._PLATEAU_PAIRS = ps2._PLATEAU_PAIRS, 0
+            try:
+                np.testing.assert_array_equal(ps2._local_maxima(a, nhood_delta), expected)
+            finally:
+                ps2._PLATEAU_PAIRS = pairs
+
+
+def _settled_maxima(a, nhood_delta, allowed=None):
+    # the (allowed) elements that are the maximum of their neighbourhood, without an earlier one of the same value
+    # in it
+    def nhood(i):
+        return tuple(slice(None) if delta is None else slice(max(k - delta, 0), k + delta + 1)
+                     for k, delta in zip(np.unravel_index(i, a.shape), nhood_delta))
+
+    maxima = np.array([a.flat[i] == a[nhood(i)].max() for i in range(a.size)]).reshape(a.shape)
+    if allowed is not None:
+        maxima &= allowed
+    kept = []
+    for i in np.flatnonzero(maxima):
+        ties = np.zeros(a.shape, dtype=bool)
+        ties[nhood(i)] = maxima[nhood(i)] & (a[nhood(i)] == a.flat[i])
+        if np.flatnonzero(ties)[0] == i:
+            kept.append(i)
+    kept = np.array(kept, dtype=np.int64)
+    return kept[np.lexsort((kept, -a.flat[kept].astype(np.float64)))]
+
+
+def _point_plus_acc(img_orig, img_edges, radius):
+    # the 'point plus' votes of the original hough_circles_acc, one edge pixel at a time
+    row_size, col_size = img_edges.shape
+    H = np.zeros((row_size, col_size))
+    grad_x = cv2.Sobel(img_orig, cv2.CV_64F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(img_orig, cv2.CV_64F, 0, 1, ksize=3)
+    for y, x in zip(*np.where(img_edges == 255)):
+        t = math.atan2(grad_y[y, x], grad_x[y, x])
+        a1, a2 = [int(np.round(y + sign * radius * math.sin(t))) for sign in (1, -1)]
+        b1, b2 = [int(np.round(x + sign * radius * math.cos(t))) for sign in (1, -1)]
+        for a, b in [(a1, b1), (a1, b2), (a2, b1), (a2, b2)]:
+            if 0 <= a < row_size and 0 <= b < col_size:
+                H[max(a - 1, 0):a + 2, max(b - 1, 0):b + 2] += 1
+                H[a, b] += 10
+    return H
+
+
+class HoughCirclesAccTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.img = np.zeros((60, 80), dtype=np.uint8)
+        cv2.circle(cls.img, (30, 25), 12, 255, -1)
+        cv2.circle(cls.img, (70, 50), 15, 128, -1)
+        cls.edges = cv2.Canny(cls.img, 50, 150)
+
+    def test_matches_original_votes(self):
+        for radius in (12, 15, 20):
+            H = ps2.hough_circles_acc(self.img, self.edges, radius)
+            np.testing.assert_array_equal(H, _point_plus_acc(self.img, self.edges, radius))
+
+    def test_volume_stacks_every_radius(self):
+        radii = [10, 12, 15, 20]
+        H = ps2.hough_circles_volume(self.img, self.edges, radii)
+        self.assertEqual(H.shape, (len(radii),) + self.edges.shape)
+        self.assertTrue(H.flags.c_contiguous)
+        for plane, radius in zip(H, radii):
+            np.testing.assert_array_equal(plane, _point_plus_acc(self.img, self.edges, radius))
+        self.assertEqual(ps2.hough_circles_volume(self.img, np.zeros_like(self.edges), radii).max(), 0)
+
+    def test_chunks_match_one_pass(self):
+        rows, cols, sin_t, cos_t = ps2._edge_gradient_directions(self.img, self.edges)
+        H = ps2._vote_circles(rows, cols, sin_t, cos_t, [12, 15], self.edges.shape)
+        for chunk_size in (1, 100):
+            H_chunks = ps2._vote_circles(rows, cols, sin_t, cos_t, [12, 15], self.edges.shape, chunk_size)
+            np.testing.assert_array_equal(H_chunks, H)
+
+
+class FindCirclesTest(unittest.TestCase):
+
+    radii = list(range(15, 31))
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scene = benchmark.make_scene((240, 320), 4, 4, (15, 30), 0.002, seed=0)
+
+    def test_finds_the_planted_circles(self):
+        circles = ps2.find_circles(self.scene['img'], self.scene['edges'], self.radii, 100, (2, 2))
+        for row, col, radius in self.scene['circles']:
+            distance = np.abs(circles - [row, col, radius]).max(axis=1)
+            self.assertLessEqual(distance.min(), 2)
+
+    def test_matches_brute_force_suppression(self):
+        # the planted circles plus noise, on a small image so that every bin can be checked one at a time
+        img, edges = self.scene['img'][:100, :120], self.scene['edges'][:100, :120]
+        radii = [15, 16, 17, 18]
+        H = ps2.hough_circles_volume(img, edges, radii)
+        passed = H >= ps2._normalized_threshold(H, 60)[:, np.newaxis, np.newaxis]
+        for radius_delta in (None, 1):
+            peaks = _settled_maxima(H, (radius_delta, 2, 2), passed)
+            expected = np.column_stack(np.unravel_index(peaks, H.shape))
+            expected[:, 0] = np.asarray(radii)[expected[:, 0]]
+            circles = ps2.find_circles(img, edges, radii, 60, (2, 2), radius_delta=radius_delta)
+            np.testing.assert_array_equal(circles, expected[:, [1, 2, 0]])
+
+    def test_streaming_matches_volume(self):
+        # the 3-D array would need 6.2 MB (6.8 MB with radius_delta=2), so a 6 MB ceiling streams the radii
+        for radius_delta in (None, 2):
+            circles = ps2.find_circles(self.scene['img'], self.scene['edges'], self.radii, 60, (2, 2),
+                                       radius_delta=radius_delta)
+            streamed = ps2.find_circles(self.scene['img'], self.scene['edges'], self.radii, 60, (2, 2),
+                                        radius_delta=radius_delta, max_bytes=6 * 10 ** 6)
+            np.testing.assert_array_equal(streamed, circles)
+
+
+@unittest.skipUnless(hasattr(np, 'int'), 'hough_peaks needs np.int (numpy < 1.24)')
+class HoughCirclesPyramidTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scenes = [benchmark.make_scene(shape, 8, 6, (15, 30), 0.002, seed=seed)
+                      for seed, shape in enumerate([(480, 640), (1080, 1920)])]
+
+    def test_coarse_pass_finds_the_circles(self):
+        for scene in self.scenes:
+            for row, col, radius in scene['circles']:
+                H = ps2.hough_circles_acc(scene['img'], scene['edges'], radius)
+                H_pyramid = ps2.hough_circles_acc_pyramid(scene['img'], scene['edges'], radius)
+                self.assertEqual(H_pyramid.dtype, H.dtype)
+                self.assertTrue(((H_pyramid == H) | (H_pyramid == 0)).all())
+                around = (slice(int(row) - 2, int(row) + 3), slice(int(col) - 2, int(col) + 3))
+                self.assertEqual(H_pyramid[around].max(), H[around].max())
+
+
+if __name__ == '__main__':
+    unittest.main()
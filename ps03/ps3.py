@@ -1,8 +1,11 @@
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 import cv2
 import numpy as np
 
 
-def disparity_ssd(img1, img2, direction, w_size, dmax):
+def disparity_ssd(img1, img2, direction, w_size, dmax, return_costs=False, subpixel=False):
     """Returns a disparity map D(y, x) using the Sum of Squared Differences.
 
     Assuming img1 and img2 are the left (L) and right (R) images from the same scene. The disparity image contains
@@ -29,6 +32,9 @@ def disparity_ssd(img1, img2, direction, w_size, dmax):
     For each location r, c the SSD for an offset d is in DSI(r,c,d). The best match for pixel r,c is represented by
     the index d for which DSI(r,c,d) is smallest.
 
+    The DSI is not stored: the costs of each d are compared against a running best cost and best d image, so only a
+    few images of the input size are kept in memory regardless of dmax.
+
     Args:
         img1 (numpy.array): grayscale image, in range [0.0, 1.0].
         img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
@@ -36,31 +42,21 @@ def disparity_ssd(img1, img2, direction, w_size, dmax):
                          if 0: match left to right (shift img2 right).
         w_size (tuple): window size, type int representing both height and width (h, w).
         dmax (int): maximum value of pixel disparity to test.
+        return_costs (bool): also return the best and second best SSD of every pixel. Default set to False.
+        subpixel (bool): refine the disparities to sub-pixel precision with a parabola fit through the SSD of the
+                         neighbouring disparities, computed in the same pass. Default set to False.
 
     Returns:
         numpy.array: Disparity map of type int64, 2-D array of the same shape as img1 or img2.
                      This array contains the d values representing how far a certain pixel has been displaced.
-                     Return without normalizing or clipping.
+                     Return without normalizing or clipping. Type float32 if subpixel is True.
+        If return_costs is True, a tuple (disparity map, best cost, second best cost) with the costs of type float64.
     """
-    y, x = img1.shape
-    disparity_map = np.zeros((y, x, dmax))
-    kernel = np.ones(w_size) / (w_size[0] * w_size[1])
-
-    if direction == 0:
-        for d in xrange(0, dmax):
-            shift = cv2.copyMakeBorder(img2[:, :(-d or None)], 0, 0, d, 0, cv2.BORDER_REPLICATE)
-            disparity_map[:, :, d] = cv2.filter2D((img1 - shift) ** 2, -1, kernel)
-    elif direction == 1:
-        for d in xrange(0, dmax):
-            shift = cv2.copyMakeBorder(img1[:, d:], 0, 0, 0, d, cv2.BORDER_REPLICATE)
-            disparity_map[:, :, d] = cv2.filter2D((img2 - shift) ** 2, -1, kernel)
-
-    disp_img = np.argmin(disparity_map, axis=2)
+    return _winner_take_all(_ssd_costs(img1, img2, direction, w_size, dmax), img1.shape,
+                            return_costs=return_costs, subpixel=subpixel)
 
-    return disp_img
 
-
-def disparity_ncorr(img1, img2, direction, w_size, dmax):
+def disparity_ncorr(img1, img2, direction, w_size, dmax, return_costs=False, zero_mean=False, subpixel=False):
     """Returns a disparity map D(y, x) using the normalized correlation method.
 
     This method uses a similar approach used in disparity_ssd replacing SDD with the normalized correlation metric.
@@ -68,7 +64,8 @@ def disparity_ncorr(img1, img2, direction, w_size, dmax):
     For more information refer to:
     https://software.intel.com/en-us/node/504333
 
-    Unlike SSD, the best match for pixel r,c is represented by the index d for which DSI(r,c,d) is highest.
+    Unlike SSD, the best match for pixel r,c is represented by the index d for which DSI(r,c,d) is highest. As in
+    disparity_ssd, only the running best values are kept instead of the whole DSI.
 
     Args:
         img1 (numpy.array): grayscale image, in range [0.0, 1.0].
@@ -77,35 +74,1202 @@ def disparity_ncorr(img1, img2, direction, w_size, dmax):
                          if 0: match left to right (shift img2 right).
         w_size (tuple): window size, type int representing both height and width (h, w).
         dmax (int): maximum value of pixel disparity to test.
+        return_costs (bool): also return the best and second best correlation of every pixel. Default set to False.
+        zero_mean (bool): subtract the window means before correlating (zero-mean normalized cross correlation),
+                          which makes the metric invariant to brightness offsets. Default set to False.
+        subpixel (bool): refine the disparities to sub-pixel precision, as in disparity_ssd. Default set to False.
 
     Returns:
         numpy.array: Disparity map of type int64, 2-D array of the same shape size as img1 or img2.
                      This array contains the d values representing how far a certain pixel has been displaced.
-                     Return without normalizing or clipping.
+                     Return without normalizing or clipping. Type float32 if subpixel is True.
+        If return_costs is True, a tuple (disparity map, best correlation, second best correlation) with the
+        correlations of type float64.
+    """
+    return _winner_take_all(_ncorr_costs(img1, img2, direction, w_size, dmax, zero_mean), img1.shape,
+                            maximize=True, return_costs=return_costs, subpixel=subpixel)
+
+
+def disparity_census(img1, img2, direction, w_size, dmax, c_size=(5, 5), return_costs=False, subpixel=False):
+    """Returns a disparity map D(y, x) using the census transform matching cost.
+
+    Every pixel is described by a bit string that says which of its neighbours in a c_size window are darker than
+    it (see census_transform). The cost of a disparity is the Hamming distance between the bit strings of the
+    matched pixels, averaged over a w_size window as in disparity_ssd. Since only the order of the intensities
+    matters, the cost is not affected by brightness and contrast changes such as increase_contrast.
+
+    Refer to: Zabih, R. and Woodfill, J. "Non-parametric local transforms for computing visual correspondence."
+    (1994).
+
+    Args:
+        img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size, type int representing both height and width (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        c_size (tuple): census window size (h, w), at most 64 pixels.
+        return_costs (bool): also return the best and second best cost of every pixel. Default set to False.
+        subpixel (bool): refine the disparities to sub-pixel precision, as in disparity_ssd. Default set to False.
+
+    Returns:
+        numpy.array: Disparity map of type int64 (float32 if subpixel is True), 2-D array of the same shape as img1
+                     or img2.
+        If return_costs is True, a tuple (disparity map, best cost, second best cost) with the costs (mean Hamming
+        distances) of type float64.
+    """
+    return _winner_take_all(_census_costs(img1, img2, direction, w_size, dmax, c_size), img1.shape,
+                            return_costs=return_costs, subpixel=subpixel)
+
+
+def census_transform(img, c_size=(5, 5)):
+    """Returns the census transform of an image packed into 64-bit integers.
+
+    Bit k of a pixel is set when the k-th neighbour of its c_size window (row by row, skipping the center) is
+    darker than the pixel. The image borders are extended with BORDER_REFLECT_101.
+
+    Args:
+        img (numpy.array): grayscale image.
+        c_size (tuple): census window size (h, w), with h * w - 1 <= 64.
+
+    Returns:
+        numpy.array: census bit strings of type uint64, same shape as img.
+    """
+    h, w = c_size
+    if h * w - 1 > 64:
+        raise ValueError("c_size {} has more than 64 neighbours".format(c_size))
+
+    img = np.asarray(img, dtype=np.float64)
+    y, x = img.shape
+    top, left = h // 2, w // 2
+    padded = cv2.copyMakeBorder(img, top, h - 1 - top, left, w - 1 - left, cv2.BORDER_REFLECT_101)
+
+    codes = np.zeros(img.shape, dtype=np.uint64)
+    bits = np.empty(img.shape, dtype=np.uint64)
+    darker = np.empty(img.shape, dtype=np.bool_)
+    k = 0
+    for i in range(h):
+        for j in range(w):
+            if i == top and j == left:
+                continue
+            np.less(padded[i:i + y, j:j + x], img, out=darker)
+            np.left_shift(darker, np.uint64(k), out=bits, casting='unsafe')
+            codes |= bits
+            k += 1
+    return codes
+
+
+def disparity_lr(img1, img2, w_size, dmax, metric='ssd', tolerance=1, subpixel=False):
+    """Returns the left and right disparity maps, their left-right consistency and an occlusion filled left map.
+
+    This gives the same maps as calling disparity_ssd (or disparity_ncorr) with direction 0 and 1, but the window
+    costs are computed once. Both directions compare the same pixel pairs: the right-to-left cost of pixel x at
+    disparity d is the left-to-right cost of pixel x + d. So the direction 1 winner-take-all reads the direction 0
+    costs moved d columns, and only the border columns are filtered again (see _lr_costs). Each direction still
+    runs its own winner-take-all (and ncorr normalization), which cost about as much as the window sums, so the
+    two maps take nearly as long as the two separate calls.
+
+    A left pixel x is consistent when its match in the right image points back to it:
+    abs(D_L(y, x) - D_R(y, x - D_L(y, x))) <= tolerance. Inconsistent pixels (mostly occlusions and mismatches)
+    are filled with the lower of the nearest consistent disparities to their left and right on the same row, as
+    occluded pixels belong to the background.
+
+    Args:
+        img1 (numpy.array): left grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): right grayscale image, in range [0.0, 1.0] same shape as img1.
+        w_size (tuple): window size, type int representing both height and width (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        metric (str): 'ssd' or 'ncorr'.
+        tolerance (int): maximum left-right disparity difference of a consistent pixel.
+        subpixel (bool): return float32 sub-pixel disparity maps, as in disparity_ssd.
+
+    Returns:
+        tuple: (D_L, D_R, consistent, D_filled). D_L and D_R are the int64 (float32 if subpixel is True) disparity
+               maps of direction 0 and 1,
+               consistent is a boolean mask of the left pixels that pass the check and D_filled is D_L with the
+               inconsistent pixels filled in.
+    """
+    maximize = metric == 'ncorr'
+    wta_l = _WinnerTakeAll(img1.shape, maximize, subpixel=subpixel)
+    wta_r = _WinnerTakeAll(img1.shape, maximize, subpixel=subpixel)
+    for d, cost_l, costs_r in _lr_costs(img1, img2, w_size, dmax, metric):
+        wta_l.update(d, cost_l)
+        for columns, cost_r in costs_r:
+            wta_r.update(d, cost_r, columns)
+    if subpixel:
+        d_l, d_r = wta_l.subpixel_disparity(), wta_r.subpixel_disparity()
+    else:
+        d_l, d_r = wta_l.disp_img, wta_r.disp_img
+
+    consistent = _lr_consistency(d_l, d_r, tolerance)
+    return d_l, d_r, consistent, _fill_occlusions(d_l, consistent)
+
+
+def _lr_costs(img1, img2, w_size, dmax, metric):
+    """Yields the direction 0 and direction 1 window costs of every disparity d in [0, dmax).
+
+    The direction 1 costs come in column pieces (see _shifted_strips): the inner columns are a view of the direction
+    0 costs moved d columns and only the border strips are filtered again. For ncorr the pieces of the cross term
+    are gathered and normalized in their own buffer.
+
+    Args:
+        img1 (numpy.array): left grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): right grayscale image, in range [0.0, 1.0] same shape as img1.
+        w_size (tuple): window size (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        metric (str): 'ssd' or 'ncorr'.
+
+    Yields:
+        tuple: (d, direction 0 cost image, list of (columns slice, direction 1 costs of these columns)). The arrays
+               are overwritten by the next iteration.
+    """
+    if metric not in ('ssd', 'ncorr'):
+        raise ValueError("metric must be 'ssd' or 'ncorr', got {!r}".format(metric))
+
+    img1 = np.asarray(img1, dtype=np.float64)
+    img2 = np.asarray(img2, dtype=np.float64)
+    x = img1.shape[1]
+    shift = np.empty_like(img1)
+    pair = np.empty_like(img1)
+    cost_l = np.empty_like(img1)
+    if metric == 'ncorr':
+        img1_sq = img1 * img1
+        img2_sq = img2 * img2
+        energy1 = _box_filter(img1_sq, w_size)
+        energy2 = _box_filter(img2_sq, w_size)
+        energy_l = np.empty_like(img1)
+        energy_r = np.empty_like(img1)
+        cost_r = np.empty_like(img1)
+
+    for d in range(dmax):
+        # direction 0: img1 against img2 shifted right
+        _shift_image(img2, d, 0, shift)
+        if metric == 'ssd':
+            np.subtract(img1, shift, out=pair)
+            np.square(pair, out=pair)
+        else:
+            np.multiply(img1, shift, out=pair)
+        _box_filter(pair, w_size, cost_l)
+
+        # direction 1: img2 against img1 shifted left. Pixel x pairs the same pixels as direction 0 pixel x + d,
+        # except near the borders, where the pair image is only computed on the columns that are filtered again
+        if metric == 'ssd':
+            def columns(start, stop):
+                return np.square(img2[:, start:stop] - _shifted_columns(img1, d, 1, start, stop))
+        else:
+            def columns(start, stop):
+                return img2[:, start:stop] * _shifted_columns(img1, d, 1, start, stop)
+        (start, stop), strips = _shifted_strips(x, d, 1, w_size)
+        costs_r = [(slice(start, stop), cost_l[:, start + d:stop + d])] if start < stop else []
+        costs_r += [(slice(a, b), _box_strip(columns, a, b, x, w_size)) for a, b in strips]
+
+        if metric == 'ncorr':
+            # energies of the shifted images, from the full image energies
+            _shifted_box(energy2, lambda start, stop: _shifted_columns(img2_sq, d, 0, start, stop),
+                         d, 0, w_size, energy_l)
+            _shifted_box(energy1, lambda start, stop: _shifted_columns(img1_sq, d, 1, start, stop),
+                         d, 1, w_size, energy_r)
+            # direction 1 first, its inner columns read the direction 0 window sums
+            for columns_r, r_tx in costs_r:
+                cost_r[:, columns_r] = r_tx
+            costs_r = [(slice(None), _normalize_correlation(cost_r, energy_r, energy2))]
+            _normalize_correlation(cost_l, energy_l, energy1)
+
+        yield d, cost_l, costs_r
+
+
+def _normalize_correlation(r_tx, r_xx, r_tt):
+    """Divides r_tx by sqrt(r_xx * r_tt) in place (r_xx is overwritten), with 0 where either window is flat."""
+    flat = (r_xx < _FLAT_VARIANCE) | (r_tt < _FLAT_VARIANCE)
+    np.multiply(r_xx, r_tt, out=r_xx)
+    r_xx[flat] = 1.
+    np.sqrt(r_xx, out=r_xx)
+    np.divide(r_tx, r_xx, out=r_tx)
+    r_tx[flat] = 0.
+    return r_tx
+
+
+def _lr_consistency(d_l, d_r, tolerance=1):
+    """Returns the mask of left pixels whose right image match maps back to them within tolerance.
+
+    Args:
+        d_l (numpy.array): left to right disparity map (direction 0), L(y, x) matches R(y, x - D_L(y, x)).
+        d_r (numpy.array): right to left disparity map (direction 1), R(y, x) matches L(y, x + D_R(y, x)).
+        tolerance (int): maximum disparity difference.
+
+    Returns:
+        numpy.array: boolean mask of the same shape as d_l.
+    """
+    y, x = d_l.shape
+    match_cols = np.arange(x)[np.newaxis, :] - np.rint(d_l).astype(np.int64)
+    inside = match_cols >= 0
+    d_back = d_r[np.arange(y)[:, np.newaxis], np.clip(match_cols, 0, x - 1)]
+    return inside & (np.abs(d_l - d_back) <= tolerance)
+
+
+def _fill_occlusions(disp_img, valid):
+    """Returns disp_img with every invalid pixel set to the lower of the nearest valid disparities to its left and
+    right on the same row. Rows without valid pixels are left unchanged.
+
+    Args:
+        disp_img (numpy.array): disparity map.
+        valid (numpy.array): boolean mask of the valid pixels.
+
+    Returns:
+        numpy.array: filled disparity map, same type as disp_img.
+    """
+    y, x = disp_img.shape
+    row_ids = np.arange(y)[:, np.newaxis]
+    col_ids = np.broadcast_to(np.arange(x), (y, x))
+
+    # column of the nearest valid pixel at or before (left) / at or after (right) each pixel, -1 / x if none
+    left = np.maximum.accumulate(np.where(valid, col_ids, -1), axis=1)
+    right = np.minimum.accumulate(np.where(valid, col_ids, x)[:, ::-1], axis=1)[:, ::-1]
+
+    no_value = np.inf
+    left_d = np.where(left >= 0, disp_img[row_ids, np.clip(left, 0, x - 1)], no_value)
+    right_d = np.where(right < x, disp_img[row_ids, np.clip(right, 0, x - 1)], no_value)
+    fill = np.minimum(left_d, right_d)
+
+    filled = disp_img.copy()
+    holes = ~valid & (fill != no_value)
+    filled[holes] = fill[holes]
+    return filled
+
+
+def disparity_tiled(img1, img2, direction, w_size, dmax, method='ssd', strip_rows=64, workers=None, processes=False,
+                    **kwargs):
+    """Returns the disparity map of disparity_ssd, disparity_ncorr or disparity_census computed on horizontal strips
+    in parallel.
+
+    The image is split into strips of strip_rows rows. Each strip is extended by a halo of half the window height
+    above and below, so every window in the strip sees the same rows as in the full image and the stitched map is
+    the untiled one. The working buffers scale with the strip size instead of the image size.
+
+    By default the strips run on a thread pool, since OpenCV and most NumPy operations release the GIL. Set
+    processes to True to use a process pool instead.
+
+    Args:
+        img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size, type int representing both height and width (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        method (str): 'ssd' (disparity_ssd), 'ncorr' (disparity_ncorr) or 'census' (disparity_census).
+        strip_rows (int): number of output rows per strip.
+        workers (int): pool size. Default set to None (number of cores).
+        processes (bool): use a process pool instead of a thread pool. Default set to False.
+        **kwargs: other arguments of the disparity function, e.g. subpixel or zero_mean. return_costs is not
+                  supported: only the disparity map is stitched.
+
+    Returns:
+        numpy.array: disparity map of the disparity function on the whole image.
+    """
+    if method not in _DISPARITY_METHODS:
+        raise ValueError("method must be one of {}, got {!r}".format(sorted(_DISPARITY_METHODS), method))
+    if strip_rows < 1:
+        raise ValueError("strip_rows must be at least 1, got {}".format(strip_rows))
+    if kwargs.get('return_costs'):
+        raise ValueError("disparity_tiled does not support return_costs")
+
+    y = img1.shape[0]
+    jobs = []
+    for start in range(0, y, strip_rows):
+        stop = min(start + strip_rows, y)
+        s0, s1 = _strip_bounds(start, stop, y, w_size, method, kwargs.get('c_size', (5, 5)))
+        jobs.append((method, img1[s0:s1], img2[s0:s1], direction, w_size, dmax, kwargs, start - s0, stop - s0))
+
+    pool = multiprocessing.Pool(workers) if processes else ThreadPool(workers)
+    try:
+        strips = pool.map(_disparity_strip, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    return np.concatenate(strips, axis=0)
+
+
+def _strip_bounds(start, stop, rows, w_size, method='ssd', c_size=(5, 5)):
+    """Returns the rows (s0, s1) of the strip [start, stop) extended by the window halo, clipped to the image.
+
+    For census the halo also covers the census window of the rows in the matching window, so their codes are the
+    same as in the full image.
+
+    Args:
+        start (int): first row of the strip.
+        stop (int): row after the last one.
+        rows (int): number of rows of the image.
+        w_size (tuple): window size (h, w).
+        method (str): 'ssd', 'ncorr' or 'census'.
+        c_size (tuple): census window size (h, w), only used by census.
+
+    Returns:
+        tuple: (s0, s1).
+    """
+    # cv2 window anchor: rows [r - above, r + below] around row r
+    above = w_size[0] // 2
+    below = w_size[0] - 1 - above
+    if method == 'census':
+        above += c_size[0] // 2
+        below += c_size[0] - 1 - c_size[0] // 2
+    return max(start - above, 0), min(stop + below, rows)
+
+
+def _disparity_strip(job):
+    """Pool worker: runs the disparity function on one strip with its halo and returns the rows without the halo."""
+    method, img1, img2, direction, w_size, dmax, kwargs, start, stop = job
+    return _DISPARITY_METHODS[method](img1, img2, direction, w_size, dmax, **kwargs)[start:stop]
+
+
+_DISPARITY_METHODS = {'ssd': disparity_ssd, 'ncorr': disparity_ncorr, 'census': disparity_census}
+
+
+def disparity_pyramid(img1, img2, direction, w_size, dmax, levels=3, radius=2, metric='ssd'):
+    """Returns a disparity map D(y, x) computed coarse to fine over an image pyramid.
+
+    The full 0..dmax search only runs on the coarsest level, where both the images and the disparities are
+    2 ** (levels - 1) times smaller. At every finer level the disparity map is upsampled (and doubled) and each
+    pixel only tests the 2 * radius + 1 disparities around its own estimate, with the same window costs as the full
+    search (see _band_search).
+
+    Args:
+        img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size, type int representing both height and width (h, w). Used at every level.
+        dmax (int): maximum value of pixel disparity to test at full resolution.
+        levels (int): number of pyramid levels, 1 is a plain full search.
+        radius (int): disparity search radius around the upsampled estimate at the finer levels.
+        metric (str): 'ssd' (lowest sum of squared differences) or 'ncorr' (highest normalized correlation).
+
+    Returns:
+        numpy.array: Disparity map of type int64, 2-D array of the same shape as img1 or img2.
+    """
+    if metric not in ('ssd', 'ncorr'):
+        raise ValueError("metric must be 'ssd' or 'ncorr', got {!r}".format(metric))
+    if levels < 1:
+        raise ValueError("levels must be at least 1, got {}".format(levels))
+
+    pyramid = [(np.asarray(img1, dtype=np.float64), np.asarray(img2, dtype=np.float64))]
+    for _ in range(levels - 1):
+        pyramid.append(tuple(cv2.pyrDown(img) for img in pyramid[-1]))
+
+    full_search = _DISPARITY_METHODS[metric]
+    coarse_dmax = max(1, -(-dmax // 2 ** (levels - 1)))
+    disp_img = full_search(pyramid[-1][0], pyramid[-1][1], direction, w_size, coarse_dmax)
+
+    for level in range(levels - 2, -1, -1):
+        img1_level, img2_level = pyramid[level]
+        y, x = img1_level.shape
+        prior = 2 * cv2.resize(disp_img.astype(np.int32), (x, y), interpolation=cv2.INTER_NEAREST)
+        level_dmax = max(1, -(-dmax // 2 ** level))
+        disp_img = _band_search(img1_level, img2_level, direction, w_size, prior, radius, level_dmax, metric)
+
+    return disp_img
+
+
+def _band_search(img1, img2, direction, w_size, prior, radius, dmax, metric, buffers=None):
+    """Returns the best disparity of every pixel within prior +/- radius (clipped to [0, dmax)).
+
+    The cost of a pixel at a candidate d is the window cost of the full search at d. For every d, the per pixel
+    cost image of d is summed into an integral image and only read back at the pixels whose band contains d, four
+    reads per pixel. So the result is the full search restricted to the band (up to rounding). The window sums and
+    the winner-take-all only touch 2 * radius + 1 candidates per pixel, but the cost and integral images are still
+    computed on the whole image for every d in some band, which makes it only about 1.5 times faster than the full
+    search for a noisy prior whose bands cover the whole 0..dmax range.
+
+    Args:
+        img1 (numpy.array): grayscale image of type float64.
+        img2 (numpy.array): grayscale image of type float64, same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size (h, w).
+        prior (numpy.array): integer disparity estimate of every pixel, same shape as img1.
+        radius (int): search radius around prior.
+        dmax (int): maximum disparity (exclusive).
+        metric (str): 'ssd' or 'ncorr'.
+        buffers (dict): working arrays kept between calls on images of the same shape, see _buffer.
+
+    Returns:
+        numpy.array: disparity map of type int64.
+    """
+    buffers = {} if buffers is None else buffers
+    ref, moving = (img1, img2) if direction == 0 else (img2, img1)
+    y, x = ref.shape
+    low = np.clip(prior - radius, 0, dmax - 1).ravel()
+    high = np.clip(prior + radius, 0, dmax - 1).ravel()
+
+    # pixels sorted by the low end of their band, the pixels whose band contains d have low in [d - 2 * radius, d]
+    order = np.argsort(low)
+    sorted_low, sorted_high = low[order], high[order]
+    # flat index of the top left window corner of every pixel in the integral image of the padded cost image
+    stride = x + w_size[1]
+    corners = (np.arange(y)[:, np.newaxis] * stride + np.arange(x)).ravel()[order]
+    if metric == 'ncorr':
+        r_tt = _box_filter(ref * ref, w_size, _buffer(buffers, 'band_r_tt', ref.shape)).ravel()[order]
+
+    maximize = metric == 'ncorr'
+    # in the order of the sorted pixels
+    best = np.full(y * x, -np.inf if maximize else np.inf)
+    best_d = np.zeros(y * x, dtype=np.int64)
+    shifted = _buffer(buffers, 'band_shifted', ref.shape)
+    diff = _buffer(buffers, 'band_diff', ref.shape)
+    bounds = np.searchsorted(sorted_low, np.arange(-2 * radius, dmax + 1))
+    for d in range(int(sorted_low[0]), int(sorted_high.max()) + 1):
+        start, stop = bounds[d], bounds[d + 2 * radius + 1]
+        keep = np.flatnonzero(sorted_high[start:stop] >= d) + start
+        _shift_image(moving, d, direction, shifted)
+        pixel_corners = corners[keep]
+        if metric == 'ssd':
+            cv2.subtract(ref, shifted, diff)
+            cv2.multiply(diff, diff, diff)
+            cost = _window_means(diff, w_size, pixel_corners, buffers)
+            better = cost + _TIE_TOLERANCE < best[keep]
+        else:
+            cv2.multiply(ref, shifted, diff)
+            cost = _window_means(diff, w_size, pixel_corners, buffers)
+            cv2.multiply(shifted, shifted, diff)
+            r_xx = _window_means(diff, w_size, pixel_corners, buffers)
+            cost = _normalize_correlation(cost, r_xx, r_tt[keep])
+            better = cost - _TIE_TOLERANCE > best[keep]
+        keep = keep[better]
+        best[keep] = cost[better]
+        best_d[keep] = d
+
+    disp_img = np.empty(y * x, dtype=np.int64)
+    disp_img[order] = best_d
+    return disp_img.reshape(y, x)
+
+
+def _window_means(img, w_size, corners, buffers):
+    """Returns the mean of img over the w_size window of the pixels given by their window corners.
+
+    The same values as _box_filter(img, w_size) at these pixels (up to rounding): img is padded with the
+    BORDER_REFLECT_101 border of cv2.boxFilter and summed into an integral image.
+
+    Args:
+        img (numpy.array): 2-D image of type float64.
+        w_size (tuple): window size (h, w).
+        corners (numpy.array): flat index of the top left window corner in the integral image, i.e.
+                               row * (img.shape[1] + w) + column for the pixel (row, column).
+        buffers (dict): working arrays, see _buffer.
+
+    Returns:
+        numpy.array: 1-D array of type float64, one mean per corner.
     """
-    y, x = img1.shape
-    disparity_map = np.zeros((y, x, dmax))
-    kernel = np.ones(w_size) / (w_size[0] * w_size[1])
+    h, w = w_size
+    y, x = img.shape
+    above, left = h // 2, w // 2
+    padded = _buffer(buffers, 'band_padded', (y + h - 1, x + w - 1))
+    cv2.copyMakeBorder(img, above, h - 1 - above, left, w - 1 - left, cv2.BORDER_REFLECT_101, dst=padded)
+    integral = _buffer(buffers, 'band_integral', (y + h, x + w))
+    cv2.integral(padded, integral, cv2.CV_64F)
+    flat = integral.ravel()
+    sums = flat.take(corners + (h * (x + w) + w))
+    sums -= flat.take(corners + w)
+    sums -= flat.take(corners + h * (x + w))
+    sums += flat.take(corners)
+    sums /= h * w
+    return sums
+
+
+def _buffer(buffers, name, shape, dtype=np.float64):
+    """Returns the array buffers[name], allocating a new one if it is missing or has another shape or type."""
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+class StereoMatcher(object):
+    """Computes the disparity maps of a rectified stereo video, reusing the result of the previous frame.
+
+    The first frame (and the first one after reset or a change of size) gets a full 0..dmax search. After that
+    every pixel only searches its previous disparity +/- radius (see _band_search), except for the rows where
+    either image changed since the previous frame. A row changed if the window mean of the absolute frame
+    difference is above change_threshold anywhere on it. Runs of changed rows get a full search with the same halo
+    as disparity_tiled. The working arrays are kept between frames.
+
+    The band search can only move a disparity by radius per frame, so a pixel whose full search match drifted
+    away, e.g. to a lower cost outside the band under a change of noise or lighting below change_threshold, keeps
+    following its old match. Every refresh frames the whole frame gets a full search again.
+
+    Args:
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size, type int representing both height and width (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        metric (str): 'ssd' or 'ncorr'.
+        radius (int): disparity search radius around the previous disparity.
+        change_threshold (float): window mean absolute difference, in intensity units of [0.0, 1.0], above which a
+                                  row gets a full search.
+        refresh (int): number of frames between two full searches of the whole frame, None for only the first.
+    """
+
+    def __init__(self, direction, w_size, dmax, metric='ssd', radius=2, change_threshold=0.05, refresh=10):
+        if metric not in ('ssd', 'ncorr'):
+            raise ValueError("metric must be 'ssd' or 'ncorr', got {!r}".format(metric))
+        if refresh is not None and refresh < 1:
+            raise ValueError("refresh must be at least 1 or None, got {}".format(refresh))
+        self.direction = direction
+        self.w_size = w_size
+        self.dmax = dmax
+        self.metric = metric
+        self.radius = radius
+        self.change_threshold = change_threshold
+        self.refresh = refresh
+        self.reset()
+
+    def reset(self):
+        """Forgets the previous frame, the next one gets a full search."""
+        self.prev_disparity = None
+        self.prev_img1 = None
+        self.prev_img2 = None
+        self.full_search_rows = 0
+        self._frames_since_full_search = None
+        self._buffers = {}
+
+    def match(self, img1, img2):
+        """Returns the disparity map of the next frame pair.
+
+        Args:
+            img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+            img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+
+        Returns:
+            numpy.array: Disparity map of type int64, 2-D array of the same shape as img1 or img2. The number of
+                         rows that got a full search is left in full_search_rows.
+        """
+        img1 = np.asarray(img1, dtype=np.float64)
+        img2 = np.asarray(img2, dtype=np.float64)
+        full_search = _DISPARITY_METHODS[self.metric]
+
+        if self.prev_disparity is None or self.prev_disparity.shape != img1.shape:
+            self.prev_img1 = np.empty_like(img1)
+            self.prev_img2 = np.empty_like(img2)
+            self._frames_since_full_search = None
+
+        if self._frames_since_full_search is None or self._frames_since_full_search == self.refresh:
+            disp_img = full_search(img1, img2, self.direction, self.w_size, self.dmax)
+            self.full_search_rows = img1.shape[0]
+            self._frames_since_full_search = 1
+        else:
+            changed = self._changed_rows(img1, img2)
+            disp_img = _band_search(img1, img2, self.direction, self.w_size, self.prev_disparity, self.radius,
+                                    self.dmax, self.metric, self._buffers)
+
+            # start and stop of every run of changed rows
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], changed.view(np.int8), [0]))))
+            for start, stop in zip(edges[::2], edges[1::2]):
+                s0, s1 = _strip_bounds(start, stop, img1.shape[0], self.w_size)
+                disp_img[start:stop] = _disparity_strip((self.metric, img1[s0:s1], img2[s0:s1], self.direction,
+                                                         self.w_size, self.dmax, {}, start - s0, stop - s0))
+            self.full_search_rows = int(changed.sum())
+            self._frames_since_full_search += 1
+
+        np.copyto(self.prev_img1, img1)
+        np.copyto(self.prev_img2, img2)
+        self.prev_disparity = disp_img
+        return disp_img
+
+    def _changed_rows(self, img1, img2):
+        """Returns a boolean array with the rows where either image changed since the previous frame."""
+        diff = _buffer(self._buffers, 'frame_diff', img1.shape)
+        mean = _buffer(self._buffers, 'frame_mean', img1.shape)
+        changed = np.zeros(img1.shape[0], dtype=np.bool_)
+        for img, prev in ((img1, self.prev_img1), (img2, self.prev_img2)):
+            np.subtract(img, prev, out=diff)
+            np.abs(diff, out=diff)
+            changed |= (_box_filter(diff, self.w_size, mean) > self.change_threshold).any(axis=1)
+        return changed
+
+
+def disparity_sgm(img1, img2, direction, w_size, dmax, metric='ssd', paths=8, p1=10, p2=120):
+    """Returns a disparity map D(y, x) using semi-global matching (SGM).
+
+    The window costs of disparity_ssd, disparity_ncorr or disparity_census are quantized to integers in [0, 255]
+    and stored in an int16 (height, width, dmax) volume. They are then aggregated along 4 or 8 straight paths with
+    the recurrence:
+
+        L(p, d) = C(p, d) + min(L(p - r, d), L(p - r, d +/- 1) + P1, min_k L(p - r, k) + P2) - min_k L(p - r, k)
 
+    and the best d is the lowest sum S(p, d) over all paths. The smoothness penalties make small windows (e.g. 3x3
+    or 5x5) robust, where a plain window search needs much larger ones.
+
+    Refer to: Hirschmuller, H. "Stereo processing by semiglobal matching and mutual information." (2008).
+
+    Args:
+        img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size, type int representing both height and width (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        metric (str): matching cost, 'ssd' (quantized as 255 * sqrt(ssd)), 'ncorr' (quantized as
+                      127.5 * (1 - ncorr)) or 'census' (mean Hamming distance of 5x5 census codes, times 255 / 24).
+        paths (int): number of aggregation paths, 4 (horizontal and vertical) or 8 (also the diagonals).
+        p1 (int): penalty for a disparity change of 1 between neighbouring pixels.
+        p2 (int): penalty for larger disparity changes, p2 >= p1.
+
+    Returns:
+        numpy.array: Disparity map of type int64, 2-D array of the same shape as img1 or img2.
+    """
+    if paths not in (4, 8):
+        raise ValueError("paths must be 4 or 8, got {}".format(paths))
+    if not 0 <= p1 <= p2:
+        raise ValueError("penalties must satisfy 0 <= p1 <= p2, got p1={}, p2={}".format(p1, p2))
+    # each path cost is at most max(C) + p2, and the path sum must fit in int16
+    if paths * (255 + p2) > np.iinfo(np.int16).max:
+        raise ValueError("p2={} is too large for {} paths with int16 costs".format(p2, paths))
+
+    cost_volume = _quantized_costs(img1, img2, direction, w_size, dmax, metric)
+    total = np.zeros_like(cost_volume)
+
+    steps = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+    if paths == 8:
+        steps += [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+    for dy, dx in steps:
+        if dy == 0:
+            # horizontal paths walk the columns: same as a vertical path on the transposed volume
+            _aggregate_path(cost_volume.transpose(1, 0, 2), dx, 0, p1, p2, total.transpose(1, 0, 2))
+        else:
+            _aggregate_path(cost_volume, dy, dx, p1, p2, total)
+
+    return np.argmin(total, axis=2)
+
+
+def _quantized_costs(img1, img2, direction, w_size, dmax, metric):
+    """Returns the matching cost volume of shape (height, width, dmax) quantized to int16 values in [0, 255].
+
+    Args:
+        img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        metric (str): 'ssd', 'ncorr' or 'census'.
+
+    Returns:
+        numpy.array: cost volume of type int16, lower is better.
+    """
+    if metric == 'ssd':
+        costs = _ssd_costs(img1, img2, direction, w_size, dmax)
+    elif metric == 'ncorr':
+        costs = _ncorr_costs(img1, img2, direction, w_size, dmax)
+    elif metric == 'census':
+        costs = _census_costs(img1, img2, direction, w_size, dmax)
+    else:
+        raise ValueError("metric must be 'ssd', 'ncorr' or 'census', got {!r}".format(metric))
+
+    # filled one contiguous image per d, then transposed once so the disparities of a pixel are contiguous
+    by_d = np.empty((dmax,) + img1.shape, dtype=np.int16)
+    for d, cost in costs:
+        if metric == 'ssd':
+            # root of the mean squared difference, in intensity levels (running sums can leave tiny negatives)
+            np.maximum(cost, 0., out=cost)
+            np.sqrt(cost, out=cost)
+            cost *= 255.
+        elif metric == 'ncorr':
+            np.subtract(1., cost, out=cost)
+            cost *= 127.5
+        else:
+            # 24 bits in the default 5x5 census window
+            cost *= 255. / 24
+        np.rint(cost, out=cost)
+        np.clip(cost, 0, 255, out=cost)
+        by_d[d] = cost
+    return np.ascontiguousarray(by_d.transpose(1, 2, 0))
+
+
+def _aggregate_path(cost_volume, dy, dx, p1, p2, total):
+    """Adds the SGM path costs along direction (dy, dx) to total.
+
+    The volume is walked one row at a time (forward if dy is 1, backward if dy is -1), and each row is updated
+    from the previous one shifted by dx columns. Pixels whose predecessor falls outside the image start a new path.
+
+    Args:
+        cost_volume (numpy.array): int16 matching costs of shape (rows, cols, dmax).
+        dy (int): row step, 1 or -1.
+        dx (int): column step, -1, 0 or 1.
+        p1 (int): small disparity change penalty.
+        p2 (int): large disparity change penalty.
+        total (numpy.array): int16 array of the same shape as cost_volume, updated in place.
+    """
+    rows, cols, dmax = cost_volume.shape
+    # path costs stay below 255 + p2, so the row state fits in int16 like the volumes. The element-wise minimums and
+    # the in-place sums go through cv2, which is vectorized for int16 where numpy is not on older numpy versions
+    prev = np.zeros((cols, dmax), dtype=np.int16)
+    shifted = np.zeros_like(prev) if dx != 0 else prev
+    relative = np.empty_like(prev)
+    best = np.empty_like(prev)
+    step = np.empty_like(prev[:, 1:])
+    row_min = np.empty_like(prev[:, :(dmax + 1) // 2])
+
+    for r in (range(rows) if dy == 1 else range(rows - 1, -1, -1)):
+        # an all zero predecessor gives L = C, i.e. the path starts at this pixel
+        if dx == 1:
+            shifted[1:] = prev[:-1]
+        elif dx == -1:
+            shifted[:-1] = prev[1:]
+
+        # relative to min_k L(p - r, k): min(L(p - r, d), min_k L(p - r, k) + P2) - min_k L(p - r, k)
+        # = min(relative(d), P2)
+        np.subtract(shifted, _min_over_columns(shifted, row_min), out=relative)
+        cv2.min(relative, p2, best)
+        # lowest neighbour at d - 1 or d + 1: min(L(d), L(d + 1)) + P1 serves both d + 1 and d, and the L(d) + P1
+        # part never beats L(d) itself
+        if dmax > 1:
+            cv2.min(relative[:, :-1], relative[:, 1:], step)
+            cv2.add(step, p1, step)
+            cv2.min(best[:, 1:], step, best[:, 1:])
+            cv2.min(best[:, :-1], step, best[:, :-1])
+        cv2.add(best, cost_volume[r], prev)
+        cv2.add(total[r], prev, total[r])
+
+
+def _min_over_columns(values, work):
+    """Returns the minimum of every row of the 2-D array values as a column vector, by halving the columns.
+
+    Args:
+        values (numpy.array): 2-D array, not modified.
+        work (numpy.array): buffer of the same rows and type with at least half the columns (rounded up).
+
+    Returns:
+        numpy.array: view of work (values itself if it has a single column) of shape (rows, 1).
+    """
+    n = values.shape[1]
+    if n == 1:
+        return values
+    half = n // 2
+    cv2.min(values[:, :half], values[:, n - half:], work[:, :half])
+    # an odd count leaves the middle column out of the pairs, it stays next to them
+    n -= half
+    if n > half:
+        work[:, half] = values[:, half]
+    while n > 1:
+        half = n // 2
+        cv2.min(work[:, :half], work[:, n - half:n], work[:, :half])
+        n -= half
+    return work[:, :1]
+
+
+def _shift_image(img, d, direction, out):
+    """Writes img shifted by d columns into out, replicating the border column in the uncovered part.
+
+    This is the same as cv2.copyMakeBorder(img[:, :-d], 0, 0, d, 0, cv2.BORDER_REPLICATE) for direction 0 and
+    cv2.copyMakeBorder(img[:, d:], 0, 0, 0, d, cv2.BORDER_REPLICATE) for direction 1, without allocating a new
+    image for every d.
+
+    Args:
+        img (numpy.array): 2-D image.
+        d (int): shift in columns, 0 <= d < img.shape[1].
+        direction (int): if 0: shift right. if 1: shift left.
+        out (numpy.array): output buffer of the same shape as img.
+
+    Returns:
+        numpy.array: out.
+    """
+    x = img.shape[1]
     if direction == 0:
-        for d in xrange(0, dmax):
-            shift = cv2.copyMakeBorder(img2[:, :(-d or None)], 0, 0, d, 0, cv2.BORDER_REPLICATE)
-            # https://software.intel.com/en-us/node/504333
-            r_tx = cv2.filter2D(img1 * shift, -1, kernel)
-            r_xx = cv2.filter2D(shift * shift, -1, kernel)
-            r_tt = cv2.filter2D(img1 * img1, -1, kernel)
-            disparity_map[:, :, d] = r_tx / np.sqrt(r_xx * r_tt)
-    elif direction == 1:
-        for d in xrange(0, dmax):
-            shift = cv2.copyMakeBorder(img1[:, d:], 0, 0, 0, d, cv2.BORDER_REPLICATE)
-            # https://software.intel.com/en-us/node/504333
-            r_tx = cv2.filter2D(img2 * shift, -1, kernel)
-            r_xx = cv2.filter2D(shift * shift, -1, kernel)
-            r_tt = cv2.filter2D(img2 * img2, -1, kernel)
-            disparity_map[:, :, d] = r_tx / np.sqrt(r_xx * r_tt)
-
-    disp_img = np.argmax(disparity_map, axis=2)
+        out[:, d:] = img[:, :x - d]
+        out[:, :d] = img[:, :1]
+    else:
+        out[:, :x - d] = img[:, d:]
+        out[:, x - d:] = img[:, -1:]
+    return out
+
+
+def _box_filter(img, w_size, out=None):
+    """Returns the mean of img over a w_size window around every pixel.
+
+    cv2.boxFilter keeps running row and column sums, so the cost per pixel does not depend on the window size.
+    The window anchor and the border (BORDER_REFLECT_101) are the same as cv2.filter2D with a uniform kernel.
+
+    Args:
+        img (numpy.array): 2-D image of type float64.
+        w_size (tuple): window size (h, w).
+        out (numpy.array): optional output buffer of the same shape and type as img.
+
+    Returns:
+        numpy.array: filtered image of type float64.
+    """
+    return cv2.boxFilter(img, -1, (w_size[1], w_size[0]), dst=out, normalize=True)
+
+
+def _ssd_costs(img1, img2, direction, w_size, dmax):
+    """Yields the window SSD cost image of every disparity d in [0, dmax).
+
+    The shifted image, the squared difference and the cost are written to buffers allocated once, so the
+    yielded cost image is overwritten by the next iteration.
+
+    Args:
+        img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+
+    Yields:
+        tuple: (d, cost image of type float64).
+    """
+    img1 = np.asarray(img1, dtype=np.float64)
+    img2 = np.asarray(img2, dtype=np.float64)
+    # direction 0 shifts img2 right and compares it to img1, direction 1 shifts img1 left and compares it to img2
+    ref, moving = (img1, img2) if direction == 0 else (img2, img1)
+
+    shift = np.empty_like(ref)
+    diff = np.empty_like(ref)
+    cost = np.empty_like(ref)
+
+    for d in range(dmax):
+        _shift_image(moving, d, direction, shift)
+        np.subtract(ref, shift, out=diff)
+        np.square(diff, out=diff)
+        yield d, _box_filter(diff, w_size, cost)
+
+
+def _shifted_columns(img, d, direction, start, stop):
+    """Returns columns [start, stop) of _shift_image(img, d, direction) without shifting the whole image.
+
+    Args:
+        img (numpy.array): 2-D image.
+        d (int): shift in columns.
+        direction (int): if 0: shift right. if 1: shift left.
+        start (int): first column.
+        stop (int): column after the last one.
+
+    Returns:
+        numpy.array: array of shape (img.shape[0], stop - start).
+    """
+    col_ids = np.arange(start, stop) + (-d if direction == 0 else d)
+    return img[:, np.clip(col_ids, 0, img.shape[1] - 1)]
+
+
+def _shifted_box(boxed, columns, d, direction, w_size, out):
+    """Returns _box_filter(shifted, w_size) given boxed = _box_filter(img, w_size), where shifted is the image img
+    moved by _shift_image(img, d, direction).
+
+    Away from the borders the window mean of the shifted image is the shifted window mean, so it is copied from
+    boxed. Only the columns whose window reaches the image border or the replicated columns are filtered again,
+    and only the shifted image columns these need are requested from columns.
+
+    Args:
+        boxed (numpy.array): box filtered image, type float64.
+        columns (callable): columns(start, stop) returns columns [start, stop) of the shifted image, type float64.
+        d (int): shift in columns.
+        direction (int): if 0: shifted right. if 1: shifted left.
+        w_size (tuple): window size (h, w).
+        out (numpy.array): output buffer of the same shape as boxed.
+
+    Returns:
+        numpy.array: out.
+    """
+    _shift_image(boxed, d, direction, out)
+    for start, stop in _shifted_strips(boxed.shape[1], d, direction, w_size)[1]:
+        out[:, start:stop] = _box_strip(columns, start, stop, boxed.shape[1], w_size)
+    return out
+
+
+def _shifted_strips(x, d, direction, w_size):
+    """Splits the x columns of an image shifted by _shift_image(img, d, direction) into the columns where the window
+    mean of the shifted image is the shifted window mean of img, and the border strips where it is not.
+
+    Args:
+        x (int): number of columns.
+        d (int): shift in columns.
+        direction (int): if 0: shifted right. if 1: shifted left.
+        w_size (tuple): window size (h, w).
+
+    Returns:
+        tuple: ((start, stop) of the inner columns, list of the (start, stop) of the non-empty border strips). The
+               ranges do not overlap and cover all the columns.
+    """
+    # cv2 window anchor: columns [c - lo, c + hi] around column c
+    lo = w_size[1] // 2
+    hi = w_size[1] - 1 - lo
+    # the windows of the inner columns reach neither the image borders nor the replicated columns
+    if direction == 0:
+        start, stop = min(d + lo, x), max(x - hi, 0)
+    else:
+        start, stop = min(lo, x), max(x - d - hi, 0)
+    stop = max(start, stop)
+    strips = [(a, b) for a, b in ((0, start), (stop, x)) if a < b]
+    return (start, stop), strips
+
+
+def _box_strip(columns, start, stop, x, w_size):
+    """Returns the box filter of columns [start, stop) of an image of x columns, given only as the callable columns.
+
+    Args:
+        columns (callable): columns(start, stop) returns columns [start, stop) of the image, type float64.
+        start (int): first column.
+        stop (int): column after the last one.
+        x (int): number of columns of the image.
+        w_size (tuple): window size (h, w).
+
+    Returns:
+        numpy.array: array of shape (rows, stop - start), type float64.
+    """
+    lo = w_size[1] // 2
+    hi = w_size[1] - 1 - lo
+    # enough context around the strip that its own borders are either the image borders or unused
+    s0, s1 = max(start - lo, 0), min(stop + hi, x)
+    return _box_filter(np.ascontiguousarray(columns(s0, s1)), w_size)[:, start - s0:stop - s0]
+
+
+# window variances (or energies) below this are treated as flat regions, where the correlation is undefined
+_FLAT_VARIANCE = 1e-12
+
+
+def _ncorr_costs(img1, img2, direction, w_size, dmax, zero_mean=False):
+    """Yields the window normalized correlation image of every disparity d in [0, dmax).
+
+    The window means and energies of both images are computed once. For each d only the cross term is box
+    filtered, the statistics of the moving image are shifted copies (see _shifted_box). Pixels where either
+    window is flat get a correlation of 0 instead of NaN or inf.
+
+    Same buffer reuse as _ssd_costs: the yielded image is overwritten by the next iteration.
+
+    Args:
+        img1 (numpy.array): grayscale image, in range [0.0, 1.0].
+        img2 (numpy.array): grayscale image, in range [0.0, 1.0] same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        zero_mean (bool): subtract the window means (zero-mean normalized cross correlation).
+
+    Yields:
+        tuple: (d, correlation image of type float64).
+    """
+    img1 = np.asarray(img1, dtype=np.float64)
+    img2 = np.asarray(img2, dtype=np.float64)
+    ref, moving = (img1, img2) if direction == 0 else (img2, img1)
+    moving_sq = moving * moving
+
+    # https://software.intel.com/en-us/node/504333
+    r_tt = _box_filter(ref * ref, w_size)
+    r_xx_boxed = _box_filter(moving_sq, w_size)
+    if zero_mean:
+        mean_t = _box_filter(ref, w_size)
+        mean_x_boxed = _box_filter(moving, w_size)
+        r_tt -= mean_t * mean_t
+        mean_x = np.empty_like(ref)
+
+    shift = np.empty_like(ref)
+    r_tx = np.empty_like(ref)
+    r_xx = np.empty_like(ref)
+
+    for d in range(dmax):
+        _shifted_box(r_xx_boxed, lambda start, stop: _shifted_columns(moving_sq, d, direction, start, stop),
+                     d, direction, w_size, r_xx)
+        if zero_mean:
+            _shifted_box(mean_x_boxed, lambda start, stop: _shifted_columns(moving, d, direction, start, stop),
+                         d, direction, w_size, mean_x)
+        _shift_image(moving, d, direction, shift)
+        _box_filter(np.multiply(ref, shift, out=shift), w_size, r_tx)
+
+        if zero_mean:
+            r_tx -= mean_t * mean_x
+            r_xx -= mean_x * mean_x
+
+        yield d, _normalize_correlation(r_tx, r_xx, r_tt)
+
+
+def _census_costs(img1, img2, direction, w_size, dmax, c_size=(5, 5)):
+    """Yields the window mean Hamming distance between the census codes of every disparity d in [0, dmax).
+
+    The codes are computed once per image. For each d the codes are shifted and XORed, and the set bits are
+    counted with _popcount. Same buffer reuse as _ssd_costs: the yielded image is overwritten by the next iteration.
+
+    Args:
+        img1 (numpy.array): grayscale image.
+        img2 (numpy.array): grayscale image, same shape as img1.
+        direction (int): if 1: match right to left (shift img1 left).
+                         if 0: match left to right (shift img2 right).
+        w_size (tuple): window size (h, w).
+        dmax (int): maximum value of pixel disparity to test.
+        c_size (tuple): census window size (h, w).
+
+    Yields:
+        tuple: (d, cost image of type float64).
+    """
+    codes1 = census_transform(img1, c_size)
+    codes2 = census_transform(img2, c_size)
+    ref, moving = (codes1, codes2) if direction == 0 else (codes2, codes1)
+
+    shift = np.empty_like(ref)
+    work = np.empty_like(ref)
+    distance = np.empty(ref.shape)
+    cost = np.empty(ref.shape)
+
+    for d in range(dmax):
+        _shift_image(moving, d, direction, shift)
+        np.bitwise_xor(ref, shift, out=shift)
+        np.copyto(distance, _popcount(shift, work), casting='unsafe')
+        yield d, _box_filter(distance, w_size, cost)
+
+
+def _popcount(codes, work):
+    """Counts the set bits of every uint64 in place, using the parallel bit count (SWAR) from "Hacker's Delight".
+
+    Args:
+        codes (numpy.array): array of type uint64, overwritten with the counts.
+        work (numpy.array): scratch array of the same shape and type.
+
+    Returns:
+        numpy.array: codes.
+    """
+    # 2-bit, 4-bit and 8-bit partial sums, then add the 8 bytes with a multiplication into the top byte
+    np.right_shift(codes, np.uint64(1), out=work)
+    np.bitwise_and(work, np.uint64(0x5555555555555555), out=work)
+    np.subtract(codes, work, out=codes)
+    np.right_shift(codes, np.uint64(2), out=work)
+    np.bitwise_and(work, np.uint64(0x3333333333333333), out=work)
+    np.bitwise_and(codes, np.uint64(0x3333333333333333), out=codes)
+    np.add(codes, work, out=codes)
+    np.right_shift(codes, np.uint64(4), out=work)
+    np.add(codes, work, out=codes)
+    np.bitwise_and(codes, np.uint64(0x0f0f0f0f0f0f0f0f), out=codes)
+    np.multiply(codes, np.uint64(0x0101010101010101), out=codes)
+    np.right_shift(codes, np.uint64(56), out=codes)
+    return codes
+
+
+# costs closer than this are ties. The box filter rounding is far smaller for images in [0, 1], while window SSDs
+# of 8-bit images that really differ are at least 1 / (255 ** 2 * window area) apart
+_TIE_TOLERANCE = 1e-9
+
+
+class _WinnerTakeAll(object):
+    """Running winner-take-all over a stream of per-disparity cost images.
+
+    Only the best cost, the best d and (optionally) the second best cost images are kept. Ties keep the lowest d,
+    as numpy.argmin / numpy.argmax would on the full DSI. The running-sum box filter rounds the costs of every d
+    differently, so windows that compare the same pixels (flat regions, the replicated border columns) do not get
+    exactly equal costs: a cost only beats the best one by more than _TIE_TOLERANCE.
+
+    For sub-pixel refinement the costs at best d - 1 and best d + 1 are kept as well: the cost of the previous d
+    is saved when a pixel gets a new best, and the next cost image fills in d + 1 for the pixels whose best is
+    still the previous d.
+
+    Args:
+        shape (tuple): image shape (rows, cols).
+        maximize (bool): if True the best cost is the highest one (correlation), otherwise the lowest one.
+        track_second (bool): also keep the second best cost.
+        subpixel (bool): also keep the neighbouring costs of the best d, see subpixel_disparity.
+    """
+
+    def __init__(self, shape, maximize=False, track_second=False, subpixel=False):
+        self.maximize = maximize
+        self.better_than, self.best_of = (np.greater, np.maximum) if maximize else (np.less, np.minimum)
+
+        self.best = np.empty(shape)
+        self.second = np.empty(shape) if track_second else None
+        self.disp_img = np.empty(shape, dtype=np.int64)
+        self.better = np.empty(shape, dtype=np.bool_)
+        self.margin = np.empty(shape)
+
+        self.subpixel = subpixel
+        if subpixel:
+            self.cost_minus = np.empty(shape)
+            self.cost_plus = np.empty(shape)
+            self.prev_cost = np.empty(shape)
+            self.prev_best = np.empty(shape, dtype=np.bool_)
+        self.reset()
+
+    def reset(self):
+        """Starts a new stream of cost images, keeping the arrays."""
+        worst = -np.inf if self.maximize else np.inf
+        self.best.fill(worst)
+        if self.second is not None:
+            self.second.fill(worst)
+        self.disp_img.fill(0)
+        if self.subpixel:
+            self.cost_minus.fill(np.nan)
+            self.cost_plus.fill(np.nan)
+            self.prev_cost.fill(np.nan)
+
+    def update(self, d, cost, columns=slice(None)):
+        """Compares the cost image of disparity d with the best costs so far.
+
+        Args:
+            d (int): disparity of the costs.
+            cost (numpy.array): cost image, or only the given columns of it.
+            columns (slice): columns of the image that cost covers. Default set to all of them.
+        """
+        best, better, margin, disp_img = [a[:, columns] for a in (self.best, self.better, self.margin, self.disp_img)]
+        if self.subpixel:
+            cost_minus, cost_plus, prev_cost, prev_best = [a[:, columns] for a in (self.cost_minus, self.cost_plus,
+                                                                                  self.prev_cost, self.prev_best)]
+            # pixels whose best is d - 1 get their d + 1 neighbour now
+            np.equal(disp_img, d - 1, out=prev_best)
+            np.copyto(cost_plus, cost, where=prev_best)
+
+        if self.maximize:
+            np.subtract(cost, _TIE_TOLERANCE, out=margin)
+        else:
+            np.add(cost, _TIE_TOLERANCE, out=margin)
+        self.better_than(margin, best, out=better)
+        if self.second is not None:
+            # a new best pushes the old best to second place, otherwise cost may still beat the second best
+            second = self.second[:, columns]
+            self.best_of(second, cost, out=second)
+            np.copyto(second, best, where=better)
+        np.copyto(best, cost, where=better)
+        np.copyto(disp_img, d, where=better)
+
+        if self.subpixel:
+            np.copyto(cost_minus, prev_cost, where=better)
+            cost_plus[better] = np.nan
+            # the cost images are reused buffers, keep a copy for the next d
+            np.copyto(prev_cost, cost)
+
+    def subpixel_disparity(self):
+        """Returns the best d refined by fitting a parabola through the costs at d - 1, d and d + 1.
+
+        The vertex of the parabola is at d + (c(d - 1) - c(d + 1)) / (2 * (c(d - 1) - 2 * c(d) + c(d + 1))). Pixels
+        at the ends of the disparity range or with a flat or wrongly curved cost keep their integer d.
+
+        Returns:
+            numpy.array: disparity map of type float32.
+        """
+        curvature = self.cost_minus - 2 * self.best + self.cost_plus
+        # a minimum needs an upward parabola, a maximum a downward one. NaN neighbours (ends of the range) fail the
+        # comparison as well
+        with np.errstate(invalid='ignore'):
+            valid = curvature < 0 if self.maximize else curvature > 0
+        offset = np.zeros(self.best.shape)
+        offset[valid] = (self.cost_minus[valid] - self.cost_plus[valid]) / (2 * curvature[valid])
+        return (self.disp_img + np.clip(offset, -0.5, 0.5)).astype(np.float32)
+
+
+def _winner_take_all(costs, shape, maximize=False, return_costs=False, subpixel=False):
+    """Picks the best disparity of every pixel from a stream of per-disparity cost images.
+
+    Args:
+        costs (iterable): (d, cost image) pairs, e.g. from _ssd_costs.
+        shape (tuple): image shape (rows, cols).
+        maximize (bool): if True the best cost is the highest one (correlation), otherwise the lowest one.
+        return_costs (bool): also return the best and second best cost images.
+        subpixel (bool): return float32 sub-pixel disparities instead of int64 ones.
+
+    Returns:
+        numpy.array: best d of every pixel, type int64 (float32 if subpixel is True).
+        If return_costs is True, a tuple (best d, best cost, second best cost).
+    """
+    wta = _WinnerTakeAll(shape, maximize, return_costs, subpixel)
+    for d, cost in costs:
+        wta.update(d, cost)
 
+    disp_img = wta.subpixel_disparity() if subpixel else wta.disp_img
+    if return_costs:
+        return disp_img, wta.best, wta.second
     return disp_img
 
 
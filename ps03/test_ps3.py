@@ -0,0 +1,315 @@
+"""
+Tests for the disparity functions in ps3.py.
+
+How to run:
+python -m unittest test_ps3
+"""
+
+import os
+import timeit
+import unittest
+
+import cv2
+import numpy as np
+
+import ps3
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input')
+
+
+def _best_time(function, repeat=3):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def _read_pair(name, rows):
+    l = cv2.imread(os.path.join(INPUT_DIR, name + '-L.png'), 0) / 255.
+    r = cv2.imread(os.path.join(INPUT_DIR, name + '-R.png'), 0) / 255.
+    return l[rows], r[rows]
+
+
+def _old_ssd_dsi(img1, img2, direction, w_size, dmax):
+    # the DSI built by the original disparity_ssd, with copyMakeBorder shifts and cv2.filter2D
+    y, x = img1.shape
+    disparity_map = np.zeros((y, x, dmax))
+    kernel = np.ones(w_size) / (w_size[0] * w_size[1])
+    for d in range(dmax):
+        if direction == 0:
+            shift = cv2.copyMakeBorder(img2[:, :(-d or None)], 0, 0, d, 0, cv2.BORDER_REPLICATE)
+            disparity_map[:, :, d] = cv2.filter2D((img1 - shift) ** 2, -1, kernel)
+        else:
+            shift = cv2.copyMakeBorder(img1[:, d:], 0, 0, 0, d, cv2.BORDER_REPLICATE)
+            disparity_map[:, :, d] = cv2.filter2D((img2 - shift) ** 2, -1, kernel)
+    return disparity_map
+
+
+def _old_ncorr_dsi(img1, img2, direction, w_size, dmax, zero_mean=False):
+    # the normalized correlations of the original disparity_ncorr, and with the window means removed
+    disparity_map = np.zeros((img1.shape[0], img1.shape[1], dmax))
+    kernel = np.ones(w_size) / (w_size[0] * w_size[1])
+    ref = img1 if direction == 0 else img2
+    for d in range(dmax):
+        if direction == 0:
+            shift = cv2.copyMakeBorder(img2[:, :(-d or None)], 0, 0, d, 0, cv2.BORDER_REPLICATE)
+        else:
+            shift = cv2.copyMakeBorder(img1[:, d:], 0, 0, 0, d, cv2.BORDER_REPLICATE)
+        r_tx = cv2.filter2D(ref * shift, -1, kernel)
+        r_xx = cv2.filter2D(shift * shift, -1, kernel)
+        r_tt = cv2.filter2D(ref * ref, -1, kernel)
+        if zero_mean:
+            mean_t, mean_x = cv2.filter2D(ref, -1, kernel), cv2.filter2D(shift, -1, kernel)
+            r_tx, r_xx, r_tt = r_tx - mean_t * mean_x, r_xx - mean_x * mean_x, r_tt - mean_t * mean_t
+        disparity_map[:, :, d] = r_tx / np.sqrt(r_xx * r_tt)
+    return disparity_map
+
+
+class DisparitySSDTest(unittest.TestCase):
+
+    w_size = (7, 7)
+    dmax = 100
+
+    @classmethod
+    def setUpClass(cls):
+        cls.l, cls.r = _read_pair('pair1', slice(200, 296))
+        cls.disp = [ps3.disparity_ssd(cls.l, cls.r, direction, cls.w_size, cls.dmax) for direction in (0, 1)]
+
+    def test_matches_old_implementation(self):
+        # numpy.argmin on the old DSI, except that costs which only differ by rounding are ties and keep the lowest
+        # d. cv2.filter2D and the box filter round them differently, e.g. in the replicated border columns
+        for direction in (0, 1):
+            dsi = _old_ssd_dsi(self.l, self.r, direction, self.w_size, self.dmax)
+            ties = dsi <= dsi.min(axis=2)[..., np.newaxis] + ps3._TIE_TOLERANCE
+            np.testing.assert_array_equal(self.disp[direction], np.argmax(ties, axis=2))
+            unique = ties.sum(axis=2) == 1
+            np.testing.assert_array_equal(self.disp[direction][unique], np.argmin(dsi, axis=2)[unique])
+
+    def test_costs_match_old_dsi(self):
+        # the running best and second best costs are the two lowest costs of the DSI
+        for direction in (0, 1):
+            disp_img, best, second = ps3.disparity_ssd(self.l, self.r, direction, self.w_size, self.dmax,
+                                                       return_costs=True)
+            np.testing.assert_array_equal(disp_img, self.disp[direction])
+            lowest = np.sort(_old_ssd_dsi(self.l, self.r, direction, self.w_size, self.dmax), axis=2)
+            np.testing.assert_allclose(best, lowest[..., 0], rtol=0, atol=1e-9)
+            np.testing.assert_allclose(second, lowest[..., 1], rtol=0, atol=1e-9)
+
+    def test_tiled_matches_disparity_ssd(self):
+        for direction in (0, 1):
+            tiled = ps3.disparity_tiled(self.l, self.r, direction, self.w_size, self.dmax, strip_rows=20)
+            np.testing.assert_array_equal(tiled, self.disp[direction])
+
+    def test_tiled_matches_disparity_census(self):
+        # the strip halo covers the census window of the rows in the matching window
+        for direction in (0, 1):
+            census = ps3.disparity_census(self.l, self.r, direction, self.w_size, self.dmax)
+            tiled = ps3.disparity_tiled(self.l, self.r, direction, self.w_size, self.dmax, method='census',
+                                        strip_rows=20)
+            np.testing.assert_array_equal(tiled, census)
+
+    def test_tiled_rejects_return_costs(self):
+        with self.assertRaises(ValueError):
+            ps3.disparity_tiled(self.l, self.r, 0, self.w_size, self.dmax, return_costs=True)
+
+    def test_lr_matches_disparity_ssd(self):
+        d_l, d_r = ps3.disparity_lr(self.l, self.r, self.w_size, self.dmax)[:2]
+        np.testing.assert_array_equal(d_l, self.disp[0])
+        np.testing.assert_array_equal(d_r, self.disp[1])
+
+    def test_subpixel_matches_parabola_fit(self):
+        for direction in (0, 1):
+            sub = ps3.disparity_ssd(self.l, self.r, direction, self.w_size, self.dmax, subpixel=True)
+            disp_img = self.disp[direction]
+            self.assertEqual(sub.dtype, np.float32)
+            self.assertTrue((np.abs(sub - disp_img) <= 0.5).all())
+
+            # the vertex of the parabola through the old DSI costs around the integer disparity
+            dsi = _old_ssd_dsi(self.l, self.r, direction, self.w_size, self.dmax)
+            inner = (disp_img > 0) & (disp_img < self.dmax - 1)
+            d = np.clip(disp_img, 1, self.dmax - 2)[..., np.newaxis]
+            c_minus, c, c_plus = [np.take_along_axis(dsi, d + i, axis=2)[..., 0] for i in (-1, 0, 1)]
+            curvature = c_minus - 2 * c + c_plus
+            fitted = inner & (curvature > 1e-6)
+            offset = np.clip((c_minus - c_plus)[fitted] / (2 * curvature[fitted]), -0.5, 0.5)
+            np.testing.assert_allclose(sub[fitted], disp_img[fitted] + offset, rtol=0, atol=1e-4)
+            np.testing.assert_array_equal(sub[~inner], disp_img[~inner])
+
+    def test_subpixel_finds_a_fractional_shift(self):
+        # a smooth random texture moved by 5.3 columns with linear interpolation
+        d = 5.3
+        texture = cv2.GaussianBlur(np.random.RandomState(0).rand(64, 240), (0, 0), 2.).astype(np.float32)
+        cols = np.tile(np.arange(200, dtype=np.float32), (64, 1))
+        rows = np.tile(np.arange(64, dtype=np.float32)[:, np.newaxis], (1, 200))
+        l = texture[:, :200].astype(np.float64)
+        r = cv2.remap(texture, cols + d, rows, cv2.INTER_LINEAR).astype(np.float64)
+        inner = (slice(8, -8), slice(16, -8))
+        sub = ps3.disparity_ssd(l, r, 0, self.w_size, 16, subpixel=True)[inner]
+        self.assertLess(np.abs(sub - d).mean(), 0.1)
+        self.assertLess(np.abs(sub - d).mean(), np.abs(ps3.disparity_ssd(l, r, 0, self.w_size, 16)[inner] - d).mean())
+
+    def test_lr_consistency_and_fill(self):
+        for tolerance in (0, 1, 3):
+            d_l, d_r, consistent, filled = ps3.disparity_lr(self.l, self.r, self.w_size, self.dmax,
+                                                            tolerance=tolerance)
+            for y in range(d_l.shape[0]):
+                row = [x - d_l[y, x] >= 0 and abs(d_l[y, x] - d_r[y, x - d_l[y, x]]) <= tolerance
+                       for x in range(d_l.shape[1])]
+                np.testing.assert_array_equal(consistent[y], row)
+
+                valid = np.flatnonzero(row)
+                for x in range(d_l.shape[1]):
+                    if row[x] or not len(valid):
+                        expected = d_l[y, x]
+                    else:
+                        # the lower of the nearest consistent disparities to the left and right
+                        expected = min(d_l[y, valid[valid < x][-1:]].tolist() + d_l[y, valid[valid > x][:1]].tolist())
+                    self.assertEqual(filled[y, x], expected)
+
+
+class DisparityNCorrTest(unittest.TestCase):
+
+    w_size = (7, 7)
+    dmax = 60
+
+    @classmethod
+    def setUpClass(cls):
+        cls.l, cls.r = _read_pair('pair1', slice(200, 264))
+
+    def assert_matches_dsi(self, disp_img, best, dsi):
+        # the best correlation up to rounding, at a disparity whose correlation is the highest up to rounding
+        np.testing.assert_allclose(best, dsi.max(axis=2), rtol=0, atol=1e-9)
+        chosen = np.take_along_axis(dsi, disp_img[..., np.newaxis], axis=2)[..., 0]
+        self.assertTrue((chosen >= dsi.max(axis=2) - 1e-9).all())
+
+    def test_matches_old_implementation(self):
+        for direction in (0, 1):
+            disp_img, best, _ = ps3.disparity_ncorr(self.l, self.r, direction, self.w_size, self.dmax,
+                                                    return_costs=True)
+            self.assert_matches_dsi(disp_img, best, _old_ncorr_dsi(self.l, self.r, direction, self.w_size,
+                                                                   self.dmax))
+
+    def test_lr_matches_disparity_ncorr(self):
+        d_l, d_r = ps3.disparity_lr(self.l, self.r, self.w_size, self.dmax, metric='ncorr')[:2]
+        np.testing.assert_array_equal(d_l, ps3.disparity_ncorr(self.l, self.r, 0, self.w_size, self.dmax))
+        np.testing.assert_array_equal(d_r, ps3.disparity_ncorr(self.l, self.r, 1, self.w_size, self.dmax))
+
+    def test_zero_mean(self):
+        for direction in (0, 1):
+            disp_img, best, _ = ps3.disparity_ncorr(self.l, self.r, direction, self.w_size, self.dmax,
+                                                    return_costs=True, zero_mean=True)
+            self.assert_matches_dsi(disp_img, best, _old_ncorr_dsi(self.l, self.r, direction, self.w_size,
+                                                                   self.dmax, zero_mean=True))
+
+            # a brightness offset only changes the correlations by rounding
+            brighter = ps3.disparity_ncorr(self.l + 0.2, self.r, direction, self.w_size, self.dmax,
+                                           return_costs=True, zero_mean=True)
+            np.testing.assert_allclose(brighter[1], best, rtol=0, atol=1e-6)
+            self.assertGreater(np.mean(brighter[0] == disp_img), 0.99)
+
+
+class DisparityPyramidTest(unittest.TestCase):
+
+    def test_one_level_is_the_full_search(self):
+        l, r = _read_pair('pair1', slice(200, 264))
+        for metric in ('ssd', 'ncorr'):
+            np.testing.assert_array_equal(ps3.disparity_pyramid(l, r, 0, (7, 7), 60, levels=1, metric=metric),
+                                          ps3._DISPARITY_METHODS[metric](l, r, 0, (7, 7), 60))
+
+    def test_finds_a_large_disparity(self):
+        # a smooth random texture moved by 37 columns, which is not a multiple of the pyramid scale
+        d, width = 37, 200
+        texture = cv2.GaussianBlur(np.random.RandomState(0).rand(96, width + d), (5, 5), 1.5)
+        l, r = texture[:, :width], texture[:, d:d + width]
+        for metric in ('ssd', 'ncorr'):
+            for levels in (2, 3):
+                disp_img = ps3.disparity_pyramid(l, r, 0, (7, 7), 64, levels=levels, metric=metric)
+                self.assertEqual(disp_img.shape, l.shape)
+                # the columns left of d have no match in the right image
+                self.assertTrue((disp_img[:, d + 8:-8] == d).all())
+
+    def test_rejects_bad_arguments(self):
+        l, r = _read_pair('pair1', slice(200, 216))
+        with self.assertRaises(ValueError):
+            ps3.disparity_pyramid(l, r, 0, (7, 7), 60, metric='census')
+        with self.assertRaises(ValueError):
+            ps3.disparity_pyramid(l, r, 0, (7, 7), 60, levels=0)
+
+
+class StereoMatcherTest(unittest.TestCase):
+
+    w_size = (7, 7)
+    dmax = 100
+
+    @classmethod
+    def setUpClass(cls):
+        cls.l, cls.r = _read_pair('pair1', slice(200, 296))
+
+    def test_band_search_matches_full_search_in_band(self):
+        # every prior is within radius of the full search disparity, so the band contains the full search minimum
+        rng = np.random.RandomState(0)
+        for metric in ('ssd', 'ncorr'):
+            for direction in (0, 1):
+                full = ps3._DISPARITY_METHODS[metric](self.l, self.r, direction, self.w_size, self.dmax)
+                prior = np.clip(full + rng.randint(-2, 3, full.shape), 0, self.dmax - 1)
+                band = ps3._band_search(self.l, self.r, direction, self.w_size, prior, 2, self.dmax, metric)
+                np.testing.assert_array_equal(band, full)
+
+    def test_static_scene_stays_close_to_disparity_ssd(self):
+        # a static scene with new sensor noise every frame: no row changes, so all but the first frame are band
+        # searches. The noise moves some full search minima out of the band, but the band search must not drift
+        rng = np.random.RandomState(0)
+        matcher = ps3.StereoMatcher(0, self.w_size, self.dmax, refresh=None)
+        for frame in range(6):
+            l = self.l + rng.normal(0., 0.02, self.l.shape)
+            r = self.r + rng.normal(0., 0.02, self.r.shape)
+            disp_img = matcher.match(l, r)
+            full = ps3.disparity_ssd(l, r, 0, self.w_size, self.dmax)
+            self.assertEqual(matcher.full_search_rows, self.l.shape[0] if frame == 0 else 0)
+            self.assertGreater(np.mean(disp_img == full), 0.65)
+            self.assertGreater(np.mean(np.abs(disp_img - full) <= 2), 0.7)
+
+    def test_refresh(self):
+        matcher = ps3.StereoMatcher(0, self.w_size, self.dmax, refresh=3)
+        rows = []
+        for _ in range(7):
+            matcher.match(self.l, self.r)
+            rows.append(matcher.full_search_rows)
+        self.assertEqual(rows, [96, 0, 0, 96, 0, 0, 96])
+        with self.assertRaises(ValueError):
+            ps3.StereoMatcher(0, self.w_size, self.dmax, refresh=0)
+
+
+def _path_costs(cost_volume, dy, dx, p1, p2):
+    # the SGM recurrence, one pixel at a time
+    rows, cols, dmax = cost_volume.shape
+    path = np.zeros(cost_volume.shape, dtype=np.int64)
+    for r in (range(rows) if dy == 1 else range(rows - 1, -1, -1)):
+        for c in range(cols):
+            if not 0 <= c - dx < cols or not 0 <= r - dy < rows:
+                path[r, c] = cost_volume[r, c]
+                continue
+            prev = path[r - dy, c - dx]
+            lowest = prev.min()
+            for d in range(dmax):
+                neighbours = prev[max(d - 1, 0):d + 2] + p1
+                path[r, c, d] = cost_volume[r, c, d] + min(prev[d], neighbours.min(), lowest + p2) - lowest
+    return path
+
+
+class DisparitySGMTest(unittest.TestCase):
+
+    def test_aggregate_path_matches_recurrence(self):
+        cost_volume = np.random.RandomState(0).randint(0, 256, (9, 11, 7)).astype(np.int16)
+        for dy, dx in [(1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)]:
+            total = np.zeros_like(cost_volume)
+            ps3._aggregate_path(cost_volume, dy, dx, 10, 120, total)
+            np.testing.assert_array_equal(total, _path_costs(cost_volume, dy, dx, 10, 120))
+
+    def test_not_much_slower_than_disparity_ssd(self):
+        # the paths are walked one row at a time, vectorized over the columns and disparities
+        l, r = _read_pair('pair1', slice(None))
+        ssd = _best_time(lambda: ps3.disparity_ssd(l, r, 0, (5, 5), 100))
+        sgm = _best_time(lambda: ps3.disparity_sgm(l, r, 0, (5, 5), 100))
+        self.assertLess(sgm, 5 * ssd + 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,291 @@
+"""
+Benchmark and synthetic scene generator for the calibration and fundamental matrix functions in ps4.py.
+
+Generates synthetic pinhole cameras (K, R, t), 3D point clouds, their projections with controlled pixel noise and
+outlier rate, and stereo pairs with their true fundamental matrix. Each stage (least squares, batched least
+squares, calibrate_camera, RANSAC calibration, camera center, fundamental matrix) is timed on scenes of growing
+size, reporting the run time, the throughput in points/sec and solves/sec and the distribution of the errors
+against the noise free ground truth:
+
+    camera matrix stages: reprojection error of the true inliers in pixels.
+    fundamental matrix stages: Sampson distance (square root) of the true inliers in pixels.
+    camera center: distance to the true center in world units.
+
+How to run:
+python benchmark.py [--sizes 20 1000 1000000] [--noise 0.5] [--outliers 0.2] [--repeat 3]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import ps4
+
+
+def rotation_matrix(angles):
+    """Returns the rotation R = R_z * R_y * R_x for angles (in radians) around the x, y and z axes.
+
+    Args:
+        angles (tuple): rotation angles (x, y, z).
+
+    Returns:
+        numpy.array: rotation matrix of shape (3, 3).
+    """
+    cx, cy, cz = np.cos(angles)
+    sx, sy, sz = np.sin(angles)
+    r_x = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    r_y = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    r_z = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return np.dot(r_z, np.dot(r_y, r_x))
+
+
+def make_camera(image_shape=(480, 640), focal=800., angles=(0., 0., 0.), center=(0., 0., -10.)):
+    """Builds a pinhole camera M = K * [R | t] with the principal point at the image center.
+
+    Args:
+        image_shape (tuple): image shape (rows, cols).
+        focal (float): focal length in pixels.
+        angles (tuple): rotation angles (x, y, z) of the world to camera rotation, see rotation_matrix.
+        center (tuple): camera center in world coordinates.
+
+    Returns:
+        dict: 'K' (3, 3), 'R' (3, 3), 't' (3, 1), 'M' (3, 4), 'center' (3,) and 'shape' (rows, cols).
+    """
+    k = np.array([[focal, 0, (image_shape[1] - 1) / 2.],
+                  [0, focal, (image_shape[0] - 1) / 2.],
+                  [0, 0, 1]])
+    r = rotation_matrix(angles)
+    t = -np.dot(r, np.reshape(center, (3, 1)))
+    return {'K': k, 'R': r, 't': t, 'M': np.dot(k, np.hstack((r, t))), 'center': np.asarray(center, dtype=float),
+            'shape': tuple(image_shape)}
+
+
+def make_points(n, rng, radius=3.):
+    """Returns n random 3D points uniformly distributed in a cube centered at the origin.
+
+    Args:
+        n (int): number of points.
+        rng (numpy.random.RandomState): random generator.
+        radius (float): half the side of the cube.
+
+    Returns:
+        numpy.array: points of shape (n, 3).
+    """
+    return rng.uniform(-radius, radius, (n, 3))
+
+
+def observe(camera, pts3d, rng, noise=0., outlier_rate=0.):
+    """Projects 3D points with a camera, adding Gaussian pixel noise and replacing a fraction by outliers.
+
+    Args:
+        camera (dict): camera, see make_camera.
+        pts3d (numpy.array): 3D points of shape (N, 3).
+        rng (numpy.random.RandomState): random generator.
+        noise (float): standard deviation of the pixel noise.
+        outlier_rate (float): fraction of the points replaced by uniformly random pixels of the image.
+
+    Returns:
+        tuple: three-element tuple containing:
+               pts2d (numpy.array): observed 2D points of shape (N, 2).
+               clean (numpy.array): noise free 2D points of shape (N, 2).
+               outliers (numpy.array): boolean outlier mask of shape (N,).
+    """
+    clean = ps4.project_points(pts3d, camera['M'])
+    pts2d = clean + rng.normal(0, noise, clean.shape) if noise > 0 else clean.copy()
+    outliers = rng.rand(len(pts3d)) < outlier_rate
+    rows, cols = camera['shape']
+    pts2d[outliers] = rng.uniform(0, 1, (np.count_nonzero(outliers), 2)) * (cols - 1, rows - 1)
+    return pts2d, clean, outliers
+
+
+def fundamental_from_cameras(camera_1, camera_2):
+    """Returns the true fundamental matrix, p_2^T * F * p_1 = 0, of two cameras.
+
+    Args:
+        camera_1 (dict): first camera, see make_camera.
+        camera_2 (dict): second camera.
+
+    Returns:
+        numpy.array: fundamental matrix of shape (3, 3) with unit norm.
+    """
+    r = np.dot(camera_2['R'], camera_1['R'].T)
+    t = camera_2['t'] - np.dot(r, camera_1['t'])
+    t_x = np.array([[0, -t[2, 0], t[1, 0]], [t[2, 0], 0, -t[0, 0]], [-t[1, 0], t[0, 0], 0]])
+    f = np.dot(np.linalg.inv(camera_2['K']).T, np.dot(t_x, np.dot(r, np.linalg.inv(camera_1['K']))))
+    return f / np.linalg.norm(f)
+
+
+def make_scene(n, noise=0.5, outlier_rate=0., baseline=1.5, seed=None):
+    """Generates a calibration scene and a stereo pair sharing the same point cloud.
+
+    The first camera sits on the -z axis looking at the cloud with a small random rotation, the second one is
+    moved by baseline along x and turned towards the cloud.
+
+    Args:
+        n (int): number of points.
+        noise (float): standard deviation of the pixel noise.
+        outlier_rate (float): fraction of outliers in each image.
+        baseline (float): distance between the two camera centers.
+        seed (int): random seed. Default set to None.
+
+    Returns:
+        dict: 'pts3d' (n, 3), 'camera_1' and 'camera_2' (see make_camera), 'pts2d_1', 'pts2d_2' (observed),
+              'clean_1', 'clean_2' (noise free), 'outliers_1', 'outliers_2' (boolean masks) and 'F' (true
+              fundamental matrix).
+    """
+    rng = np.random.RandomState(seed)
+    pts3d = make_points(n, rng)
+    camera_1 = make_camera(angles=rng.uniform(-0.05, 0.05, 3))
+    camera_2 = make_camera(angles=(0., -np.arctan2(baseline, 10.), 0.), center=(baseline, 0., -10.))
+
+    scene = {'pts3d': pts3d, 'camera_1': camera_1, 'camera_2': camera_2,
+             'F': fundamental_from_cameras(camera_1, camera_2)}
+    for i, camera in ((1, camera_1), (2, camera_2)):
+        pts2d, clean, outliers = observe(camera, pts3d, rng, noise, outlier_rate)
+        scene['pts2d_{}'.format(i)], scene['clean_{}'.format(i)], scene['outliers_{}'.format(i)] = \
+            pts2d, clean, outliers
+    return scene
+
+
+def _reprojection_errors(scene, m):
+    inliers = ~scene['outliers_1']
+    return ps4.get_residuals(scene['clean_1'][inliers], ps4.project_points(scene['pts3d'][inliers], m))[:, 0]
+
+
+def _sampson_errors(scene, f):
+    inliers = ~(scene['outliers_1'] | scene['outliers_2'])
+    p_1 = np.insert(scene['clean_1'][inliers], 2, 1, axis=1)
+    p_2 = np.insert(scene['clean_2'][inliers], 2, 1, axis=1)
+    return np.sqrt(ps4.sampson_distance(f, p_1, p_2))
+
+
+# A stage runs one function on a scene and returns (errors, number of solves, number of points solved). Errors may be
+# None.
+def stage_least_squares(scene, config):
+    m = ps4.solve_least_squares(scene['pts3d'], scene['pts2d_1'])[0]
+    return _reprojection_errors(scene, m), 1, len(scene['pts3d'])
+
+
+def stage_least_squares_batch(scene, config):
+    n, k = len(scene['pts3d']), config['set_size_k']
+    # windows of k consecutive indices, the points are in random order already
+    subsets = np.random.RandomState(0).randint(0, n - k + 1, (config['batch'], 1)) + np.arange(k)
+    ps4.solve_least_squares_batch(scene['pts3d'][subsets], scene['pts2d_1'][subsets])
+    # every solve fits its own k points, the scene size does not matter
+    return None, config['batch'], config['batch'] * k
+
+
+def stage_calibrate_camera(scene, config):
+    m = ps4.calibrate_camera(scene['pts3d'], scene['pts2d_1'], config['set_size_k'])[0]
+    return _reprojection_errors(scene, m), 10, len(scene['pts3d'])
+
+
+def stage_calibrate_camera_ransac(scene, config):
+    m, _, stats = ps4.calibrate_camera_ransac(scene['pts3d'], scene['pts2d_1'], threshold=config['threshold'],
+                                              seed=0)
+    return _reprojection_errors(scene, m), stats['iterations'], len(scene['pts3d'])
+
+
+def stage_camera_center(scene, config):
+    m = ps4.solve_least_squares(scene['pts3d'], scene['pts2d_1'])[0]
+    center = ps4.get_camera_center(m).ravel()
+    return np.array([np.linalg.norm(center - scene['camera_1']['center'])]), 1, len(scene['pts3d'])
+
+
+def stage_fundamental_matrix(scene, config):
+    f = ps4.reduce_rank(ps4.compute_fundamental_matrix(scene['pts2d_1'], scene['pts2d_2']))
+    return _sampson_errors(scene, f), 1, len(scene['pts2d_1'])
+
+
+def stage_fundamental_matrix_ransac(scene, config):
+    f, _, stats = ps4.compute_fundamental_matrix_ransac(scene['pts2d_1'], scene['pts2d_2'],
+                                                        threshold=config['threshold'], seed=0)
+    return _sampson_errors(scene, f), stats['iterations'], len(scene['pts2d_1'])
+
+
+STAGES = [
+    ('solve_least_squares', stage_least_squares),
+    ('solve_least_squares_batch', stage_least_squares_batch),
+    ('calibrate_camera', stage_calibrate_camera),
+    ('calibrate_camera_ransac', stage_calibrate_camera_ransac),
+    ('get_camera_center', stage_camera_center),
+    ('compute_fundamental_matrix', stage_fundamental_matrix),
+    ('compute_fundamental_matrix_ransac', stage_fundamental_matrix_ransac),
+]
+
+
+def run_benchmark(sizes, noise=0.5, outlier_rate=0., repeat=1, seed=0, stages=None):
+    """Runs every stage on a synthetic scene of each size and prints a report.
+
+    Args:
+        sizes (list): numbers of points.
+        noise (float): standard deviation of the pixel noise.
+        outlier_rate (float): fraction of outliers in each image.
+        repeat (int): number of runs of each stage, the best time is reported.
+        seed (int): random seed for the scenes.
+        stages (list): names of the stages to run. Default set to None (all of them).
+
+    Returns:
+        list: one dict per (size, stage) with the measurements.
+    """
+    config = {
+        'set_size_k': 8,
+        'batch': 10000,
+        'threshold': max(3 * noise, 1.),
+    }
+    report = []
+    header = "{:>8} {:<34} {:>9} {:>12} {:>11} {:>9} {:>9} {:>9} {:>9}".format(
+        'points', 'stage', 'time (s)', 'points/s', 'solves/s', 'err p50', 'err p90', 'err p99', 'err max')
+    print(header)
+    print('-' * len(header))
+
+    for n in sizes:
+        scene = make_scene(n, noise, outlier_rate, seed=seed)
+
+        for name, stage in STAGES:
+            if stages is not None and name not in stages:
+                continue
+            # calibrate_camera checks each fit on 4 points outside its subset
+            if name == 'calibrate_camera' and n < config['set_size_k'] + 4:
+                continue
+
+            seconds = None
+            for _ in range(repeat):
+                start = time.time()
+                errors, solves, points = stage(scene, config)
+                elapsed = time.time() - start
+                seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+            row = {'points': n, 'stage': name, 'seconds': seconds, 'points_per_sec': points / max(seconds, 1e-9),
+                   'solves_per_sec': solves / max(seconds, 1e-9) if solves else None, 'errors': None}
+            percentiles = ('', '', '', '')
+            if errors is not None and len(errors) > 0:
+                row['errors'] = dict(zip(('p50', 'p90', 'p99', 'max'), np.percentile(errors, [50, 90, 99, 100])))
+                percentiles = tuple("{:.4f}".format(row['errors'][key]) for key in ('p50', 'p90', 'p99', 'max'))
+            report.append(row)
+
+            solves_per_sec = '' if row['solves_per_sec'] is None else "{:.0f}".format(row['solves_per_sec'])
+            print("{:>8} {:<34} {:>9.4f} {:>12.0f} {:>11} {:>9} {:>9} {:>9} {:>9}".format(
+                n, name, seconds, row['points_per_sec'], solves_per_sec, *percentiles))
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the calibration functions in ps4.py.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000, 10000, 100000, 1000000],
+                        help='numbers of points')
+    parser.add_argument('--noise', type=float, default=0.5, help='standard deviation of the pixel noise')
+    parser.add_argument('--outliers', type=float, default=0., help='fraction of outliers in each image')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the best time is reported')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--stages', nargs='+', default=None, help='names of the stages to run')
+
+    args = parser.parse_args()
+
+    run_benchmark(args.sizes, args.noise, args.outliers, args.repeat, args.seed, args.stages)
+
+
+if __name__ == '__main__':
+    main()
@@ -42,6 +42,10 @@ def read_points(filename):
 def draw_epipolar_lines(img_in, line_points, color=(255, 0, 0)):
     """Draws epipolar lines.
 
+    Same as draw_epipolar_segments, for the list output of get_epipolar_lines. The lines through the given end
+    points are clipped to the image first (see ps4.clip_lines), since the end points of a steep line can be far
+    outside the image, beyond the int32 coordinates cv2.polylines takes.
+
     Args:
         img_in (numpy.array): input image.
         line_points (list): list of tuples where each element consists of [(x1, y1), (x2, y2)].
@@ -51,11 +55,27 @@ def draw_epipolar_lines(img_in, line_points, color=(255, 0, 0)):
         numpy.array: image with epipolar lines drawn.
     """
 
-    img_out = np.copy(img_in)
+    ends = np.asarray(line_points, dtype=np.float64).reshape(-1, 2, 2)
+    ones = np.ones((len(ends), 1))
+    lines = np.cross(np.hstack((ends[:, 0], ones)), np.hstack((ends[:, 1], ones)))
+    return draw_epipolar_segments(img_in, clip_lines(lines, img_in.shape[:2]), color)
+
+
+def draw_epipolar_segments(img_in, segments, color=(255, 0, 0)):
+    """Draws epipolar lines in bulk.
+
+    Args:
+        img_in (numpy.array): input image.
+        segments (numpy.array): int32 array of shape (N, 2, 2) where each element is [(x1, y1), (x2, y2)], see
+                                get_epipolar_segments.
+        color (triple): lines color.
 
-    for points in line_points:
-        cv2.line(img_out, (points[0]), (points[1]), color)
+    Returns:
+        numpy.array: image with epipolar lines drawn.
+    """
 
+    img_out = np.copy(img_in)
+    cv2.polylines(img_out, list(segments), False, color)
     return img_out
 
 
@@ -141,10 +161,10 @@ def part_3():
     img_a = cv2.imread(os.path.join(input_dir, PIC_A))
     img_b = cv2.imread(os.path.join(input_dir, PIC_B))
 
-    lines_img_a, lines_img_b = get_epipolar_lines(img_a.shape, img_b.shape, f, pts2d_pic_a, pts2d_pic_b)
+    lines_img_a, lines_img_b = get_epipolar_segments(img_a.shape, img_b.shape, f, pts2d_pic_a, pts2d_pic_b)
 
-    epi_img_a = draw_epipolar_lines(img_a, lines_img_a)
-    epi_img_b = draw_epipolar_lines(img_b, lines_img_b)
+    epi_img_a = draw_epipolar_segments(img_a, lines_img_a)
+    epi_img_b = draw_epipolar_segments(img_b, lines_img_b)
 
     cv2.imwrite(os.path.join(output_dir, 'ps4-3-c-1.png'), epi_img_a)
     cv2.imwrite(os.path.join(output_dir, 'ps4-3-c-2.png'), epi_img_b)
@@ -174,10 +194,10 @@ def part_4():
     new_f = get_new_f(f_hat, t_a, t_b)
     print "New Fundamental Matrix F:\n {}".format(new_f)
 
-    lines_img_a, lines_img_b = get_epipolar_lines(img_a.shape, img_b.shape, new_f, pts2d_pic_a, pts2d_pic_b)
+    lines_img_a, lines_img_b = get_epipolar_segments(img_a.shape, img_b.shape, new_f, pts2d_pic_a, pts2d_pic_b)
 
-    epi_img_a = draw_epipolar_lines(img_a, lines_img_a)
-    epi_img_b = draw_epipolar_lines(img_b, lines_img_b)
+    epi_img_a = draw_epipolar_segments(img_a, lines_img_a)
+    epi_img_b = draw_epipolar_segments(img_b, lines_img_b)
 
     cv2.imwrite(os.path.join(output_dir, 'ps4-4-b-1.png'), epi_img_a)
     cv2.imwrite(os.path.join(output_dir, 'ps4-4-b-2.png'), epi_img_b)
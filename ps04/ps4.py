@@ -15,40 +15,96 @@ def solve_least_squares(pts3d, pts2d):
                M (numpy.array): transformation (a.k.a. projection) matrix of shape (3, 4).
                error (float): sum of squared residuals of all points.
     """
-    # construct u as 11x1 matrix
-    x = np.insert(pts3d, pts3d.shape[1], [1], axis=1)
-    x1 = np.insert(x, x.shape[1], [[0], [0], [0], [0]], axis=1)
-    x2 = pts3d * -1 * pts2d[:, 0].reshape(pts2d.shape[0], 1)
-    u = np.concatenate((x1, x2), axis=1)
-
-    # construct v as 11x1 matrix
-    y = np.insert(pts3d, pts3d.shape[1], [1], axis=1)
-    y1 = np.insert(y, 0, [[0], [0], [0], [0]], axis=1)
-    y2 = pts3d * -1 * pts2d[:, 1].reshape(pts2d.shape[0], 1)
-    v = np.concatenate((y1, y2), axis=1)
-
-    # combined u and v together
-    a = np.concatenate((u, v))
-    # shape b so it matches the order of a
-    b = pts2d.reshape((pts2d.size, 1), order='F')
+    a, b = _dlt_system(pts3d, pts2d)
 
     # calculate for M and error
-    m, residual = np.linalg.lstsq(a, b)[:2]
+    m, residual = np.linalg.lstsq(a, b[:, np.newaxis])[:2]
     m = np.concatenate((m, [[1]])).reshape(3, 4)
     error = np.sum(np.square(residual))
 
     return m, error
 
 
+def solve_least_squares_batch(pts3d, pts2d):
+    """Solves solve_least_squares for a stack of B point subsets at once.
+
+    All the design matrices are written into one preallocated (B, 2k, 11) array and solved together through the
+    normal equations (A^T A) m = A^T b with a batched np.linalg.solve. The columns are scaled to unit norm first to
+    keep the normal equations well conditioned.
+
+    Args:
+        pts3d (numpy.array): 3D global (x, y, z) points of shape (B, k, 3). Where k >= 6 is the subset size.
+        pts2d (numpy.array): corresponding 2D (u, v) points of shape (B, k, 2).
+
+    Returns:
+        tuple: two-element tuple containing:
+               M (numpy.array): transformation matrices of shape (B, 3, 4).
+               error (numpy.array): errors of shape (B,), computed as in solve_least_squares.
+    """
+    pts3d = np.asarray(pts3d, dtype=np.float64)
+    pts2d = np.asarray(pts2d, dtype=np.float64)
+    if pts3d.shape[-2] < 6:
+        raise ValueError("at least 6 points per subset are needed, got {}".format(pts3d.shape[-2]))
+
+    a, b = _dlt_system(pts3d, pts2d)
+    a_t = a.transpose(0, 2, 1)
+
+    scale = np.sqrt(np.einsum('bij,bij->bj', a, a))
+    scale[scale == 0] = 1.
+    ata = np.matmul(a_t, a) / (scale[:, :, np.newaxis] * scale[:, np.newaxis, :])
+    atb = np.matmul(a_t, b[:, :, np.newaxis]) / scale[:, :, np.newaxis]
+    m = np.linalg.solve(ata, atb)[:, :, 0] / scale
+
+    residual = np.matmul(a, m[:, :, np.newaxis])[:, :, 0] - b
+    # solve_least_squares squares the sum of squared residuals returned by lstsq
+    error = np.square(np.sum(np.square(residual), axis=1))
+
+    m = np.concatenate((m, np.ones((m.shape[0], 1))), axis=1).reshape(-1, 3, 4)
+    return m, error
+
+
+def _dlt_system(pts3d, pts2d):
+    """Builds the linear system A m = b of the projection matrix with M[2, 3] = 1.
+
+    The first k rows hold the u equations [X Y Z 1 0 0 0 0 -uX -uY -uZ] and the last k rows the v equations
+    [0 0 0 0 X Y Z 1 -vX -vY -vZ]; b is [u_1 .. u_k, v_1 .. v_k]. Any leading batch dimensions are kept, and A is
+    written into a single preallocated array.
+
+    Args:
+        pts3d (numpy.array): 3D points of shape (..., k, 3).
+        pts2d (numpy.array): 2D points of shape (..., k, 2).
+
+    Returns:
+        tuple: A of shape (..., 2k, 11) and b of shape (..., 2k).
+    """
+    k = pts3d.shape[-2]
+    batch = pts3d.shape[:-2]
+    a = np.zeros(batch + (2 * k, 11))
+    u = pts2d[..., 0:1]
+    v = pts2d[..., 1:2]
+
+    a[..., :k, 0:3] = pts3d
+    a[..., :k, 3] = 1
+    np.multiply(pts3d, -u, out=a[..., :k, 8:11])
+    a[..., k:, 4:7] = pts3d
+    a[..., k:, 7] = 1
+    np.multiply(pts3d, -v, out=a[..., k:, 8:11])
+
+    b = np.concatenate((pts2d[..., 0], pts2d[..., 1]), axis=-1)
+    return a, b
+
+
 def project_points(pts3d, m):
     """Projects each 3D point to 2D using the matrix M.
 
     Args:
         pts3d (numpy.array): 3D global (x, y, z) points of shape (N, 3). Where N is the number of points.
-        m (numpy.array): transformation (a.k.a. projection) matrix of shape (3, 4).
+        m (numpy.array): transformation (a.k.a. projection) matrix of shape (3, 4), or a stack of B matrices of
+                         shape (B, 3, 4).
 
     Returns:
-        numpy.array: projected 2D (u, v) points of shape (N, 2). Where N is the same as pts3d.
+        numpy.array: projected 2D (u, v) points of shape (N, 2), or (B, N, 2) for a stack of matrices. Where N is
+                     the same as pts3d.
     """
     # add 4th dimension
     pts3d_temp = np.insert(pts3d, pts3d.shape[1], [1], axis=1)
@@ -56,9 +112,9 @@ def project_points(pts3d, m):
     # dot product of matrix M with pts3d
     pts2d_projected = np.dot(m, pts3d_temp.T)
     # normalize (first two rows divided by the last column)
-    pts2d_projected = pts2d_projected[:2] / pts2d_projected[2]
+    pts2d_projected = pts2d_projected[..., :2, :] / pts2d_projected[..., 2:, :]
     # switch axis
-    pts2d_projected = np.swapaxes(pts2d_projected, 0, 1)
+    pts2d_projected = np.swapaxes(pts2d_projected, -1, -2)
 
     return pts2d_projected
 
@@ -98,15 +154,16 @@ def calibrate_camera(pts3d, pts2d, set_size_k):
     best_error = None
     avg_residuals = np.zeros((0, 1))
 
-    for i in xrange(10):
-        # Randomly choose k points from the 2D list and their corresponding points in the 3D list.
-        indices = np.sort(np.random.choice(pts2d.shape[0], set_size_k, replace=False))
+    # Randomly choose 10 sets of k points from the 2D list and their corresponding points in the 3D list.
+    subsets = np.sort([np.random.choice(pts2d.shape[0], set_size_k, replace=False) for _ in xrange(10)], axis=1)
 
-        # Compute the projection matrix M on the chosen points.
-        m, error = solve_least_squares(pts3d[indices], pts2d[indices])
+    # Compute the projection matrix M of every set at once.
+    ms, errors = solve_least_squares_batch(pts3d[subsets], pts2d[subsets])
 
+    for indices, m, error in zip(subsets, ms, errors):
         # set probability to the chosen indices to 0 and split the rest
-        p = [0 if i in indices else (1. / (pts2d.shape[0] - set_size_k)) for i in xrange(pts2d.shape[0])]
+        p = np.full(pts2d.shape[0], 1. / (pts2d.shape[0] - set_size_k))
+        p[indices] = 0
 
         # Pick 4 points not in your set of k, and compute the average residual.
         residual_indices = np.sort(np.random.choice(pts2d.shape[0], 4, replace=False, p=p))
@@ -130,6 +187,130 @@ def calibrate_camera(pts3d, pts2d, set_size_k):
     return best_m, best_error, avg_residuals
 
 
+def calibrate_camera_ransac(pts3d, pts2d, set_size_k=6, threshold=2., confidence=0.99, max_iterations=10000,
+                            batch_size=64, local_optimization=True, seed=None):
+    """Finds the camera projection matrix with RANSAC, for correspondences that contain outliers.
+
+    Hypotheses are drawn in batches of batch_size random k-point subsets, solved with solve_least_squares_batch
+    and scored together: all the points are projected with every hypothesis (see project_points) and the points
+    with a residual below threshold are its inliers. The number of iterations adapts to the best inlier ratio w so
+    far, stopping after log(1 - confidence) / log(1 - w^k) hypotheses. With local_optimization, every new best
+    hypothesis is refit on its inliers (LO-RANSAC). The final M is refit on all the inliers of the best one.
+
+    Args:
+        pts3d (numpy.array): 3D global (x, y, z) points of shape (N, 3). Where N is the number of points.
+        pts2d (numpy.array): corresponding 2D (u, v) points of shape (N, 2). Where N is the number of points.
+        set_size_k (int): number of points of each hypothesis, at least 6.
+        threshold (float): maximum residual (in pixels) of an inlier.
+        confidence (float): probability of drawing at least one all-inlier subset, in (0, 1).
+        max_iterations (int): maximum number of hypotheses.
+        batch_size (int): number of hypotheses scored at a time. It is reduced for large N so that a batch
+                          projects at most about 4 million points.
+        local_optimization (bool): refit every new best hypothesis on its inliers.
+        seed (int): random seed. Default set to None.
+
+    Returns:
+        tuple: three-element tuple containing:
+               best_m (numpy.array): transformation matrix M of shape (3, 4).
+               inliers (numpy.array): boolean inlier mask of shape (N,).
+               stats (dict): 'mean', 'median', 'rms' and 'max' residual of the inliers, 'inlier_ratio' and the
+                             number of 'iterations' (hypotheses drawn).
+    """
+    pts3d = np.asarray(pts3d, dtype=np.float64)
+    pts2d = np.asarray(pts2d, dtype=np.float64)
+    n = pts2d.shape[0]
+    if n < set_size_k:
+        raise ValueError("{} points are not enough for subsets of {}".format(n, set_size_k))
+
+    rng = np.random.RandomState(seed)
+    batch_size = max(1, min(batch_size, (1 << 22) // n))
+
+    best_m = None
+    best_inliers = np.zeros(n, dtype=np.bool_)
+    iterations = 0
+    needed = max_iterations
+
+    while iterations < min(needed, max_iterations):
+        batch = min(batch_size, max_iterations - iterations)
+        subsets = _random_subsets(rng, n, set_size_k, batch)
+        iterations += batch
+
+        ms = solve_least_squares_batch(pts3d[subsets], pts2d[subsets])[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.linalg.norm(project_points(pts3d, ms) - pts2d, axis=2)
+            inliers = distances < threshold
+        counts = inliers.sum(axis=1)
+
+        i = np.argmax(counts)
+        if counts[i] <= best_inliers.sum():
+            continue
+
+        best_m, best_inliers = ms[i], inliers[i]
+        if local_optimization:
+            best_m, best_inliers = _refit_camera(pts3d, pts2d, best_m, best_inliers, threshold)
+
+        ratio = best_inliers.mean()
+        if ratio >= 1:
+            break
+        needed = np.log(1 - confidence) / np.log(max(1 - ratio ** set_size_k, 1e-12))
+
+    if best_m is None or best_inliers.sum() < set_size_k:
+        raise ValueError("no hypothesis has {} inliers within {} pixels".format(set_size_k, threshold))
+
+    # final refit on all the inliers
+    best_m, best_inliers = _refit_camera(pts3d, pts2d, best_m, best_inliers, threshold)
+    residuals = get_residuals(pts2d[best_inliers], project_points(pts3d[best_inliers], best_m))[:, 0]
+    stats = {
+        'mean': residuals.mean(),
+        'median': np.median(residuals),
+        'rms': np.sqrt(np.mean(np.square(residuals))),
+        'max': residuals.max(),
+        'inlier_ratio': best_inliers.mean(),
+        'iterations': iterations,
+    }
+    return best_m, best_inliers, stats
+
+
+def _random_subsets(rng, n, k, batch):
+    """Returns batch random subsets of k distinct indices in [0, n), array of shape (batch, k)."""
+    if n <= 4 * k:
+        return np.argsort(rng.rand(batch, n), axis=1)[:, :k]
+
+    subsets = rng.randint(0, n, (batch, k))
+    while True:
+        ordered = np.sort(subsets, axis=1)
+        repeated = (ordered[:, 1:] == ordered[:, :-1]).any(axis=1)
+        if not repeated.any():
+            return subsets
+        subsets[repeated] = rng.randint(0, n, (repeated.sum(), k))
+
+
+def _refit_camera(pts3d, pts2d, m, inliers, threshold, steps=2):
+    """Refits M on its inliers and updates the inliers, a few times. Keeps the previous M if a refit is worse.
+
+    Args:
+        pts3d (numpy.array): 3D points of shape (N, 3).
+        pts2d (numpy.array): 2D points of shape (N, 2).
+        m (numpy.array): projection matrix of shape (3, 4).
+        inliers (numpy.array): boolean inlier mask of m, shape (N,).
+        threshold (float): maximum residual of an inlier.
+        steps (int): number of refits.
+
+    Returns:
+        tuple: (M, inliers).
+    """
+    for _ in range(steps):
+        if inliers.sum() < 6:
+            break
+        refit = solve_least_squares(pts3d[inliers], pts2d[inliers])[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            refit_inliers = get_residuals(pts2d, project_points(pts3d, refit))[:, 0] < threshold
+        if refit_inliers.sum() < inliers.sum():
+            break
+        m, inliers = refit, refit_inliers
+    return m, inliers
+
+
 def get_camera_center(m):
     """Finds the camera global coordinates.
 
@@ -171,23 +352,157 @@ def compute_fundamental_matrix(pts2d_1, pts2d_2):
     return f
 
 
+def compute_fundamental_matrix_ransac(pts2d_1, pts2d_2, threshold=1., confidence=0.99, max_iterations=10000,
+                                     batch_size=256, seed=None):
+    """Computes the fundamental matrix with RANSAC, for correspondences that contain outliers.
+
+    The points are normalized once (see _normalization_matrix). Hypotheses are drawn in batches of batch_size random
+    8-point samples, solved together as one batched SVD (normalized eight-point algorithm), reduced to rank 2 with
+    reduce_rank and scored against all the correspondences with the Sampson distance. The number of iterations
+    adapts to the best inlier ratio w so far, stopping after log(1 - confidence) / log(1 - w^8) hypotheses. The final
+    F is refit on all the inliers of the best hypothesis.
+
+    Args:
+        pts2d_1 (numpy.array): 2D points from image 1 of shape (N, 2). Where N is the number of points.
+        pts2d_2 (numpy.array): 2D points from image 2 of shape (N, 2). Where N is the number of points.
+        threshold (float): maximum Sampson distance (in pixels) of an inlier.
+        confidence (float): probability of drawing at least one all-inlier sample, in (0, 1).
+        max_iterations (int): maximum number of hypotheses.
+        batch_size (int): number of hypotheses scored at a time. It is reduced for large N so that a batch
+                          scores at most about 2 million correspondences.
+        seed (int): random seed. Default set to None.
+
+    Returns:
+        tuple: three-element tuple containing:
+               f (numpy.array): rank 2 fundamental matrix of shape (3, 3) with unit norm, p_2^T * F * p_1 = 0.
+               inliers (numpy.array): boolean inlier mask of shape (N,).
+               stats (dict): 'inlier_ratio' and the number of 'iterations' (hypotheses drawn), as in
+                             calibrate_camera_ransac.
+    """
+    pts2d_1 = np.asarray(pts2d_1, dtype=np.float64)
+    pts2d_2 = np.asarray(pts2d_2, dtype=np.float64)
+    n = pts2d_1.shape[0]
+    if n < 8:
+        raise ValueError("{} correspondences are not enough for the eight-point algorithm".format(n))
+
+    # normalize once, score in pixels
+    t_1 = _normalization_matrix(pts2d_1)
+    t_2 = _normalization_matrix(pts2d_2)
+    norm_1 = normalize_points(pts2d_1, t_1)
+    norm_2 = normalize_points(pts2d_2, t_2)
+    p_1 = np.insert(pts2d_1, 2, 1, axis=1)
+    p_2 = np.insert(pts2d_2, 2, 1, axis=1)
+
+    rng = np.random.RandomState(seed)
+    batch_size = max(1, min(batch_size, (1 << 21) // n))
+    max_distance = threshold ** 2
+
+    best_f = None
+    best_inliers = np.zeros(n, dtype=np.bool_)
+    iterations = 0
+    needed = max_iterations
+
+    while iterations < min(needed, max_iterations):
+        batch = min(batch_size, max_iterations - iterations)
+        samples = _random_subsets(rng, n, 8, batch)
+        iterations += batch
+
+        fs = _eight_point(norm_1[samples], norm_2[samples])
+        fs = np.matmul(np.matmul(t_2.T, fs), t_1)
+        inliers = sampson_distance(fs, p_1, p_2) < max_distance
+        counts = inliers.sum(axis=1)
+
+        i = np.argmax(counts)
+        if counts[i] <= best_inliers.sum():
+            continue
+
+        best_f, best_inliers = fs[i], inliers[i]
+        ratio = best_inliers.mean()
+        if ratio >= 1:
+            break
+        needed = np.log(1 - confidence) / np.log(max(1 - ratio ** 8, 1e-12))
+
+    if best_f is None or best_inliers.sum() < 8:
+        raise ValueError("no hypothesis has 8 inliers within {} pixels".format(threshold))
+
+    # final refit on all the inliers, kept only if it does not lose any
+    refit = np.dot(t_2.T, np.dot(_eight_point(norm_1[best_inliers], norm_2[best_inliers]), t_1))
+    refit_inliers = sampson_distance(refit, p_1, p_2) < max_distance
+    if refit_inliers.sum() >= best_inliers.sum():
+        best_f, best_inliers = refit, refit_inliers
+
+    stats = {
+        'inlier_ratio': best_inliers.mean(),
+        'iterations': iterations,
+    }
+    return best_f / np.linalg.norm(best_f), best_inliers, stats
+
+
+def _eight_point(pts2d_1, pts2d_2):
+    """Solves the eight-point algorithm for one or a stack of point sets.
+
+    F is the right singular vector of the smallest singular value of A^T * A, computed for all the sets as one
+    batched SVD, and is then reduced to rank 2.
+
+    Args:
+        pts2d_1 (numpy.array): normalized 2D points from image 1 of shape (..., k, 2), k >= 8.
+        pts2d_2 (numpy.array): normalized 2D points from image 2 of shape (..., k, 2), k >= 8.
+
+    Returns:
+        numpy.array: rank 2 fundamental matrices of shape (..., 3, 3).
+    """
+    uv1 = np.concatenate((pts2d_1, np.ones(pts2d_1.shape[:-1] + (1,))), axis=-1)
+    # rows [u' * u, u' * v, u', v' * u, v' * v, v', u, v, 1]
+    a = np.concatenate((uv1 * pts2d_2[..., :1], uv1 * pts2d_2[..., 1:], uv1), axis=-1)
+    ata = np.matmul(np.swapaxes(a, -1, -2), a)
+    v_h = np.linalg.svd(ata)[2]
+    f = v_h[..., -1, :].reshape(a.shape[:-2] + (3, 3))
+    return reduce_rank(f)
+
+
+def sampson_distance(f, pts_1, pts_2):
+    """Computes the Sampson distance of every correspondence for one or a stack of fundamental matrices.
+
+    The Sampson distance is the first-order approximation of the squared geometric reprojection error:
+    (p_2^T * F * p_1)^2 / ((F * p_1)_1^2 + (F * p_1)_2^2 + (F^T * p_2)_1^2 + (F^T * p_2)_2^2)
+
+    Args:
+        f (numpy.array): fundamental matrix of shape (3, 3), or a stack of B matrices of shape (B, 3, 3).
+        pts_1 (numpy.array): homogeneous 2D points from image 1 of shape (N, 3).
+        pts_2 (numpy.array): homogeneous 2D points from image 2 of shape (N, 3).
+
+    Returns:
+        numpy.array: squared distances of shape (N,), or (B, N) for a stack of matrices.
+    """
+    f_p1 = np.matmul(f, pts_1.T)
+    ft_p2 = np.matmul(np.swapaxes(f, -1, -2), pts_2.T)
+    numerator = np.square(np.sum(pts_2.T * f_p1, axis=-2))
+    denominator = np.sum(np.square(f_p1[..., :2, :]), axis=-2) + np.sum(np.square(ft_p2[..., :2, :]), axis=-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = numerator / denominator
+    # degenerate hypotheses are never inliers
+    distance[~np.isfinite(distance)] = np.inf
+    return distance
+
+
 def reduce_rank(f):
     """Reduces a full rank (3, 3) matrix to rank 2.
 
     Args:
-        f (numpy.array): full rank fundamental matrix. Must be a (3, 3) array.
+        f (numpy.array): full rank fundamental matrix. Must be a (3, 3) array, or a stack of them of shape
+                         (B, 3, 3).
 
     Returns:
-        numpy.array: rank 2 fundamental matrix. Must be a (3, 3) array.
+        numpy.array: rank 2 fundamental matrix. Must be a (3, 3) array, or (B, 3, 3) for a stack.
     """
     # Single Value Decomposition
     u, s, v_h = np.linalg.svd(f)
     # copy s
     s_prime = s.copy()
     # set the smallest singular value to 0
-    s_prime[2] = 0
-    # recompute F
-    new_f = np.dot(u, np.dot(np.diag(s_prime), v_h))
+    s_prime[..., 2] = 0
+    # recompute F, scaling the columns of u is the same as u * diag(s')
+    new_f = np.matmul(u * s_prime[..., np.newaxis, :], v_h)
     return new_f
 
 
@@ -253,6 +568,73 @@ def get_epipolar_lines(img1_shape, img2_shape, f, pts2d_1, pts2d_2):
     return epipolar_lines_a, epipolar_lines_b
 
 
+def get_epipolar_segments(img1_shape, img2_shape, f, pts2d_1, pts2d_2):
+    """Returns the epipolar lines of two sets of 2D points as segments clipped to the image borders.
+
+    Array-native version of get_epipolar_lines: every line is clipped against the four borders of its image at
+    once, so steep lines end at the top and bottom borders instead of far outside the image.
+
+    Args:
+        img1_shape (tuple): image 1 shape (rows, cols)
+        img2_shape (tuple): image 2 shape (rows, cols)
+        f (numpy.array): Fundamental matrix of shape (3, 3).
+        pts2d_1 (numpy.array): 2D points from image 1 of shape (N, 2). Where N is the number of points.
+        pts2d_2 (numpy.array): 2D points from image 2 of shape (N, 2). Where N is the number of points.
+
+    Returns:
+        tuple: two-element tuple containing:
+               segments_1 (numpy.array): int32 array of shape (N, 2, 2) with the [(x1, y1), (x2, y2)] end points of
+                                         the epipolar lines in image 1.
+               segments_2 (numpy.array): same for image 2.
+               Lines that do not cross their image have both end points set to (-1, -1).
+    """
+    p_1 = np.insert(pts2d_1, pts2d_1.shape[1], [1], axis=1)
+    p_2 = np.insert(pts2d_2, pts2d_2.shape[1], [1], axis=1)
+
+    segments_1 = clip_lines(np.dot(p_2, f), img1_shape)
+    segments_2 = clip_lines(np.dot(p_1, f.T), img2_shape)
+    return segments_1, segments_2
+
+
+def clip_lines(lines, img_shape):
+    """Clips lines a * x + b * y + c = 0 to the image borders.
+
+    Each line is intersected with the four borders x = 0, x = cols - 1, y = 0 and y = rows - 1. The segment end
+    points are the two intersections inside the image that are furthest apart along the line.
+
+    Args:
+        lines (numpy.array): lines (a, b, c) of shape (N, 3).
+        img_shape (tuple): image shape (rows, cols)
+
+    Returns:
+        numpy.array: int32 array of shape (N, 2, 2) with the [(x1, y1), (x2, y2)] end points of each line. Lines
+                     that do not cross the image have both end points set to (-1, -1).
+    """
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 3)
+    a, b, c = lines[:, :1], lines[:, 1:2], lines[:, 2:]
+    x_max, y_max = img_shape[1] - 1., img_shape[0] - 1.
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # (N, 4) intersections with the left, right, top and bottom borders
+        x = np.concatenate((np.zeros_like(a), np.full_like(a, x_max), -c / a, -(b * y_max + c) / a), axis=1)
+        y = np.concatenate((-c / b, -(a * x_max + c) / b, np.zeros_like(b), np.full_like(b, y_max)), axis=1)
+
+    eps = 1e-6
+    inside = (x >= -eps) & (x <= x_max + eps) & (y >= -eps) & (y <= y_max + eps)
+
+    # position of each intersection along the line direction (-b, a)
+    t = x * -b + y * a
+    first = np.argmin(np.where(inside, t, np.inf), axis=1)
+    last = np.argmax(np.where(inside, t, -np.inf), axis=1)
+
+    rows = np.arange(lines.shape[0])
+    segments = np.empty((lines.shape[0], 2, 2))
+    segments[:, 0, 0], segments[:, 0, 1] = x[rows, first], y[rows, first]
+    segments[:, 1, 0], segments[:, 1, 1] = x[rows, last], y[rows, last]
+    segments[~inside.any(axis=1)] = -1
+    return np.rint(segments).astype(np.int32)
+
+
 def compute_t_matrix(pts2d):
     """Computes the transformation matrix T given corresponding 2D points from an image.
 
@@ -279,6 +661,25 @@ def compute_t_matrix(pts2d):
     return t
 
 
+def _normalization_matrix(pts2d):
+    """Computes the Hartley normalization T: centroid at the origin and mean distance sqrt(2) from it.
+
+    Args:
+        pts2d (numpy.array): 2D (u, v) points of shape (N, 2). Where N is the number of points.
+
+    Returns:
+        numpy.array: transformation matrix T of shape (3, 3).
+    """
+    c_u, c_v = np.mean(pts2d, axis=0)
+    mean_distance = np.mean(np.hypot(pts2d[:, 0] - c_u, pts2d[:, 1] - c_v))
+    s = np.sqrt(2) / mean_distance if mean_distance > 0 else 1.
+    return np.array([
+        [s, 0, -s * c_u],
+        [0, s, -s * c_v],
+        [0, 0,        1]
+    ])
+
+
 def normalize_points(pts2d, t):
     """Normalizes 2D points.
 
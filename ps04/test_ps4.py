@@ -0,0 +1,109 @@
+"""
+Tests for the calibration and fundamental matrix functions in ps4.py.
+
+How to run:
+python -m unittest test_ps4
+"""
+
+import unittest
+
+import numpy as np
+
+import benchmark
+import ps4
+
+
+class SolveLeastSquaresBatchTest(unittest.TestCase):
+
+    def test_matches_solve_least_squares(self):
+        scene = benchmark.make_scene(200, noise=0.5, seed=0)
+        subsets = np.random.RandomState(0).rand(32, 200).argsort(axis=1)[:, :8]
+        pts3d, pts2d = scene['pts3d'][subsets], scene['pts2d_1'][subsets]
+
+        ms, errors = ps4.solve_least_squares_batch(pts3d, pts2d)
+        self.assertEqual(ms.shape, (32, 3, 4))
+        self.assertEqual(errors.shape, (32,))
+        for m, error, subset_3d, subset_2d in zip(ms, errors, pts3d, pts2d):
+            expected_m, expected_error = ps4.solve_least_squares(subset_3d, subset_2d)
+            np.testing.assert_allclose(m, expected_m, rtol=1e-6, atol=1e-9)
+            np.testing.assert_allclose(error, expected_error, rtol=1e-6)
+
+    def test_rejects_small_subsets(self):
+        with self.assertRaises(ValueError):
+            ps4.solve_least_squares_batch(np.zeros((4, 5, 3)), np.zeros((4, 5, 2)))
+
+
+class CalibrateCameraRansacTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scene = benchmark.make_scene(500, noise=0.5, outlier_rate=0.3, seed=1)
+
+    def test_ignores_outliers(self):
+        m, inliers, stats = ps4.calibrate_camera_ransac(self.scene['pts3d'], self.scene['pts2d_1'], seed=0)
+        self.assertEqual(m.shape, (3, 4))
+        self.assertGreater(np.mean(inliers == ~self.scene['outliers_1']), 0.99)
+        # the noise free projections of the true inliers, against 0.5 pixels of noise
+        self.assertLess(benchmark._reprojection_errors(self.scene, m).mean(), 0.2)
+        plain = ps4.solve_least_squares(self.scene['pts3d'], self.scene['pts2d_1'])[0]
+        self.assertGreater(benchmark._reprojection_errors(self.scene, plain).mean(), 10)
+
+        self.assertEqual(sorted(stats), ['inlier_ratio', 'iterations', 'max', 'mean', 'median', 'rms'])
+        self.assertEqual(stats['inlier_ratio'], inliers.mean())
+        self.assertLessEqual(stats['max'], 2.)
+
+    def test_iterations(self):
+        pts3d, pts2d = self.scene['pts3d'], self.scene['pts2d_1']
+        # 30% outliers and 6 point subsets need about 45 hypotheses for 0.99 confidence, drawn in batches
+        stats = ps4.calibrate_camera_ransac(pts3d, pts2d, batch_size=8, seed=0)[2]
+        self.assertEqual(stats['iterations'] % 8, 0)
+        self.assertLess(stats['iterations'], 200)
+        stats = ps4.calibrate_camera_ransac(pts3d, pts2d, max_iterations=20, batch_size=8, seed=0)[2]
+        self.assertEqual(stats['iterations'], 20)
+
+    def test_rejects_too_few_points(self):
+        with self.assertRaises(ValueError):
+            ps4.calibrate_camera_ransac(self.scene['pts3d'][:5], self.scene['pts2d_1'][:5])
+
+
+
+class FundamentalMatrixRansacTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scene = benchmark.make_scene(500, noise=0.5, outlier_rate=0.2, seed=2)
+        cls.p_1 = np.insert(cls.scene['clean_1'], 2, 1, axis=1)
+        cls.p_2 = np.insert(cls.scene['clean_2'], 2, 1, axis=1)
+
+    def test_sampson_distance(self):
+        f = self.scene['F']
+        np.testing.assert_allclose(ps4.sampson_distance(f, self.p_1, self.p_2), 0, atol=1e-12)
+
+        # a stack gives the distances of each matrix, which do not depend on the scale of F
+        p_2 = np.insert(self.scene['pts2d_2'], 2, 1, axis=1)
+        distance = ps4.sampson_distance(f, self.p_1, p_2)
+        self.assertGreater(distance.max(), 1)
+        np.testing.assert_allclose(ps4.sampson_distance(np.stack((f, -3 * f)), self.p_1, p_2),
+                                   [distance, distance], rtol=1e-9)
+
+    def test_finds_the_inliers(self):
+        f, inliers, stats = ps4.compute_fundamental_matrix_ransac(self.scene['pts2d_1'], self.scene['pts2d_2'],
+                                                                  seed=0)
+        self.assertEqual(np.linalg.matrix_rank(f), 2)
+        self.assertAlmostEqual(np.linalg.norm(f), 1)
+        self.assertLess(benchmark._sampson_errors(self.scene, f).mean(), 0.5)
+
+        # noisy inliers can be more than 1 pixel off and outliers can fall near their epipolar line
+        true_inliers = ~(self.scene['outliers_1'] | self.scene['outliers_2'])
+        self.assertGreater(np.mean(inliers[true_inliers]), 0.85)
+        self.assertGreater(np.mean(true_inliers[inliers]), 0.98)
+        self.assertEqual(sorted(stats), ['inlier_ratio', 'iterations'])
+        self.assertEqual(stats['inlier_ratio'], inliers.mean())
+
+    def test_rejects_too_few_points(self):
+        with self.assertRaises(ValueError):
+            ps4.compute_fundamental_matrix_ransac(self.scene['pts2d_1'][:7], self.scene['pts2d_2'][:7])
+
+
+if __name__ == '__main__':
+    unittest.main()